@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import sys
 import os
+import csv
 import json
 import asyncio
 import aiohttp
@@ -8,27 +9,102 @@ import urllib.parse
 import urllib.robotparser
 import re
 import argparse
+import bisect
+import hashlib
+import heapq
+import math
+import random
 import time
 import ipaddress
+import signal
 import socket
+import sqlite3
+import ssl
+import zlib
+import contextvars
+import multiprocessing
+import queue
+import threading
+import tempfile
+import resource
+import email.utils
+from array import array
 from collections import deque
 from datetime import datetime, timezone
-from typing import Optional, Dict, Tuple, List
+from typing import Optional, Dict, Tuple, List, Set
 from contextlib import asynccontextmanager
 
+from nodeinfo_archive import NodeInfoArchive, has_archive
+
 USER_AGENT = "fetch-nodeinfo-bot (+https://arewedecentralizedyet.online/)"
 
 REQUEST_TIMEOUT = 10  # seconds
 MAX_CONCURRENT = 30   # concurrent host checks
 DNS_CACHE_TTL_SECS = 10 * 60
 MAX_429_RETRIES = 3
+MAX_503_RETRIES = 2
+RETRY_503_BASE_SECS = 5.0
+RETRY_AFTER_MAX_SECS = 3600.0
+ROBOTS_MAX_BYTES = 500 * 1024
+WELLKNOWN_MAX_BYTES = 64 * 1024
+NODEINFO_MAX_BYTES = 1024 * 1024
+STATE_CHECKPOINT_SECS = 30.0
+DAEMON_TICK_SECS = 60.0
+CONCURRENCY_WINDOW_SECS = 5.0
+WRITER_QUEUE_SIZE = 1000
+WRITER_BATCH_SIZE = 100
+METRICS_INTERVAL_SECS = 15.0
+LOG_WINDOW_SECS = 10.0
+KEEPALIVE_SECS = 30.0
+DRAIN_MAX_BYTES = 16 * 1024
+TLS_SESSION_CACHE_SIZE = 10000
 
 # Globals for config & state
+URL_SCHEME = "https"                  # http only for --benchmark's local farm
+DNS_RESOLVER = None                   # aiohttp resolver replacing system DNS (--benchmark)
+METRICS_FILE: Optional[str] = None    # OpenMetrics textfile, rewritten periodically
+METRICS_PORT: Optional[int] = None    # or served on http://127.0.0.1:PORT/metrics
+LOG_LEVEL = "info"                    # least severe per-request event shown on stderr
+LOG_SAMPLE = 5                        # events shown per class and window; the rest are counted
+LOG_JSONL: Optional[str] = None       # every event at LOG_LEVEL or above, one JSON object per line
 ROBOTS_TTL_SECS: float = 24 * 3600
 NODEINFO_TTL_SECS: float = 24 * 3600
 ERROR_TTL_SECS: float = 6 * 3600
+NODEINFO_LINK_TTL_SECS: float = 30 * 24 * 3600
+REVISIT_ADAPTIVE = False
+REVISIT_MIN_SECS: float = 24 * 3600
+REVISIT_MAX_SECS: float = 14 * 24 * 3600
+REVISIT_GROWTH = 1.5       # interval multiplier after an unchanged fetch
+REVISIT_SHRINK = 0.5       # interval multiplier after a changed fetch
+LOW_CHURN_FACTOR = 4.0     # hosts revisited this many times slower than the minimum
+LOW_CHURN_SHARE = 0.2      # max share of a crawl spent on low-churn hosts
+ERROR_BACKOFF_BASE_SECS: Dict[str, float] = {
+    # first retry delay per error class; doubles with each consecutive failure
+    "dns": 24 * 3600,
+    "tls": 24 * 3600,
+    "timeout": 6 * 3600,
+    "http_4xx": 24 * 3600,
+    "http_5xx": 6 * 3600,
+    "other": 6 * 3600,
+}
+ERROR_BACKOFF_MAX_SECS: float = 30 * 24 * 3600
+DISCOVERY = False          # set by --discover
+DISCOVER_MAX_PENDING = 1000
+PEERS_TTL_SECS: float = 7 * 24 * 3600
+PEERS_MAX_BYTES = 8 * 1024 * 1024
+MAU_TIERS = False          # set when --weights is given
+MAU_HEAD_SHARE = 0.9       # head tier: the largest hosts covering this share of MAU
+MAU_TAIL_TTL_FACTOR = 4.0  # NodeInfo TTL multiplier for everyone else
+mau_tier_of: Dict[str, str] = {}
 
-state_hosts: Dict[str, Dict] = {}
+state_store: Optional["StateStore"] = None
+nodeinfo_archive: Optional[NodeInfoArchive] = None
+# Read-only archive handle for load_snapshot(), opened when first needed
+snapshot_reader: Optional[NodeInfoArchive] = None
+snapshot_reader_lock = threading.Lock()
+# In a shard worker: where disk writes are sent for the coordinator to do
+shard_outbox = None
+shard_forward_results = False
 stats_hosts: Dict[str, Dict] = {}
 
 # ---------------------------------------------------------------------
@@ -45,36 +121,51 @@ def load_hostnames(path: str) -> List[str]:
         raise ValueError("Input JSON must be an array of hostnames")
     return data
 
+def state_db_path(path: str) -> str:
+    """Legacy state.json paths map to a state.sqlite next to them."""
+    if path.endswith(".json"):
+        return path[:-len(".json")] + ".sqlite"
+    return path
+
 def load_state(path: str) -> None:
-    """Load state.json into global `state_hosts`."""
-    global  state_hosts
-    if os.path.exists(path):
+    """Open the state store for `path`, importing a legacy state.json once."""
+    global state_store
+    db_path = state_db_path(path)
+    legacy = None
+    if db_path != path and os.path.exists(path) and not os.path.exists(db_path):
         try:
             with open(path, "r", encoding="utf-8") as f:
-                state_hosts = json.load(f)
+                legacy = json.load(f)
         except Exception as e:
             print(f"# Warning: could not read state file {path}: {e}", file=sys.stderr)
-            state_hosts = {}
-    else:
-        state_hosts = {}
+    state_store = StateStore(db_path)
+    if isinstance(legacy, dict):
+        state_store.import_hosts(legacy)
+        print(f"# Imported {len(legacy)} state entries from {path} into {db_path}", file=sys.stderr)
+    state_store.ensure_due_config()
 
-def save_state(path: str) -> None:
-    global state_hosts
-    """Write state.json"""
-    tmp = path + ".tmp"
+def save_state() -> None:
+    """Write modified host state (and pending archive snapshots) to disk."""
+    if shard_outbox is not None:
+        shard_outbox.put([("state", state_store.take_dirty_rows())])
+        return
+    if nodeinfo_archive is not None:
+        try:
+            nodeinfo_archive.commit()
+        except (OSError, sqlite3.Error) as e:
+            print(f"# Warning: could not commit archive {nodeinfo_archive.path}: {e}", file=sys.stderr)
     try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(state_hosts, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, path)
-    except Exception as e:
-        print(f"# Warning: could not write state file {path}: {e}", file=sys.stderr)
+        state_store.checkpoint()
+    except sqlite3.Error as e:
+        print(f"# Warning: could not write state to {state_store.path}: {e}", file=sys.stderr)
 
 def get_host_state(host: str) -> Dict:
-    hs = state_hosts.get(host)
-    if hs is None:
-        hs = {}
-        state_hosts[host] = hs
-    return hs
+    return state_store.get(host)
+
+def mark_host_dirty(host: str) -> None:
+    if MAU_TIERS:
+        get_host_state(host)["mau_tier"] = mau_tier_of.get(host, "tail")
+    state_store.mark_dirty(host)
 
 def parse_dt(value: Optional[str]) -> Optional[datetime]:
     if not value:
@@ -90,9 +181,12 @@ def get_stats(host: str) -> Dict:
         hs = {
             "requests": 0,
             "success": 0,
+            "not_modified": 0,
             "robots_disallow": 0,
             "network_error": 0,
             "json_error": 0,
+            "oversize": 0,
+            "bad_type": 0,
             "http_statuses": {},
         }
         stats_hosts[host] = hs
@@ -118,6 +212,15 @@ def record_success(host: str) -> None:
     hs = get_stats(host)
     hs["success"] += 1
 
+def record_not_modified(host: str) -> None:
+    hs = get_stats(host)
+    hs["not_modified"] += 1
+
+def record_body_rejected(host: str, kind: str) -> None:
+    """kind is "oversize" or "bad_type"."""
+    hs = get_stats(host)
+    hs[kind] += 1
+
 def record_json_error(host: str) -> None:
     hs = get_stats(host)
     hs["json_error"] += 1
@@ -126,25 +229,164 @@ def host_for_url(url: str) -> str:
     host = urllib.parse.urlparse(url).hostname
     return host or "<no-host>"
 
-WORDPRESS_V4_NETS = [
-    ipaddress.ip_network("192.0.78.0/24"),
-]
+# ---------------------------------------------------------------------
+# Per-key rate limits
+# ---------------------------------------------------------------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(SCRIPT_DIR))
+RATELIMITS_PATH = os.path.join(SCRIPT_DIR, "ratelimits.json")
+GEO_CACHE_PATH = os.path.join(REPO_ROOT, "data", "cache", "ipinfo-cache.json")
+
+# (network or exact key, max requests per second), from RATELIMITS_PATH
+KEY_RATE_LIMITS: List[Tuple[object, float]] = []
+
+def load_ratelimits(path: str) -> List[Tuple[object, float]]:
+    """
+    Read per-provider limits: {"rates": {match: requests_per_second}}.
+    A match that parses as an IP network applies to ip/subnet keys inside
+    (or containing) it; anything else must equal the key, e.g. "AS2635".
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    limits = []
+    for match, rate in (data.get("rates") or {}).items():
+        try:
+            match = ipaddress.ip_network(match, strict=False)
+        except ValueError:
+            pass
+        limits.append((match, float(rate)))
+    return limits
 
-def is_wordpress_key(key: str) -> bool:
+def key_rate_limit(key: str) -> Optional[float]:
+    """The configured rate for `key`, if any (the lowest one that matches)."""
+    net = None
     try:
         net = ipaddress.ip_network(key, strict=False)
-        if net.version != 4:
-            return False
-        return any(net.subnet_of(wp) or wp.subnet_of(net) for wp in WORDPRESS_V4_NETS)
     except ValueError:
         pass
+    rates = []
+    for match, rate in KEY_RATE_LIMITS:
+        if isinstance(match, str):
+            if match == key:
+                rates.append(rate)
+        elif net is not None and net.version == match.version:
+            if net.subnet_of(match) or match.subnet_of(net):
+                rates.append(rate)
+    return min(rates) if rates else None
+
+# ---------------------------------------------------------------------
+# Prefix-to-ASN index (for --ratelimit-key=asn/org)
+# ---------------------------------------------------------------------
+class PrefixIndex:
+    """
+    Longest-prefix match from IP address to (ASN, organisation).
+
+    Prefixes are kept in one dict per prefix length, keyed by the network
+    address as an integer, so a lookup is one masked dict probe per prefix
+    length in use (longest first).
+    """
+
+    def __init__(self):
+        self._tables: Dict[int, Dict[int, Dict[int, Tuple[int, Optional[str]]]]] = {4: {}, 6: {}}
+        self._lengths: Dict[int, List[int]] = {4: [], 6: []}
+
+    def __len__(self) -> int:
+        return sum(len(t) for tables in self._tables.values() for t in tables.values())
+
+    def add(self, prefix: str, asn: int, org: Optional[str] = None) -> None:
+        net = ipaddress.ip_network(prefix, strict=False)
+        tables = self._tables[net.version]
+        if net.prefixlen not in tables:
+            tables[net.prefixlen] = {}
+            self._lengths[net.version] = sorted(tables, reverse=True)
+        tables[net.prefixlen][int(net.network_address)] = (asn, org)
+
+    def lookup(self, addr: str) -> Optional[Tuple[int, Optional[str]]]:
+        try:
+            ip = ipaddress.ip_address(addr)
+        except ValueError:
+            return None
+        bits = ip.max_prefixlen
+        value = int(ip)
+        tables = self._tables[ip.version]
+        for length in self._lengths[ip.version]:
+            mask = ((1 << length) - 1) << (bits - length)
+            hit = tables[length].get(value & mask)
+            if hit is not None:
+                return hit
+        return None
+
+def parse_asn(value) -> Optional[int]:
+    """Accept 24940, "24940" or "AS24940"."""
+    if value is None:
+        return None
+    value = str(value).strip().upper()
+    if value.startswith("AS"):
+        value = value[2:]
     try:
-        addr = ipaddress.ip_address(key)
-        if addr.version != 4:
-            return False
-        return any(addr in wp for wp in WORDPRESS_V4_NETS)
+        return int(value)
     except ValueError:
-        return False
+        return None
+
+def load_asn_table(index: PrefixIndex, path: str) -> int:
+    """
+    Add a prefix-to-ASN table: one "prefix asn [organisation]" per line,
+    separated by whitespace or commas (as in pyasn or CSV exports).
+    Returns the number of prefixes added.
+    """
+    added = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = re.split(r"[,\s]+", line, maxsplit=2)
+            if len(parts) < 2:
+                continue
+            asn = parse_asn(parts[1])
+            if asn is None:
+                continue
+            try:
+                index.add(parts[0], asn, parts[2].strip('"') if len(parts) > 2 else None)
+            except ValueError:
+                continue
+            added += 1
+    return added
+
+def load_geo_cache(index: PrefixIndex, path: str) -> int:
+    """
+    Add the IPinfo cache written by data-fetchers/geo: the announced route
+    when it is known, otherwise the single address. Returns entries added.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        cache = json.load(f)
+    added = 0
+    for ip, details in cache.items():
+        if not isinstance(details, dict):
+            continue
+        asn_info = details.get("asn")
+        asn = None
+        org = None
+        prefix = ip
+        if isinstance(asn_info, dict):
+            asn = parse_asn(asn_info.get("asn"))
+            org = asn_info.get("name")
+            prefix = asn_info.get("route") or ip
+        elif details.get("org"):
+            # Free tier: "org": "AS24940 Hetzner Online GmbH"
+            head, _, name = str(details["org"]).partition(" ")
+            asn = parse_asn(head)
+            org = name or None
+        if asn is None:
+            continue
+        try:
+            index.add(prefix, asn, org)
+        except ValueError:
+            continue
+        added += 1
+    return added
+
+prefix_index: Optional[PrefixIndex] = None
 
 def print_stats(stream=sys.stderr) -> None:
     if not stats_hosts:
@@ -170,21 +412,525 @@ def print_stats(stream=sys.stderr) -> None:
         net_err = hs.get("network_error", 0)
         robots_disallow = hs.get("robots_disallow", 0)
         json_err = hs.get("json_error", 0)
+        not_modified = hs.get("not_modified", 0)
+        rejected = hs.get("oversize", 0) + hs.get("bad_type", 0)
         print(
             f"# {host} {succ}/{reqs} ({rate:.1%})"
-            f" 429={count_429} net_err={net_err} robots={robots_disallow} json_err={json_err}",
+            f" 429={count_429} net_err={net_err} robots={robots_disallow} json_err={json_err}"
+            f" not_modified={not_modified} rejected={rejected}",
             file=stream,
         )
 
+# ---------------------------------------------------------------------
+# Latency histograms
+# ---------------------------------------------------------------------
+LATENCY_STAGES = ("dns", "connect", "ttfb", "body", "total")
+LATENCY_PERCENTILES = (0.5, 0.9, 0.99)
+
+# Rate-limit key of the host being fetched, set by the dispatcher so
+# requests can be attributed to it.
+current_rate_key: contextvars.ContextVar = contextvars.ContextVar("current_rate_key", default=None)
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of durations: microsecond values are bucketed by
+    their top SUB_BITS bits, so every bucket is within ~3% of its values
+    whatever the magnitude. Buckets are kept sparse.
+    """
+
+    SUB_BITS = 5
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.max_us = 0
+
+    @classmethod
+    def _bucket(cls, value_us: int) -> int:
+        shift = max(0, value_us.bit_length() - cls.SUB_BITS)
+        return (shift << 8) | (value_us >> shift)
+
+    @staticmethod
+    def _value(bucket: int) -> int:
+        shift, top = bucket >> 8, bucket & 0xFF
+        return (top << shift) + ((1 << shift) >> 1)
+
+    def record(self, seconds: float) -> None:
+        value_us = max(0, int(seconds * 1e6))
+        bucket = self._bucket(value_us)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.max_us = max(self.max_us, value_us)
+
+    def merge(self, buckets: Dict[int, int], count: int, max_us: int) -> None:
+        for bucket, n in buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + n
+        self.count += count
+        self.max_us = max(self.max_us, max_us)
+
+    def percentile(self, q: float) -> float:
+        """Value at quantile `q` (0-1) in seconds; 0 when empty."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self._value(bucket), self.max_us) / 1e6
+        return self.max_us / 1e6
+
+    def summary(self) -> Dict:
+        out = {"count": self.count, "max_ms": round(self.max_us / 1000.0, 3)}
+        for q in LATENCY_PERCENTILES:
+            out[f"p{q * 100:g}_ms"] = round(self.percentile(q) * 1000.0, 3)
+        return out
+
+class LatencyStats:
+    """
+    Histograms per request stage, overall and broken down by status class
+    ("2xx", "4xx", "timeout", ...) and by rate-limit key.
+    """
+
+    def __init__(self):
+        self.overall: Dict[str, LatencyHistogram] = {}
+        self.by_status: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.by_key: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    @staticmethod
+    def _hist(table: Dict, name) -> LatencyHistogram:
+        hist = table.get(name)
+        if hist is None:
+            hist = table[name] = LatencyHistogram()
+        return hist
+
+    def record(self, stage: str, seconds: float, status_class: str, key: Optional[str]) -> None:
+        self._hist(self.overall, stage).record(seconds)
+        self._hist(self.by_status, (stage, status_class)).record(seconds)
+        if key is not None:
+            self._hist(self.by_key, (stage, key)).record(seconds)
+
+    def dump(self) -> Dict:
+        """Plain-data copy for merge() in another process."""
+        return {
+            table: {name: (hist.buckets, hist.count, hist.max_us) for name, hist in getattr(self, table).items()}
+            for table in ("overall", "by_status", "by_key")
+        }
+
+    def merge(self, dumped: Dict) -> None:
+        for table, hists in dumped.items():
+            mine = getattr(self, table)
+            for name, (buckets, count, max_us) in hists.items():
+                self._hist(mine, name).merge(buckets, count, max_us)
+
+    def status_line(self) -> str:
+        parts = []
+        for stage in LATENCY_STAGES:
+            hist = self.overall.get(stage)
+            if hist is None or not hist.count:
+                continue
+            p50, p90, p99 = (hist.percentile(q) * 1000.0 for q in LATENCY_PERCENTILES)
+            parts.append(f"{stage}={p50:.0f}/{p90:.0f}/{p99:.0f}")
+        return "# Latency p50/p90/p99 ms: " + (" ".join(parts) if parts else "no requests")
+
+    def report(self, max_keys: int = 0) -> Dict:
+        """
+        JSON-able summary. Keys are ordered by their p90 total time,
+        slowest first, and cut to `max_keys` (0 = all).
+        """
+        keys = sorted(
+            {key for stage, key in self.by_key if stage == "total"},
+            key=lambda k: self.by_key[("total", k)].percentile(0.9),
+            reverse=True,
+        )
+        if max_keys > 0:
+            keys = keys[:max_keys]
+        return {
+            "stages": {stage: hist.summary() for stage, hist in self.overall.items()},
+            "by_status": {
+                status: {
+                    stage: hist.summary()
+                    for (stage, s), hist in self.by_status.items() if s == status
+                }
+                for status in sorted({s for _, s in self.by_status})
+            },
+            "by_key": {
+                key: {
+                    stage: hist.summary()
+                    for stage in LATENCY_STAGES
+                    for hist in [self.by_key.get((stage, key))] if hist is not None
+                }
+                for key in keys
+            },
+        }
+
+latency_stats = LatencyStats()
+
+def make_trace_config() -> aiohttp.TraceConfig:
+    """
+    Trace hooks that note when each stage of a request ends in the dict
+    passed as trace_request_ctx. DNS and connection setup are summed, since
+    a redirect can need more than one. aiohttp reports TCP connect and the
+    TLS handshake together, so "connect" covers both.
+    """
+
+    def timed(name: str, end: bool):
+        async def hook(session, ctx, params) -> None:
+            timing = ctx.trace_request_ctx
+            if timing is None:
+                return
+            now = time.monotonic()
+            if end:
+                begun = timing.pop(name + "_start", None)
+                if begun is not None:
+                    timing[name] = timing.get(name, 0.0) + now - begun
+                    timing["ready"] = now
+            else:
+                timing[name + "_start"] = now
+        return hook
+
+    async def on_headers(session, ctx, params) -> None:
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx["headers"] = time.monotonic()
+
+    async def on_connection_created(session, ctx, params) -> None:
+        connection_stats["connections_opened"] += 1
+
+    async def on_connection_reused(session, ctx, params) -> None:
+        connection_stats["connections_reused"] += 1
+
+    trace = aiohttp.TraceConfig()
+    trace.on_dns_resolvehost_start.append(timed("dns", False))
+    trace.on_dns_resolvehost_end.append(timed("dns", True))
+    trace.on_connection_create_start.append(timed("connect", False))
+    trace.on_connection_create_end.append(timed("connect", True))
+    trace.on_connection_create_end.append(on_connection_created)
+    trace.on_connection_reuseconn.append(on_connection_reused)
+    trace.on_request_end.append(on_headers)
+    return trace
+
+def record_latency(timing: Dict, start: float, end: float, status_class: str) -> None:
+    key = current_rate_key.get()
+    for stage in ("dns", "connect"):
+        if stage in timing:
+            latency_stats.record(stage, timing[stage], status_class, key)
+    headers = timing.get("headers")
+    if headers is not None:
+        # From the connection being ready (or reused) to the response headers
+        latency_stats.record("ttfb", headers - timing.get("ready", start), status_class, key)
+        latency_stats.record("body", end - headers, status_class, key)
+    latency_stats.record("total", end - start, status_class, key)
+
+# ---------------------------------------------------------------------
+# Connection reuse and TLS session resumption
+# ---------------------------------------------------------------------
+CONNECTION_COUNTERS = (
+    ("connections_opened", "New TCP connections (each with a TLS handshake for https)"),
+    ("connections_reused", "Requests sent on a pooled keep-alive connection"),
+    ("tls_full", "TLS handshakes without session resumption"),
+    ("tls_resumed", "TLS handshakes that resumed an earlier session"),
+)
+connection_stats: Dict[str, int] = {name: 0 for name, _ in CONNECTION_COUNTERS}
+
+class ResumingTLSContext(ssl.SSLContext):
+    """
+    Client context that offers the last TLS session seen for a server name
+    when it opens a new connection to it, so a reconnect (after keep-alive
+    expiry, a redirect back, or a daemon revisit) can skip the full handshake.
+
+    asyncio has no way to pass a session in, so wrap_bio() does it; the
+    session is picked up by collect() once a request on the connection has
+    completed, which is after TLS 1.3 servers send their tickets.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._sessions: Dict[str, ssl.SSLSession] = {}
+        self._fresh: List[Tuple[float, ssl.SSLObject]] = []
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and server_hostname:
+            session = self._sessions.get(server_hostname)
+        try:
+            obj = super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+        except ValueError:
+            # Session from a server with different settings; start afresh
+            self._sessions.pop(server_hostname, None)
+            obj = super().wrap_bio(incoming, outgoing, server_side, server_hostname)
+        self._fresh.append((time.monotonic(), obj))
+        return obj
+
+    def collect(self) -> None:
+        """Count finished handshakes and remember their sessions."""
+        now = time.monotonic()
+        pending = []
+        for created, obj in self._fresh:
+            if obj.version() is None:
+                # Still handshaking, or failed and about to be dropped
+                if now - created < REQUEST_TIMEOUT * 2:
+                    pending.append((created, obj))
+                continue
+            connection_stats["tls_resumed" if obj.session_reused else "tls_full"] += 1
+            session = obj.session
+            if session is not None and obj.server_hostname:
+                self._sessions.pop(obj.server_hostname, None)
+                self._sessions[obj.server_hostname] = session
+                if len(self._sessions) > TLS_SESSION_CACHE_SIZE:
+                    # dicts keep insertion order: drop the least recent
+                    del self._sessions[next(iter(self._sessions))]
+        self._fresh = pending
+
+# Shared by every connection of the crawl session
+tls_context: Optional[ResumingTLSContext] = None
+
+def make_tls_context() -> ResumingTLSContext:
+    """Like ssl.create_default_context(), with session resumption."""
+    context = ResumingTLSContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_default_certs()
+    return context
+
+async def drain_small_body(resp: aiohttp.ClientResponse) -> None:
+    """
+    Read what is left of a short body the caller did not want (an error
+    page, say), so the connection goes back to the pool instead of being
+    closed. Larger or unsized bodies are abandoned.
+    """
+    if resp.closed or resp.content.at_eof():
+        return
+    length = resp.content_length
+    if length is None or length > DRAIN_MAX_BYTES:
+        return
+    try:
+        await resp.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+
+def connection_status_line() -> str:
+    c = connection_stats
+    saved = c["connections_reused"] + c["tls_resumed"]
+    return (
+        f"# Connections: opened={c['connections_opened']} reused={c['connections_reused']}"
+        f" tls_full={c['tls_full']} tls_resumed={c['tls_resumed']} handshakes_saved={saved}"
+    )
+
+def merge_connection_stats(other: Dict[str, int]) -> None:
+    for name, value in other.items():
+        connection_stats[name] = connection_stats.get(name, 0) + value
+
+# ---------------------------------------------------------------------
+# OpenMetrics export
+# ---------------------------------------------------------------------
+METRICS_PREFIX = "fetch_nodeinfo"
+
+# stats_hosts field -> (counter name, help)
+METRICS_COUNTERS = (
+    ("requests", "requests", "HTTP requests sent (including failed ones)"),
+    ("success", "successes", "Successful JSON fetches"),
+    ("not_modified", "not_modified", "Fetches answered from cache after a 304"),
+    ("robots_disallow", "robots_disallows", "URLs skipped because robots.txt disallows them"),
+    ("network_error", "network_errors", "Requests that failed without an HTTP response"),
+    ("json_error", "json_errors", "Responses that were not valid JSON"),
+)
+
+def metrics_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_metrics(gauges: Dict[str, Tuple[float, str]]) -> str:
+    """
+    OpenMetrics text for the crawl counters in stats_hosts (summed over
+    hosts, to keep cardinality bounded), the given gauges ({name: (value,
+    help)}) and latency percentiles per stage.
+    """
+    totals = {field: 0 for field, _, _ in METRICS_COUNTERS}
+    rejected = {"oversize": 0, "bad_type": 0}
+    statuses: Dict[str, int] = {}
+    for hs in list(stats_hosts.values()):
+        for field in totals:
+            totals[field] += hs.get(field, 0)
+        for reason in rejected:
+            rejected[reason] += hs.get(reason, 0)
+        for status, n in hs.get("http_statuses", {}).items():
+            statuses[status] = statuses.get(status, 0) + n
+
+    lines = []
+
+    def family(name: str, mtype: str, help_text: str, samples: List[Tuple[str, str, float]]) -> None:
+        full = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# TYPE {full} {mtype}")
+        lines.append(f"# HELP {full} {help_text}")
+        for suffix, labels, value in samples:
+            lines.append(f"{full}{suffix}{labels} {value}")
+
+    for field, name, help_text in METRICS_COUNTERS:
+        family(name, "counter", help_text, [("_total", "", totals[field])])
+    family(
+        "http_responses", "counter", "HTTP responses by status code",
+        [("_total", f'{{code="{metrics_label(code)}"}}', n) for code, n in sorted(statuses.items())],
+    )
+    family(
+        "rejected_bodies", "counter", "Response bodies refused for size or content type",
+        [("_total", f'{{reason="{reason}"}}', n) for reason, n in sorted(rejected.items())],
+    )
+    for name, help_text in CONNECTION_COUNTERS:
+        family(name, "counter", help_text, [("_total", "", connection_stats[name])])
+    family("hosts_seen", "gauge", "Hosts with at least one request this run", [("", "", len(stats_hosts))])
+    for name, (value, help_text) in sorted(gauges.items()):
+        family(name, "gauge", help_text, [("", "", value)])
+    samples = []
+    for stage in LATENCY_STAGES:
+        hist = latency_stats.overall.get(stage)
+        if hist is None or not hist.count:
+            continue
+        for q in LATENCY_PERCENTILES:
+            samples.append(("", f'{{stage="{stage}",quantile="{q:g}"}}', hist.percentile(q)))
+    family("request_stage_seconds", "gauge", "Request latency percentiles by stage", samples)
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def write_metrics_file(path: str, text: str) -> None:
+    """Replace `path` atomically, so a collector never reads half a file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+async def start_metrics_server(port: int, gauges) -> "aiohttp.web.AppRunner":
+    """Serve render_metrics(gauges()) on http://127.0.0.1:port/metrics."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            text=render_metrics(gauges()),
+            headers={"Content-Type": "application/openmetrics-text; version=1.0.0; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+# ---------------------------------------------------------------------
+# Crawl event log
+# ---------------------------------------------------------------------
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+class EventLog:
+    """
+    Background thread for per-request messages (HTTP errors, network
+    failures, rejected bodies, ...), so a crawl over many dead hosts does
+    not do one unbuffered stderr write per failure on the event loop.
+
+    Events are grouped by class (e.g. "HTTP 404", "TimeoutError"). In each
+    LOG_WINDOW_SECS window only the first LOG_SAMPLE events of a class are
+    printed, followed at the end of the window by a line counting the rest.
+    With a JSONL path, every event is also appended there in full.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None):
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._threshold = LOG_LEVELS[LOG_LEVEL]
+        self._jsonl = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        self._counts: Dict[str, int] = {}
+        self._window_start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def emit(self, level: str, cls: str, message: str, fields: Dict) -> None:
+        if LOG_LEVELS[level] >= self._threshold:
+            self._queue.put((time.time(), level, cls, message, fields))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        if self._jsonl is not None:
+            self._jsonl.close()
+
+    def _summaries(self) -> List[str]:
+        lines = []
+        elapsed = time.monotonic() - self._window_start
+        for cls, count in sorted(self._counts.items(), key=lambda item: -item[1]):
+            if count > LOG_SAMPLE:
+                lines.append(
+                    f"# {count} {cls} in the last {elapsed:.0f}s ({count - LOG_SAMPLE} not shown)\n"
+                )
+        self._counts = {}
+        self._window_start = time.monotonic()
+        return lines
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            wait = max(0.0, self._window_start + LOG_WINDOW_SECS - time.monotonic())
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=wait))
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            records = []
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                ts, level, cls, message, fields = item
+                count = self._counts.get(cls, 0) + 1
+                self._counts[cls] = count
+                if count <= LOG_SAMPLE:
+                    prefix = "" if level == "info" else f"{level.capitalize()}: "
+                    lines.append(f"# {prefix}{message}\n")
+                if self._jsonl is not None:
+                    record = {
+                        "ts": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+                        "level": level,
+                        "class": cls,
+                        "message": message,
+                    }
+                    record.update(fields)
+                    records.append(json.dumps(record, ensure_ascii=False) + "\n")
+            if stop or time.monotonic() >= self._window_start + LOG_WINDOW_SECS:
+                lines.extend(self._summaries())
+            if lines:
+                sys.stderr.write("".join(lines))
+                sys.stderr.flush()
+            if records:
+                self._jsonl.write("".join(records))
+                self._jsonl.flush()
+
+event_log: Optional[EventLog] = None
+
+def log_event(level: str, cls: str, message: str, **fields) -> None:
+    """
+    Report a per-request event of class `cls` ("HTTP 503", "json_error",
+    ...). Printed directly when no EventLog is running.
+    """
+    if event_log is not None:
+        event_log.emit(level, cls, message, fields)
+    elif LOG_LEVELS[level] >= LOG_LEVELS[LOG_LEVEL]:
+        prefix = "" if level == "info" else f"{level.capitalize()}: "
+        print(f"# {prefix}{message}", file=sys.stderr)
+
 # ---------------------------------------------------------------------
 # Concurrency-limited session
 # ---------------------------------------------------------------------
+# Set while a task holds a RateLimitedSession slot for a whole host
+holding_slot: contextvars.ContextVar = contextvars.ContextVar("holding_slot", default=False)
+
 class RateLimitedSession:
     """
-    Thin wrapper around aiohttp.ClientSession enforcing a global concurrency limit.
+    Thin wrapper around aiohttp.ClientSession enforcing a global concurrency
+    limit, and timing each request's stages into latency_stats.
+
+    Inside `async with session.slot():` the limit is taken once for all the
+    requests made, so a host's robots.txt, well-known and NodeInfo requests
+    run back to back on one kept-alive connection.
     """
 
     def __init__(self, sem, *args, **kwargs):
+        kwargs["trace_configs"] = list(kwargs.get("trace_configs") or []) + [make_trace_config()]
         self._session = aiohttp.ClientSession(*args, **kwargs)
         self._sem = sem
         self._sem_waiters = 0
@@ -202,20 +948,68 @@ class RateLimitedSession:
         async with self._sem_lock:
             return self._sem_waiters
 
+    async def _acquire(self) -> None:
+        await self._inc_sem_waiters()
+        try:
+            await self._sem.acquire()
+        finally:
+            await self._dec_sem_waiters()
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._sem is None or holding_slot.get():
+            yield
+            return
+        await self._acquire()
+        token = holding_slot.set(True)
+        try:
+            yield
+        finally:
+            holding_slot.reset(token)
+            self._sem.release()
+
     @asynccontextmanager
     async def request(self, method, url, **kwargs):
-        if self._sem is not None:
-            await self._inc_sem_waiters()
-            try:
-                await self._sem.acquire()
-            finally:
-                await self._dec_sem_waiters()
+        sem = None if holding_slot.get() else self._sem
+        if sem is not None:
+            await self._acquire()
+        # A ConcurrencyController also wants to see latencies and timeouts,
+        # one outcome per request
+        record = getattr(self._sem, "record", None)
+        timing: Dict[str, float] = {}
+        status_class = "error"
+        start = time.monotonic()
+        headers_latency: Optional[float] = None
+        timed_out = False
         try:
-            async with self._session.request(method, url, **kwargs) as resp:
-                yield resp
+            async with self._session.request(method, url, trace_request_ctx=timing, **kwargs) as resp:
+                status_class = f"{resp.status // 100}xx"
+                headers_latency = time.monotonic() - start
+                try:
+                    yield resp
+                finally:
+                    # The caller reads the body inside the block
+                    record_latency(timing, start, time.monotonic(), status_class)
+                    await drain_small_body(resp)
+        except asyncio.TimeoutError:
+            timed_out = True
+            if status_class == "error":
+                record_latency(timing, start, time.monotonic(), "timeout")
+            raise
+        except aiohttp.ClientError:
+            if status_class == "error":
+                record_latency(timing, start, time.monotonic(), status_class)
+            raise
         finally:
-            if self._sem is not None:
-                self._sem.release()
+            if record is not None:
+                if timed_out:
+                    record(time.monotonic() - start, True)
+                elif headers_latency is not None:
+                    record(headers_latency, False)
+            if tls_context is not None:
+                tls_context.collect()
+            if sem is not None:
+                sem.release()
 
     @asynccontextmanager
     async def get(self, url, **kwargs):
@@ -241,6 +1035,133 @@ class RateLimitedSession:
     def connector(self):
         return self._session.connector
 
+class ConcurrencyController:
+    """
+    Global AIMD limit on in-flight requests, usable as the semaphore of a
+    RateLimitedSession.
+
+    Every `window` seconds it looks at the p90 latency, the timeout rate,
+    event-loop lag and open file descriptors. If any of them shows stress
+    the limit is cut multiplicatively; otherwise, if requests had to wait
+    for a slot, it grows additively. The limit stays within
+    [min_limit, max_limit].
+    """
+
+    TIMEOUT_RATE_MAX = 0.2
+    LOOP_LAG_MAX = 0.25         # seconds
+    LATENCY_FACTOR_MAX = 3.0    # p90 relative to the best p90 seen
+    FD_SHARE_MAX = 0.8          # of RLIMIT_NOFILE
+    INCREASE_STEP = 2
+    DECREASE_FACTOR = 0.7
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, window: float = CONCURRENCY_WINDOW_SECS):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, initial))
+        self.window = window
+        self._inflight = 0
+        self._waiters: deque = deque()
+        self._latencies: List[float] = []
+        self._timeouts = 0
+        self._waited = False
+        self._max_lag = 0.0
+        self._baseline_p90: Optional[float] = None
+        self.last_reason = "start"
+        try:
+            self._fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        except ValueError:
+            self._fd_limit = 0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def acquire(self) -> None:
+        while self._inflight >= self.limit:
+            self._waited = True
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done():
+                    # We were woken but will not use the slot; pass it on
+                    self._wake()
+                raise
+        self._inflight += 1
+
+    def release(self) -> None:
+        self._inflight = max(0, self._inflight - 1)
+        self._wake()
+
+    def _wake(self) -> None:
+        free = self.limit - self._inflight
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    def record(self, latency: float, timed_out: bool) -> None:
+        if timed_out:
+            self._timeouts += 1
+        else:
+            self._latencies.append(latency)
+
+    def _open_fds(self) -> int:
+        try:
+            return len(os.listdir("/proc/self/fd"))
+        except OSError:
+            return 0
+
+    def adjust(self) -> None:
+        samples = len(self._latencies) + self._timeouts
+        p90 = None
+        if self._latencies:
+            ordered = sorted(self._latencies)
+            p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+            if self._baseline_p90 is None or p90 < self._baseline_p90:
+                self._baseline_p90 = p90
+            else:
+                # Let the baseline drift up slowly as conditions change
+                self._baseline_p90 *= 1.02
+
+        reason = None
+        if samples >= 10 and self._timeouts / samples > self.TIMEOUT_RATE_MAX:
+            reason = "timeouts"
+        elif self._max_lag > self.LOOP_LAG_MAX:
+            reason = "loop_lag"
+        elif self._fd_limit and self._open_fds() > self._fd_limit * self.FD_SHARE_MAX:
+            reason = "fds"
+        elif p90 is not None and self._baseline_p90 and p90 > self._baseline_p90 * self.LATENCY_FACTOR_MAX:
+            reason = "latency"
+
+        if reason is not None:
+            self.limit = max(self.min_limit, int(self.limit * self.DECREASE_FACTOR))
+            self.last_reason = reason
+        elif self._waited:
+            self.limit = min(self.max_limit, self.limit + self.INCREASE_STEP)
+            self.last_reason = "increase"
+            self._wake()
+
+        self._latencies = []
+        self._timeouts = 0
+        self._waited = False
+        self._max_lag = 0.0
+
+    async def run(self) -> None:
+        """Sample event-loop lag and adjust the limit once per window."""
+        tick = 0.1
+        next_adjust = time.monotonic() + self.window
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+            self._max_lag = max(self._max_lag, now - before - tick)
+            if now >= next_adjust:
+                self.adjust()
+                next_adjust = now + self.window
+
 class RateLimitKeyer:
     def __init__(
         self,
@@ -248,8 +1169,10 @@ class RateLimitKeyer:
         subnet_bits_v4: int,
         subnet_bits_v6: int,
         cache_ttl: float = DNS_CACHE_TTL_SECS,
+        prefixes: Optional[PrefixIndex] = None,
     ):
         self._mode = mode
+        self._prefixes = prefixes
         self._subnet_bits_v4 = subnet_bits_v4
         self._subnet_bits_v6 = subnet_bits_v6
         self._cache_ttl = cache_ttl
@@ -287,18 +1210,25 @@ class RateLimitKeyer:
             self._cache[host] = (expires_at, key)
 
     async def _resolve_key(self, host: str) -> str:
-        loop = asyncio.get_running_loop()
-        try:
-            infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
-        except socket.gaierror:
-            return host
-
+        hostname = urllib.parse.urlsplit("//" + host).hostname or host
         addrs = []
-        for family, _, _, _, sockaddr in infos:
-            if family == socket.AF_INET:
-                addrs.append(sockaddr[0])
-            elif family == socket.AF_INET6:
-                addrs.append(sockaddr[0])
+        if DNS_RESOLVER is not None:
+            try:
+                infos = await DNS_RESOLVER.resolve(hostname, 0, socket.AF_UNSPEC)
+            except OSError:
+                return host
+            addrs = [info["host"] for info in infos]
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                infos = await loop.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+            except socket.gaierror:
+                return host
+            for family, _, _, _, sockaddr in infos:
+                if family == socket.AF_INET:
+                    addrs.append(sockaddr[0])
+                elif family == socket.AF_INET6:
+                    addrs.append(sockaddr[0])
 
         if not addrs:
             return host
@@ -306,6 +1236,17 @@ class RateLimitKeyer:
         if self._mode == "ip":
             return sorted(addrs)[0]
 
+        if self._mode in ("asn", "org") and self._prefixes is not None:
+            for addr in sorted(addrs):
+                hit = self._prefixes.lookup(addr)
+                if hit is None:
+                    continue
+                asn, org = hit
+                if self._mode == "org" and org:
+                    return org
+                return f"AS{asn}"
+            # Not in the routing table: fall back to the subnet key
+
         networks = []
         for addr in addrs:
             try:
@@ -318,27 +1259,715 @@ class RateLimitKeyer:
                 net = ipaddress.ip_network(f"{addr}/{self._subnet_bits_v6}", strict=False)
             networks.append(str(net))
 
-        if not networks:
-            return host
+        if not networks:
+            return host
+
+        return sorted(networks)[0]
+
+# ---------------------------------------------------------------------
+# Crawl state store
+# ---------------------------------------------------------------------
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    nodeinfo_due REAL NOT NULL DEFAULT 0,
+    robots_due REAL NOT NULL DEFAULT 0,
+    error_due REAL NOT NULL DEFAULT 0,
+    due_at REAL NOT NULL DEFAULT 0,
+    last_success REAL,
+    revisit REAL
+);
+CREATE INDEX IF NOT EXISTS hosts_due_at ON hosts (due_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    host TEXT PRIMARY KEY,
+    source TEXT,
+    discovered REAL NOT NULL
+);
+"""
+
+def nodeinfo_fingerprint(nodeinfo: object) -> str:
+    """The parts of a NodeInfo document whose changes we care about."""
+    ni = nodeinfo if isinstance(nodeinfo, dict) else {}
+    software = ni.get("software") if isinstance(ni.get("software"), dict) else {}
+    usage = ni.get("usage") if isinstance(ni.get("usage"), dict) else {}
+    users = usage.get("users") if isinstance(usage.get("users"), dict) else {}
+    return json.dumps([
+        software.get("name"),
+        software.get("version"),
+        users.get("total"),
+        users.get("activeMonth"),
+        usage.get("localPosts"),
+    ])
+
+def revisit_secs(nodeinfo_state: Dict) -> float:
+    """Current revisit interval for a host, within the configured bounds."""
+    interval = nodeinfo_state.get("revisit_secs")
+    if not isinstance(interval, (int, float)):
+        interval = REVISIT_MIN_SECS
+    return min(REVISIT_MAX_SECS, max(REVISIT_MIN_SECS, float(interval)))
+
+def update_revisit(nodeinfo_state: Dict, nodeinfo: object, now: datetime) -> None:
+    """
+    Adapt a host's revisit interval after a successful fetch: it shrinks
+    when the fingerprint changed since the previous fetch and grows while
+    it stays the same.
+    """
+    fingerprint = nodeinfo_fingerprint(nodeinfo)
+    interval = revisit_secs(nodeinfo_state)
+    previous = nodeinfo_state.get("fingerprint")
+    if previous is None:
+        pass
+    elif previous != fingerprint:
+        interval *= REVISIT_SHRINK
+        nodeinfo_state["last_change"] = now.isoformat()
+    else:
+        interval *= REVISIT_GROWTH
+    nodeinfo_state["fingerprint"] = fingerprint
+    nodeinfo_state["revisit_secs"] = min(REVISIT_MAX_SECS, max(REVISIT_MIN_SECS, interval))
+
+def is_low_churn(revisit: Optional[float]) -> bool:
+    return (
+        REVISIT_ADAPTIVE
+        and REVISIT_MIN_SECS > 0
+        and revisit is not None
+        and revisit >= REVISIT_MIN_SECS * LOW_CHURN_FACTOR
+    )
+
+def host_due_times(host_state: Dict) -> Tuple[float, float, float]:
+    """
+    Epoch times before which a host is skipped, as
+    (nodeinfo_due, robots_due, error_due); 0 means no constraint.
+    """
+    nodeinfo_state = host_state.get("nodeinfo") or {}
+    robots_state = host_state.get("robots") or {}
+
+    nodeinfo_due = 0.0
+    nodeinfo_ttl = NODEINFO_TTL_SECS
+    if MAU_TIERS and host_state.get("mau_tier") == "tail":
+        nodeinfo_ttl *= MAU_TAIL_TTL_FACTOR
+    last_checked = parse_dt(nodeinfo_state.get("last_checked"))
+    if last_checked is not None and nodeinfo_ttl > 0:
+        nodeinfo_due = last_checked.timestamp() + nodeinfo_ttl
+    if REVISIT_ADAPTIVE:
+        last_success = last_success_from_state(host_state)
+        if last_success is not None:
+            nodeinfo_due = max(nodeinfo_due, last_success.timestamp() + revisit_secs(nodeinfo_state))
+
+    robots_due = 0.0
+    robots_checked = parse_dt(robots_state.get("last_checked"))
+    if robots_state.get("allowed") is False and robots_checked is not None and ROBOTS_TTL_SECS > 0:
+        robots_due = robots_checked.timestamp() + ROBOTS_TTL_SECS
+
+    # The per-class backoff applies even when the flat error TTL is off
+    error_due = 0.0
+    last_error = parse_dt(nodeinfo_state.get("last_error"))
+    error_wait = max(ERROR_TTL_SECS, error_backoff_secs(nodeinfo_state))
+    if last_error is not None and error_wait > 0:
+        error_due = last_error.timestamp() + error_wait
+
+    return nodeinfo_due, robots_due, error_due
+
+# Bump when host_due_times computes due times differently
+DUE_RULES_VERSION = 2
+
+def due_config() -> str:
+    """Settings that host_due_times depends on; a change forces a recompute."""
+    return json.dumps([
+        DUE_RULES_VERSION,
+        NODEINFO_TTL_SECS,
+        ROBOTS_TTL_SECS,
+        ERROR_TTL_SECS,
+        REVISIT_ADAPTIVE,
+        REVISIT_MIN_SECS,
+        REVISIT_MAX_SECS,
+        MAU_TIERS and MAU_TAIL_TTL_FACTOR,
+        ERROR_BACKOFF_BASE_SECS,
+        ERROR_BACKOFF_MAX_SECS,
+    ])
+
+# ---------------------------------------------------------------------
+# Error backoff
+# ---------------------------------------------------------------------
+DNS_ERROR_MARKERS = (
+    "DNSError", "Name or service not known", "nodename nor servname",
+    "No address associated", "Temporary failure in name resolution",
+)
+TLS_ERROR_MARKERS = ("SSL", "Certificate", "certificate")
+
+def error_class(status: str, error_str: Optional[str]) -> Optional[str]:
+    """
+    Backoff class of a failed fetch, from process_host's status and error
+    string. None for robots.txt refusals, which have their own TTL.
+    """
+    if status == "ok":
+        return None
+    err = error_str or ""
+    if err.startswith("disallowed by robots"):
+        return None
+    if any(marker in err for marker in DNS_ERROR_MARKERS):
+        return "dns"
+    if any(marker in err for marker in TLS_ERROR_MARKERS):
+        return "tls"
+    if "Timeout" in err:
+        return "timeout"
+    match = re.match(r"HTTP (\d)\d\d", err)
+    if match:
+        # 429 is a server asking us to slow down, not a broken host
+        if match.group(1) == "4" and not err.startswith("HTTP 429"):
+            return "http_4xx"
+        return "http_5xx"
+    return "other"
+
+def record_failure(nodeinfo_state: Dict, status: str, error_str: Optional[str]) -> None:
+    """Count a consecutive failure of the host's current error class."""
+    cls = error_class(status, error_str)
+    if cls is None:
+        return
+    nodeinfo_state["failures"] = int(nodeinfo_state.get("failures") or 0) + 1
+    nodeinfo_state["error_class"] = cls
+
+def error_backoff_secs(nodeinfo_state: Dict) -> float:
+    """Base interval of the error class doubled per consecutive failure, capped."""
+    failures = int(nodeinfo_state.get("failures") or 0)
+    base = ERROR_BACKOFF_BASE_SECS.get(nodeinfo_state.get("error_class"))
+    if failures <= 0 or not base:
+        return 0.0
+    return min(ERROR_BACKOFF_MAX_SECS, base * 2 ** min(failures - 1, 32))
+
+def parse_backoff(value: str) -> Dict[str, float]:
+    """Parse "dns=24,timeout=6" (hours) into a copy of ERROR_BACKOFF_BASE_SECS."""
+    bases = dict(ERROR_BACKOFF_BASE_SECS)
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, sep, hours = item.partition("=")
+        name = name.strip()
+        if not sep or name not in bases:
+            raise ValueError(f"unknown error class in {item!r}; expected one of {', '.join(bases)}")
+        bases[name] = max(0.0, float(hours)) * 3600.0
+    return bases
+
+# ---------------------------------------------------------------------
+# MAU weights and freshness tiers
+# ---------------------------------------------------------------------
+def load_mau_weights(path: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Monthly active users per host from a parse-nodeinfo.py CSV, or from the
+    newest CSV in a directory of them (e.g. data/fedi-mau). Returns the
+    file actually read and {host: active_month}.
+    """
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.endswith(".csv"))
+        if not names:
+            raise ValueError(f"no CSV files in {path}")
+        path = os.path.join(path, names[-1])
+    weights: Dict[str, int] = {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            host = (row.get("hostname") or "").strip()
+            try:
+                mau = int(row.get("active_month") or 0)
+            except ValueError:
+                continue
+            if host and mau > 0:
+                weights[host] = max(mau, weights.get(host, 0))
+    return path, weights
+
+def mau_tiers(weights: Dict[str, int], head_share: float) -> Dict[str, str]:
+    """
+    "head" for the largest hosts that together hold `head_share` of all
+    MAU; "tail" for the rest.
+    """
+    total = sum(weights.values())
+    tiers = {}
+    covered = 0
+    for host, mau in sorted(weights.items(), key=lambda item: (-item[1], item[0])):
+        tiers[host] = "head" if covered < total * head_share else "tail"
+        covered += mau
+    return tiers
+
+def tier_rank(host: str) -> int:
+    """Sort position of a host's tier; everything ranks equal without weights."""
+    if not MAU_TIERS:
+        return 0
+    return 0 if mau_tier_of.get(host) == "head" else 1
+
+class StateStore:
+    """
+    Per-host crawl state in an SQLite database (WAL mode).
+
+    Each host is one row holding its state dict as JSON, plus indexed due
+    times derived from it, so candidate selection is a query rather than a
+    scan of every host's state. Hosts are loaded on first use and modified
+    ones are written back in one transaction by checkpoint().
+
+    The connection is shared with the result writer thread, so every use
+    of it holds `_lock`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(STATE_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(hosts)")}
+        if "revisit" not in columns:
+            self._conn.execute("ALTER TABLE hosts ADD COLUMN revisit REAL")
+        self._cache: Dict[str, Dict] = {}
+        self._dirty: Set[str] = set()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM hosts").fetchone()[0]
+
+    def get(self, host: str) -> Dict:
+        hs = self._cache.get(host)
+        if hs is not None:
+            return hs
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM hosts WHERE host = ?", (host,)).fetchone()
+        hs = {}
+        if row is not None:
+            try:
+                hs = json.loads(row[0])
+            except ValueError:
+                hs = {}
+        self._cache[host] = hs
+        return hs
+
+    def preload(self, hosts: List[str]) -> None:
+        """Load state for `hosts` into memory, so fetching them never waits on disk."""
+        missing = [host for host in hosts if host not in self._cache]
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            with self._lock:
+                rows = dict(self._conn.execute(
+                    f"SELECT host, state FROM hosts WHERE host IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ))
+            for host in chunk:
+                try:
+                    hs = json.loads(rows[host]) if host in rows else {}
+                except ValueError:
+                    hs = {}
+                self._cache.setdefault(host, hs)
+
+    def mark_dirty(self, host: str) -> None:
+        self._dirty.add(host)
+
+    @staticmethod
+    def _row(host: str, hs: Dict) -> Tuple:
+        nodeinfo_due, robots_due, error_due = host_due_times(hs)
+        success = last_success_from_state(hs)
+        return (
+            host,
+            json.dumps(hs, ensure_ascii=False),
+            nodeinfo_due,
+            robots_due,
+            error_due,
+            max(nodeinfo_due, robots_due, error_due),
+            success.timestamp() if success is not None else None,
+            (hs.get("nodeinfo") or {}).get("revisit_secs"),
+        )
+
+    def _write_rows(self, rows: List[Tuple]) -> None:
+        self._conn.executemany(
+            """
+            INSERT INTO hosts (host, state, nodeinfo_due, robots_due, error_due, due_at, last_success, revisit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (host) DO UPDATE SET
+                state = excluded.state,
+                nodeinfo_due = excluded.nodeinfo_due,
+                robots_due = excluded.robots_due,
+                error_due = excluded.error_due,
+                due_at = excluded.due_at,
+                last_success = excluded.last_success,
+                revisit = excluded.revisit
+            """,
+            rows,
+        )
+
+    def take_dirty_rows(self) -> List[Tuple]:
+        """Snapshot modified hosts as rows for write_rows() and clear the dirty set."""
+        dirty = self._dirty
+        self._dirty = set()
+        return [self._row(host, self._cache[host]) for host in dirty if host in self._cache]
+
+    def write_rows(self, rows: List[Tuple]) -> None:
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._write_rows(rows)
+
+    def checkpoint(self) -> int:
+        """Commit all modified hosts; returns how many rows were written."""
+        dirty = set(self._dirty)
+        rows = self.take_dirty_rows()
+        try:
+            self.write_rows(rows)
+        except sqlite3.Error:
+            self._dirty |= dirty
+            raise
+        return len(rows)
+
+    def import_hosts(self, hosts: Dict[str, Dict]) -> None:
+        self.write_rows([self._row(host, hs) for host, hs in hosts.items() if isinstance(hs, dict)])
+
+    def apply_tiers(self) -> int:
+        """Store each host's current MAU tier (and the due times it implies); returns hosts changed."""
+        rows = []
+        with self._lock:
+            stored = list(self._conn.execute("SELECT host, state FROM hosts"))
+        for host, state in stored:
+            hs = self._cache.get(host)
+            if hs is None:
+                try:
+                    hs = json.loads(state)
+                except ValueError:
+                    continue
+            tier = mau_tier_of.get(host, "tail")
+            if hs.get("mau_tier") != tier:
+                hs["mau_tier"] = tier
+                rows.append(self._row(host, hs))
+        self.write_rows(rows)
+        return len(rows)
+
+    def known_hosts(self) -> List[str]:
+        """Every host with crawl state or in the discovery frontier."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT host FROM hosts UNION SELECT host FROM frontier"
+            )]
+
+    def add_frontier(self, rows: List[Tuple[str, str, float]]) -> None:
+        """Record discovered (host, source, time) rows; known hosts are ignored."""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO frontier (host, source, discovered) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def discovered_hosts(self, untried_limit: int) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Frontier hosts as (adopted, failing, untried): fetched successfully
+        at least once; tried but never successfully; never tried (oldest
+        discoveries first, at most `untried_limit`).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT f.host, h.host IS NOT NULL, h.last_success
+                FROM frontier f LEFT JOIN hosts h ON h.host = f.host
+                ORDER BY f.discovered
+                """
+            ).fetchall()
+        adopted = [host for host, _, last_success in rows if last_success is not None]
+        failing = [host for host, tried, last_success in rows if tried and last_success is None]
+        untried = [host for host, tried, _ in rows if not tried][:untried_limit]
+        return adopted, failing, untried
+
+    def ensure_due_config(self) -> None:
+        """Recompute stored due times if the TTL settings changed since last run."""
+        config = due_config()
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'due_config'").fetchone()
+        if row is not None and row[0] == config:
+            return
+        rows = []
+        for host, state in self._conn.execute("SELECT host, state FROM hosts"):
+            try:
+                hs = json.loads(state)
+            except ValueError:
+                continue
+            rows.append(self._row(host, hs))
+        with self._lock, self._conn:
+            self._write_rows(rows)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('due_config', ?)",
+                (config,),
+            )
+
+    def not_due(self, now_ts: float) -> Dict[str, Tuple[float, float, float]]:
+        """Hosts that must be skipped at `now_ts`, with their due times."""
+        with self._lock:
+            return self._not_due(now_ts)
+
+    def _not_due(self, now_ts: float) -> Dict[str, Tuple[float, float, float]]:
+        return {
+            host: (nodeinfo_due, robots_due, error_due)
+            for host, nodeinfo_due, robots_due, error_due in self._conn.execute(
+                "SELECT host, nodeinfo_due, robots_due, error_due FROM hosts WHERE due_at > ?",
+                (now_ts,),
+            )
+        }
+
+    def due_hosts(self, now_ts: float) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+        """(last success, revisit interval) for every host that is due at `now_ts`."""
+        with self._lock:
+            return self._due_hosts(now_ts)
+
+    def _due_hosts(self, now_ts: float) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+        return {
+            host: (last_success, revisit)
+            for host, last_success, revisit in self._conn.execute(
+                "SELECT host, last_success, revisit FROM hosts WHERE due_at <= ?",
+                (now_ts,),
+            )
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+# ---------------------------------------------------------------------
+# Retry-After / rate-limit headers
+# ---------------------------------------------------------------------
+# Seconds the server asked us to wait, set by fetch_json and read by the
+# dispatcher after process_host returns (same task, so same context).
+retry_hint: contextvars.ContextVar = contextvars.ContextVar("retry_hint", default=None)
+
+def parse_reset_value(value: str, now: datetime) -> Optional[float]:
+    """
+    Seconds until `value`, which may be delta-seconds, a Unix timestamp,
+    an HTTP-date or an ISO 8601 date (as Mastodon sends).
+    """
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None:
+        if number > 1e9:
+            return max(0.0, number - now.timestamp())
+        return max(0.0, number)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        when = parse_dt(value.replace("Z", "+00:00"))
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+def retry_after_from_headers(headers, status: int, now: datetime) -> Optional[float]:
+    """
+    How long to wait before the next request to this server: Retry-After
+    on 429/503, otherwise the rate-limit reset once the remaining quota
+    reaches zero.
+    """
+    if status in (429, 503):
+        value = headers.get("Retry-After")
+        if value:
+            delay = parse_reset_value(value, now)
+            if delay is not None:
+                return delay
+    remaining = headers.get("RateLimit-Remaining") or headers.get("X-RateLimit-Remaining")
+    if status == 429 or (remaining is not None and remaining.strip() == "0"):
+        reset = headers.get("RateLimit-Reset") or headers.get("X-RateLimit-Reset")
+        if reset:
+            return parse_reset_value(reset, now)
+    return None
+
+# ---------------------------------------------------------------------
+# Bounded body reads
+# ---------------------------------------------------------------------
+# Content types that can never be a NodeInfo document or robots.txt
+JSON_REJECT_TYPES = ("text/html", "image/", "audio/", "video/", "font/")
+ROBOTS_REJECT_TYPES = ("image/", "audio/", "video/", "font/", "application/octet-stream")
+
+class BodyRejected(Exception):
+    """A response body refused before (or while) reading it."""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind  # "oversize" or "bad_type"
+
+async def read_body(
+    resp: aiohttp.ClientResponse,
+    max_bytes: int,
+    reject_types: Tuple[str, ...],
+    truncate: bool = False,
+) -> Tuple[bytes, bool]:
+    """
+    Read at most `max_bytes` of a response body in chunks. Raises
+    BodyRejected for a content type starting with one of `reject_types`,
+    or for a body over the limit unless `truncate` is set, in which case
+    the first `max_bytes` are returned. Returns (body, truncated).
+    """
+    if "Content-Type" in resp.headers:
+        ctype = resp.content_type
+        if ctype.startswith(reject_types):
+            raise BodyRejected("bad_type", f"unexpected content type {ctype}")
+    length = resp.content_length
+    if length is not None and length > max_bytes and not truncate:
+        raise BodyRejected("oversize", f"body of {length} bytes exceeds {max_bytes}")
+
+    chunks = []
+    total = 0
+    async for chunk in resp.content.iter_chunked(64 * 1024):
+        if total + len(chunk) > max_bytes:
+            if not truncate:
+                raise BodyRejected("oversize", f"body exceeds {max_bytes} bytes")
+            chunks.append(chunk[:max_bytes - total])
+            return b"".join(chunks), True
+        chunks.append(chunk)
+        total += len(chunk)
+    return b"".join(chunks), False
 
-        return sorted(networks)[0]
+# ---------------------------------------------------------------------
+# Conditional GET validators
+# ---------------------------------------------------------------------
+def conditional_headers(validators: Optional[Dict]) -> Dict[str, str]:
+    """If-None-Match / If-Modified-Since headers from stored validators."""
+    headers: Dict[str, str] = {}
+    if not validators:
+        return headers
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+def store_validators(validators: Dict, resp: aiohttp.ClientResponse) -> bool:
+    """Remember ETag/Last-Modified from `resp`; returns False if it sent neither."""
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    validators.clear()
+    if not etag and not last_modified:
+        return False
+    if etag:
+        validators["etag"] = etag
+    if last_modified:
+        validators["last_modified"] = last_modified
+    return True
 
 # ---------------------------------------------------------------------
 # Robots.txt handling (with TTL & state tracking)
 # ---------------------------------------------------------------------
+WELLKNOWN_PATH = "/.well-known/nodeinfo"
+
+# Parsed robots.txt rules per origin ("scheme://netloc"): (checked_at, parser)
+robots_cache: Dict[str, Tuple[datetime, urllib.robotparser.RobotFileParser]] = {}
+robots_locks: Dict[str, asyncio.Lock] = {}
+
+def parse_robots(robots_url: str, body: str) -> urllib.robotparser.RobotFileParser:
+    rp = urllib.robotparser.RobotFileParser()
+    rp.set_url(robots_url)
+    rp.parse(body.splitlines())
+    return rp
+
+def robots_fresh(checked: Optional[datetime], now: datetime) -> bool:
+    if checked is None or ROBOTS_TTL_SECS <= 0:
+        return False
+    return (now - checked).total_seconds() < ROBOTS_TTL_SECS
+
+async def fetch_robots(
+    session: aiohttp.ClientSession,
+    robots_url: str,
+    robots_state: Dict,
+    now: datetime,
+) -> urllib.robotparser.RobotFileParser:
+    """
+    (Re)fetch robots.txt and record it in `robots_state`. The raw body is
+    kept so a later run can rebuild the rules without downloading it.
+    Missing or unreachable robots.txt is stored as an empty body (allow all).
+    """
+    validators = robots_state.setdefault("validators", {})
+    previous_body = robots_state.get("body")
+    headers = conditional_headers(validators) if previous_body is not None else {}
+    body = ""
+    error_str: Optional[str] = None
+    netloc = urllib.parse.urlparse(robots_url).netloc
+
+    try:
+        async with session.get(robots_url, headers=headers) as resp:
+            if resp.status == 304 and headers:
+                # Unchanged since the last fetch: reuse the stored body
+                body = previous_body
+                record_not_modified(netloc)
+            elif resp.status >= 400:
+                # Treat missing/forbidden robots as "no robots" => allowed
+                error_str = f"HTTP {resp.status}"
+                validators.clear()
+            else:
+                # Like major crawlers, only the first ROBOTS_MAX_BYTES are parsed
+                raw, truncated = await read_body(resp, ROBOTS_MAX_BYTES, ROBOTS_REJECT_TYPES, truncate=True)
+                if truncated:
+                    record_body_rejected(netloc, "oversize")
+                body = raw.decode(resp.charset or "utf-8", errors="replace")
+                store_validators(validators, resp)
+    except BodyRejected as e:
+        # Not a robots file; treat it like a missing one
+        record_body_rejected(netloc, e.kind)
+        error_str = str(e)
+        validators.clear()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # robots spec says: when robots unavailable, crawling is allowed
+        error_str = f"{type(e).__name__}: {e}"
+
+    rp = parse_robots(robots_url, body)
+    robots_state["last_checked"] = now.isoformat()
+    robots_state["body"] = body
+    robots_state["allowed"] = rp.can_fetch(USER_AGENT, WELLKNOWN_PATH)
+    robots_state["error"] = error_str
+    mark_host_dirty(netloc)
+    return rp
+
+async def get_robots_rules(
+    session: aiohttp.ClientSession,
+    scheme: str,
+    netloc: str,
+    now: datetime,
+) -> urllib.robotparser.RobotFileParser:
+    """
+    Parsed robots.txt rules for an origin, shared by every path and every
+    host that links to it. Rules come from memory, then from the body kept
+    in the state store, and are only downloaded once the TTL has lapsed.
+    """
+    origin = f"{scheme}://{netloc}"
+    cached = robots_cache.get(origin)
+    if cached is not None and robots_fresh(cached[0], now):
+        return cached[1]
+
+    lock = robots_locks.setdefault(origin, asyncio.Lock())
+    async with lock:
+        # Another task may have fetched it while we waited
+        cached = robots_cache.get(origin)
+        if cached is not None and robots_fresh(cached[0], now):
+            return cached[1]
+
+        robots_url = f"{origin}/robots.txt"
+        robots_state = get_host_state(netloc).setdefault("robots", {})
+        checked = parse_dt(robots_state.get("last_checked"))
+        body = robots_state.get("body")
+        if body is not None and robots_fresh(checked, now):
+            rp = parse_robots(robots_url, body)
+        else:
+            rp = await fetch_robots(session, robots_url, robots_state, now)
+            checked = now
+        robots_cache[origin] = (checked, rp)
+        return rp
+
 async def is_allowed(session: aiohttp.ClientSession, url: str, now: datetime) -> bool:
     """
     Check robots.txt for the given URL for our USER_AGENT.
-    Uses state.json to rate-limit robots.txt fetching via TTL.
+    Rules are cached per origin and re-fetched after ROBOTS_TTL_SECS.
     """
     parsed = urllib.parse.urlparse(url)
     scheme = parsed.scheme or "https"
     netloc = parsed.netloc
     path = parsed.path or "/"
 
-    host_state = get_host_state(netloc)
-    robots_state = host_state.setdefault("robots", {})
-
     # Special case for wordpress.com - We fetch it because they *do* provide
     # public access to nodeinfo.json file, but then direct you to a different
     # host that just has a blanket deny-everything rule - gotta say, the intent
@@ -346,46 +1975,8 @@ async def is_allowed(session: aiohttp.ClientSession, url: str, now: datetime) ->
     if netloc == "public-api.wordpress.com":
         return True
 
-    # TTL check: reuse previous decision if fresh
-    last_checked_str = robots_state.get("last_checked")
-    if last_checked_str and ROBOTS_TTL_SECS > 0:
-        try:
-            last_dt = datetime.fromisoformat(last_checked_str)
-            age = (now - last_dt).total_seconds()
-        except Exception:
-            age = None
-        if age is not None and age < ROBOTS_TTL_SECS:
-            allowed = robots_state.get("allowed")
-            if isinstance(allowed, bool):
-                if not allowed:
-                    record_robots_disallow(netloc)
-                return allowed
-
-    # Need to (re)fetch robots.txt
-    robots_url = f"{scheme}://{netloc}/robots.txt"
-    allowed = True
-    error_str: Optional[str] = None
-
-    try:
-        async with session.get(robots_url) as resp:
-            if resp.status >= 400:
-                # Treat missing/forbidden robots as "no robots" => allowed
-                error_str = f"HTTP {resp.status}"
-            else:
-                text = await resp.text()
-                rp = urllib.robotparser.RobotFileParser()
-                rp.set_url(robots_url)
-                rp.parse(text.splitlines())
-                allowed = rp.can_fetch(USER_AGENT, path)
-    except aiohttp.ClientError as e:
-        error_str = f"{type(e).__name__}: {e}"
-        # robots spec says: when robots unavailable, crawling is allowed
-        allowed = True
-
-    robots_state["last_checked"] = now.isoformat()
-    robots_state["allowed"] = allowed
-    robots_state["error"] = error_str
-
+    rp = await get_robots_rules(session, scheme, netloc, now)
+    allowed = rp.can_fetch(USER_AGENT, path)
     if not allowed:
         record_robots_disallow(netloc)
     return allowed
@@ -393,23 +1984,67 @@ async def is_allowed(session: aiohttp.ClientSession, url: str, now: datetime) ->
 # ---------------------------------------------------------------------
 # JSON fetch with error propagation
 # ---------------------------------------------------------------------
-async def fetch_json(session: aiohttp.ClientSession, url: str, now: datetime) -> Tuple[Optional[dict], Optional[str]]:
+async def fetch_json(
+    session: aiohttp.ClientSession,
+    url: str,
+    now: datetime,
+    cache: Optional[Dict] = None,
+    max_bytes: Optional[int] = None,
+    snapshot: Optional[Tuple[str, str]] = None,
+) -> Tuple[Optional[dict], Optional[str]]:
     """
     Fetch JSON from URL, respecting robots. Returns (data, error_str).
     error_str is None on success, otherwise a short description.
+    Bodies over `max_bytes` (default NODEINFO_MAX_BYTES) or of a non-JSON
+    content type are abandoned without reading them in full.
+
+    If `cache` (a dict kept in host state) is given, the response's
+    validators and document are stored in it and sent as a conditional
+    request next time; a 304 returns the cached document as a success.
+    With `snapshot` (nodeinfo_dir, host) the document is not copied into
+    the cache: process_host saves every document it gets back as a
+    snapshot named after `now`, and the cache keeps that name to load the
+    document from on a 304. If it can no longer be loaded, the URL is
+    fetched again without validators.
     """
     if not await is_allowed(session, url, now):
         err = "disallowed by robots.txt"
-        print(f"# robots.txt disallows {url}", file=sys.stderr)
+        log_event("info", "robots_disallow", f"robots.txt disallows {url}", url=url)
         return None, err
 
+    headers: Dict[str, str] = {}
+    if cache is not None and cache.get("url") == url and ("data" in cache or "snapshot" in cache):
+        headers = conditional_headers(cache.get("validators"))
+
     try:
-        async with session.get(url) as resp:
+        async with session.get(url, headers=headers) as resp:
             host = host_for_url(url)
             record_http_status(host, resp.status)
+            delay = retry_after_from_headers(resp.headers, resp.status, now)
+            if delay is not None:
+                retry_hint.set(delay)
+            if resp.status == 304 and headers:
+                if "data" in cache:
+                    data = cache["data"]
+                elif snapshot is not None:
+                    data = await asyncio.get_running_loop().run_in_executor(
+                        None, load_snapshot, snapshot[0], snapshot[1], cache["snapshot"]
+                    )
+                else:
+                    data = None
+                if data is None:
+                    cache.clear()
+                    return await fetch_json(session, url, now, cache, max_bytes, snapshot)
+                if snapshot is not None:
+                    # This response is saved again under a new name
+                    cache.pop("data", None)
+                    cache["snapshot"] = snapshot_name(now)
+                record_not_modified(host)
+                record_success(host)
+                return data, None
             if resp.status != 200:
                 err = f"HTTP {resp.status}"
-                print(f"# {err} for {url}", file=sys.stderr)
+                log_event("info", err, f"{err} for {url}", url=url, status=resp.status)
                 #print("\n===== HTTP ERROR =====")
                 #print(f"URL: {url}")
                 #print(f"Status: {resp.status}")
@@ -422,28 +2057,48 @@ async def fetch_json(session: aiohttp.ClientSession, url: str, now: datetime) ->
                 #print("===== END ERROR =====\n")
                 return None, err
             try:
-                data = await resp.json(content_type=None)
-            except ValueError as e:
+                raw, _ = await read_body(resp, max_bytes or NODEINFO_MAX_BYTES, JSON_REJECT_TYPES)
+            except BodyRejected as e:
+                err = f"Rejected body: {e}"
+                log_event("info", f"rejected_{e.kind}", f"{err} for {url}", url=url)
+                record_body_rejected(host, e.kind)
+                return None, err
+            try:
+                if resp.charset:
+                    data = json.loads(raw.decode(resp.charset))
+                else:
+                    data = json.loads(raw)
+            except (ValueError, LookupError) as e:
                 err = f"JSON decode error: {e}"
-                print(f"# {err} for {url}", file=sys.stderr)
+                log_event("info", "json_error", f"{err} for {url}", url=url)
                 record_json_error(host)
                 return None, err
             record_success(host)
+            if cache is not None:
+                validators: Dict[str, str] = {}
+                cache.clear()
+                if store_validators(validators, resp):
+                    cache.update({"url": url, "validators": validators})
+                    if snapshot is not None:
+                        cache["snapshot"] = snapshot_name(now)
+                    else:
+                        cache["data"] = data
             return data, None
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         err = f"{type(e).__name__}: {e}"
-        print(f"# Error fetching {url}: {err}", file=sys.stderr)
+        log_event("info", type(e).__name__, f"Error fetching {url}: {err}", url=url, error=str(e))
         record_network_error(host_for_url(url))
         return None, err
 
 # ---------------------------------------------------------------------
 # NodeInfo helpers
 # ---------------------------------------------------------------------
-def pick_best_nodeinfo_link(links: list) -> Optional[str]:
+def pick_best_nodeinfo_link(links: list) -> Tuple[Optional[str], Optional[str]]:
     """
     Given the 'links' array from /.well-known/nodeinfo, pick the highest version
     rel example:
       "http://nodeinfo.diaspora.software/ns/schema/2.1"
+    Returns (href, schema version string).
     """
     best = None
     best_version = (-1, -1)  # major, minor
@@ -467,12 +2122,26 @@ def pick_best_nodeinfo_link(links: list) -> Optional[str]:
             best_version = version_tuple
             best = href
 
-    return best
+    if best is None:
+        return None, None
+    return best, f"{best_version[0]}.{best_version[1]}"
+
+def cached_nodeinfo_link(host_state: Dict, now: datetime) -> Optional[str]:
+    """The NodeInfo href resolved by an earlier discovery, if still fresh."""
+    link = host_state.get("nodeinfo_link") or {}
+    href = link.get("href")
+    resolved_at = parse_dt(link.get("resolved_at"))
+    if not href or resolved_at is None or NODEINFO_LINK_TTL_SECS <= 0:
+        return None
+    if (now - resolved_at).total_seconds() >= NODEINFO_LINK_TTL_SECS:
+        return None
+    return href
 
 async def fetch_nodeinfo_for_host(
     session: aiohttp.ClientSession,
     netloc: str,
-    now: datetime
+    now: datetime,
+    nodeinfo_dir: str,
 ) -> Tuple[Optional[str], Optional[dict], str, Optional[str]]:
     """
     For a given host (netloc), return:
@@ -481,15 +2150,39 @@ async def fetch_nodeinfo_for_host(
     status is one of:
       "ok", "no_wellknown", "no_links", "fetch_error"
     error_str describes the problem for non-ok statuses.
+
+    A NodeInfo href cached from an earlier discovery is fetched directly;
+    /.well-known/nodeinfo is only consulted when it is missing, stale or
+    the document fetch fails.
     """
+    host_state = get_host_state(netloc)
+    conditional = host_state.setdefault("conditional", {})
+
+    # 0) Try the cached link first
+    cached_href = cached_nodeinfo_link(host_state, now)
+    cached_err: Optional[str] = None
+    if cached_href:
+        nodeinfo_data, cached_err = await fetch_json(
+            session, cached_href, now, conditional.setdefault("nodeinfo", {}),
+            snapshot=(nodeinfo_dir, netloc),
+        )
+        if nodeinfo_data is not None:
+            return cached_href, nodeinfo_data, "ok", None
+        if cached_err in ("HTTP 429", "HTTP 503"):
+            # Rediscovering would only add load; let the dispatcher back off
+            return cached_href, None, "fetch_error", cached_err
+        host_state.pop("nodeinfo_link", None)
+
     # 1) Fetch /.well-known/nodeinfo
-    well_url = f"https://{netloc}/.well-known/nodeinfo"
-    well_data, well_err = await fetch_json(session, well_url, now)
+    well_url = f"{URL_SCHEME}://{netloc}{WELLKNOWN_PATH}"
+    well_data, well_err = await fetch_json(
+        session, well_url, now, conditional.setdefault("wellknown", {}), WELLKNOWN_MAX_BYTES
+    )
     if well_data is None or "links" not in well_data:
         return None, None, "no_wellknown", well_err
 
     # 2) Choose best link
-    href = pick_best_nodeinfo_link(well_data.get("links", []))
+    href, version = pick_best_nodeinfo_link(well_data.get("links", []))
     if not href:
         return None, None, "no_links", None
 
@@ -500,13 +2193,354 @@ async def fetch_nodeinfo_for_host(
             return None, None, "fetch_error", "relative href but no base URL"
         href = urllib.parse.urljoin(well_url, href)
 
-    nodeinfo_data, node_err = await fetch_json(session, href, now)
+    host_state["nodeinfo_link"] = {
+        "href": href,
+        "version": version,
+        "resolved_at": now.isoformat(),
+    }
+
+    if href == cached_href:
+        # Discovery still points at the document that just failed
+        return href, None, "fetch_error", cached_err
+
+    nodeinfo_data, node_err = await fetch_json(
+        session, href, now, conditional.setdefault("nodeinfo", {}),
+        snapshot=(nodeinfo_dir, netloc),
+    )
     if nodeinfo_data is None:
         return href, None, "fetch_error", node_err
 
     return href, nodeinfo_data, "ok", None
 
 
+# ---------------------------------------------------------------------
+# Result writer
+# ---------------------------------------------------------------------
+def write_result(
+    nodeinfo_dir: str,
+    host: str,
+    timestr: str,
+    nodeinfo_url: Optional[str],
+    nodeinfo_data: dict,
+) -> None:
+    """Persist one NodeInfo document (blocking)."""
+    if nodeinfo_archive is not None:
+        nodeinfo_archive.append(host, timestr, nodeinfo_url, nodeinfo_data)
+        return
+    out_dir = os.path.join(nodeinfo_dir, sanitize_filename(host))
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, timestr + ".json")
+    record = {
+        "hostname": host,
+        "nodeinfo_url": nodeinfo_url,
+        "nodeinfo": nodeinfo_data,
+    }
+    # Readers such as parse-nodeinfo must never see a half-written snapshot
+    tmp = f"{out_path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as jf:
+        json.dump(record, jf, ensure_ascii=False, indent=2)
+    os.replace(tmp, out_path)
+
+def snapshot_name(now: datetime) -> str:
+    """Timestamp a snapshot fetched at `now` is saved under (the file stem)."""
+    return now.isoformat().replace("+00:00", "Z")
+
+def load_snapshot(nodeinfo_dir: str, host: str, timestr: str) -> Optional[object]:
+    """NodeInfo document of an earlier snapshot, or None if it is gone (blocking)."""
+    global snapshot_reader
+    path = os.path.join(nodeinfo_dir, sanitize_filename(host), timestr + ".json")
+    try:
+        with open(path, "r", encoding="utf-8") as jf:
+            record = json.load(jf)
+        return record.get("nodeinfo") if isinstance(record, dict) else None
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError):
+        return None
+    with snapshot_reader_lock:
+        if snapshot_reader is None:
+            if not has_archive(nodeinfo_dir):
+                return None
+            snapshot_reader = NodeInfoArchive.for_nodeinfo_dir(nodeinfo_dir)
+        try:
+            record = snapshot_reader.load(host, timestr)
+        except (OSError, ValueError, zlib.error, sqlite3.Error):
+            return None
+    return record["nodeinfo"] if record is not None else None
+
+def close_snapshot_reader() -> None:
+    global snapshot_reader
+    if snapshot_reader is not None:
+        snapshot_reader.close()
+        snapshot_reader = None
+
+class ResultWriter:
+    """
+    Background thread that does the crawler's disk writes: NodeInfo
+    documents and state checkpoints. Items come through a bounded queue,
+    so a slow disk slows dispatchers down (put() waits for room) instead
+    of stalling the event loop; they are written in batches of up to
+    WRITER_BATCH_SIZE, with one archive commit per batch.
+
+    In a shard worker, state rows (and results, when the coordinator owns
+    the archive) are passed to `shard_outbox` in batches instead.
+    """
+
+    def __init__(self, nodeinfo_dir: str, max_pending: int = WRITER_QUEUE_SIZE):
+        self._nodeinfo_dir = nodeinfo_dir
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_pending))
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def put(self, item: Tuple) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, self._queue.put, item)
+
+    async def flush(self) -> None:
+        """Wait until everything queued so far is on disk."""
+        await asyncio.get_running_loop().run_in_executor(None, self._queue.join)
+
+    async def close(self) -> None:
+        await self.put(("stop",))
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITER_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            forward = []
+            try:
+                for item in batch:
+                    kind = item[0]
+                    if kind == "stop":
+                        stop = True
+                    elif shard_outbox is not None and (kind != "result" or shard_forward_results):
+                        forward.append(item)
+                    elif kind == "result":
+                        try:
+                            write_result(self._nodeinfo_dir, *item[1:])
+                        except OSError as e:
+                            print(f"# Warning: could not save NodeInfo for {item[1]}: {e}", file=sys.stderr)
+                    elif kind == "state":
+                        try:
+                            state_store.write_rows(item[1])
+                        except sqlite3.Error as e:
+                            print(f"# Warning: could not write state to {state_store.path}: {e}", file=sys.stderr)
+                    elif kind == "frontier":
+                        try:
+                            state_store.add_frontier(item[1])
+                        except sqlite3.Error as e:
+                            print(f"# Warning: could not write frontier to {state_store.path}: {e}", file=sys.stderr)
+                if forward:
+                    shard_outbox.put(forward)
+                if nodeinfo_archive is not None:
+                    try:
+                        nodeinfo_archive.commit()
+                    except (OSError, sqlite3.Error) as e:
+                        print(f"# Warning: could not commit archive {nodeinfo_archive.path}: {e}", file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+result_writer: Optional[ResultWriter] = None
+
+async def save_state_async() -> None:
+    """save_state() without blocking the event loop when a writer is running."""
+    if result_writer is None:
+        save_state()
+        return
+    await result_writer.put(("state", state_store.take_dirty_rows()))
+    await result_writer.flush()
+
+# ---------------------------------------------------------------------
+# Discovery frontier
+# ---------------------------------------------------------------------
+PEERS_PATH = "/api/v1/instance/peers"
+# Software known to serve the Mastodon peers endpoint
+PEERS_SOFTWARE = {"mastodon", "hometown", "glitchsoc", "pleroma", "akkoma", "gotosocial"}
+DATA_STATIC_DIR = os.path.join(REPO_ROOT, "data-static")
+DISCOVERY_STATIC_FILES = [
+    os.path.join(DATA_STATIC_DIR, name)
+    for name in (
+        "fedidb-fromapi.csv",
+        "instances-fromapi.csv",
+        "fedilist-fromhtml.csv",
+        "atproto-bsky-relay.csv",
+    )
+]
+HOSTNAME_RE = re.compile(r"^(?=.{4,253}$)(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z0-9-]{2,63}$")
+IGNORED_SUFFIXES = (".onion", ".i2p", ".local", ".localhost", ".invalid", ".internal", ".lan", ".arpa")
+
+class HostSet:
+    """
+    Compact membership set for hostnames, about 8 bytes per host: 64-bit
+    BLAKE2b digests in a sorted array, plus a set of recent additions that
+    is merged in once it grows. A digest collision would make a new host
+    look known, which at 64 bits is negligible.
+    """
+
+    MERGE_AT = 65536
+
+    def __init__(self, hosts=()):
+        self._sorted = array("Q")
+        self._recent: Set[int] = set()
+        self.update(hosts)
+
+    @staticmethod
+    def _digest(host: str) -> int:
+        return int.from_bytes(hashlib.blake2b(host.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    def _has(self, digest: int) -> bool:
+        if digest in self._recent:
+            return True
+        i = bisect.bisect_left(self._sorted, digest)
+        return i < len(self._sorted) and self._sorted[i] == digest
+
+    def __contains__(self, host: str) -> bool:
+        return self._has(self._digest(host))
+
+    def add(self, host: str) -> bool:
+        """Add `host`; returns False if it was already present."""
+        digest = self._digest(host)
+        if self._has(digest):
+            return False
+        self._recent.add(digest)
+        if len(self._recent) >= self.MERGE_AT:
+            self._sorted = array("Q", heapq.merge(self._sorted, sorted(self._recent)))
+            self._recent = set()
+        return True
+
+    def update(self, hosts) -> None:
+        for host in hosts:
+            self.add(host)
+
+# Known hosts (list, state, frontier); None outside the process that owns the frontier
+discovery_known: Optional[HostSet] = None
+# Discovered hosts never fetched successfully; scheduled after everything else
+frontier_pending: Set[str] = set()
+
+def normalize_host(raw: object) -> Optional[str]:
+    """
+    Canonical hostname for a candidate: URL parts, port and trailing dots
+    removed, lower case, IDNA (punycode) encoded. None if it is not a
+    plausible public hostname.
+    """
+    if not isinstance(raw, str):
+        return None
+    host = raw.strip()
+    if "://" in host:
+        host = urllib.parse.urlsplit(host).hostname or ""
+    else:
+        host = host.split("/", 1)[0].rsplit("@", 1)[-1]
+        if host.count(":") == 1:
+            host = host.split(":", 1)[0]
+    host = host.strip().rstrip(".").lower()
+    if not host:
+        return None
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        return None
+    if not HOSTNAME_RE.match(host) or host.endswith(IGNORED_SUFFIXES):
+        return None
+    try:
+        ipaddress.ip_address(host)
+        return None
+    except ValueError:
+        return host
+
+def load_static_candidates(path: str) -> List[str]:
+    """Hostnames from one of the data-static host lists."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        column = next(
+            (name for name in ("domain", "Domain", "hostname", "name") if name in (reader.fieldnames or [])),
+            None,
+        )
+        if column is None:
+            raise ValueError("no domain, hostname or name column")
+        return [row[column] for row in reader if row.get(column)]
+
+def new_frontier_rows(candidates: List[str], source: str) -> List[Tuple[str, str, float]]:
+    """Frontier rows for the normalized candidates not seen before."""
+    now_ts = time.time()
+    rows = []
+    for candidate in candidates:
+        host = normalize_host(candidate)
+        if host is None:
+            continue
+        if discovery_known is not None and not discovery_known.add(host):
+            continue
+        rows.append((host, source, now_ts))
+    return rows
+
+def with_discovered(hosts: List[str]) -> List[str]:
+    """
+    `hosts` plus the frontier: discovered hosts that have worked once are
+    crawled like listed ones; those that never did (retried on the error
+    backoff) and up to DISCOVER_MAX_PENDING untried ones are low-priority
+    candidates (see select_hosts).
+    """
+    global frontier_pending
+    adopted, failing, untried = state_store.discovered_hosts(DISCOVER_MAX_PENDING)
+    listed = set(hosts)
+    extra = [host for host in adopted + failing + untried if host not in listed]
+    frontier_pending = set(failing + untried) - listed
+    return hosts + extra
+
+async def harvest_peers(
+    session: aiohttp.ClientSession,
+    host: str,
+    host_state: Dict,
+    nodeinfo: object,
+    now: datetime,
+) -> None:
+    """
+    Every PEERS_TTL_SECS, fetch the instance's peer list (Mastodon API) and
+    add hosts not seen before to the frontier.
+    """
+    software = nodeinfo.get("software") if isinstance(nodeinfo, dict) else None
+    name = software.get("name") if isinstance(software, dict) else None
+    if not isinstance(name, str) or name.lower() not in PEERS_SOFTWARE:
+        return
+    peers_state = host_state.setdefault("peers", {})
+    checked = parse_dt(peers_state.get("last_checked"))
+    if checked is not None and (now - checked).total_seconds() < PEERS_TTL_SECS:
+        return
+    # Mark the host dirty after each change: a checkpoint may run during
+    # the awaits and would otherwise leave the rest unsaved
+    peers_state["last_checked"] = now.isoformat()
+    mark_host_dirty(host)
+    data, err = await fetch_json(session, f"{URL_SCHEME}://{host}{PEERS_PATH}", now, max_bytes=PEERS_MAX_BYTES)
+    peers_state["error"] = err
+    if isinstance(data, list):
+        peers_state["count"] = len(data)
+    mark_host_dirty(host)
+    if not isinstance(data, list):
+        return
+    rows = new_frontier_rows(data, "peers")
+    if not rows:
+        return
+    if result_writer is not None:
+        await result_writer.put(("frontier", rows))
+    else:
+        state_store.add_frontier(rows)
+
 # ---------------------------------------------------------------------
 # worker task
 # ---------------------------------------------------------------------
@@ -518,21 +2552,15 @@ async def process_host(
     """
     Process a single host:
       - Fetch NodeInfo if needed
-      - Save nodeinfo_dir/hostname/<datetime>.json
-      - Update state.json in-memory
+      - Save nodeinfo_dir/hostname/<datetime>.json (or append to the archive)
+      - Update host state in-memory
     """
     now = datetime.now(timezone.utc)
-    timestr = now.isoformat().replace("+00:00", "Z")
-
-    out_dir = os.path.join(nodeinfo_dir, sanitize_filename(host))
-    os.makedirs(out_dir, exist_ok=True)
-
-    out_path = os.path.join(out_dir, timestr + ".json")
-
+    timestr = snapshot_name(now)
 
     # We are going to attempt a NodeInfo fetch
     try:
-        nodeinfo_url, nodeinfo_data, status, error_str = await fetch_nodeinfo_for_host(session, host, now)
+        nodeinfo_url, nodeinfo_data, status, error_str = await fetch_nodeinfo_for_host(session, host, now, nodeinfo_dir)
     except Exception as e:
         status = "fetch_error"
         error_str = f"{type(e).__name__}: {e}"
@@ -548,57 +2576,45 @@ async def process_host(
     if status == "ok":
         nodeinfo_state["last_success"] = now.isoformat()
         nodeinfo_state.pop("last_error", None)
+        nodeinfo_state.pop("failures", None)
+        nodeinfo_state.pop("error_class", None)
+        update_revisit(nodeinfo_state, nodeinfo_data, now)
     else:
         nodeinfo_state["last_error"] = now.isoformat()
+        record_failure(nodeinfo_state, status, error_str)
+    mark_host_dirty(host)
 
     # Save NodeInfo document if OK
     if status == "ok" and nodeinfo_data is not None:
-        record = {
-            "hostname": host,
-            "nodeinfo_url": nodeinfo_url,
-            "nodeinfo": nodeinfo_data,
-        }
-        with open(out_path, "w", encoding="utf-8") as jf:
-            json.dump(record, jf, ensure_ascii=False, indent=2)
+        if result_writer is not None:
+            await result_writer.put(("result", host, timestr, nodeinfo_url, nodeinfo_data))
+        else:
+            write_result(nodeinfo_dir, host, timestr, nodeinfo_url, nodeinfo_data)
+
+    if DISCOVERY and status == "ok":
+        try:
+            await harvest_peers(session, host, host_state, nodeinfo_data, now)
+        except Exception as e:
+            log_event(
+                "warning", "peers_error", f"peer discovery failed for {host}: {type(e).__name__}: {e}",
+                host=host,
+            )
 
     return status, error_str
 
 def should_skip_nodeinfo(host: str, now: datetime) -> bool:
-    host_state = get_host_state(host)
-    nodeinfo_state = host_state.get("nodeinfo")
-    if nodeinfo_state is None:
-        return False
-
-    last_dt = parse_dt(nodeinfo_state.get("last_checked"))
-    if last_dt is None:
-        return False
-
-    if NODEINFO_TTL_SECS <= 0:
-        return False
-
-    return (now - last_dt).total_seconds() < NODEINFO_TTL_SECS
+    nodeinfo_due, _, _ = host_due_times(get_host_state(host))
+    return now.timestamp() < nodeinfo_due
 
 def should_skip_robots(host: str, now: datetime) -> bool:
-    host_state = get_host_state(host)
-    robots_state = host_state.get("robots") or {}
-    allowed = robots_state.get("allowed")
-    if allowed is not False:
-        return False
-    last_checked = parse_dt(robots_state.get("last_checked"))
-    if last_checked is None or ROBOTS_TTL_SECS <= 0:
-        return False
-    return (now - last_checked).total_seconds() < ROBOTS_TTL_SECS
+    _, robots_due, _ = host_due_times(get_host_state(host))
+    return now.timestamp() < robots_due
 
 def should_skip_error(host: str, now: datetime) -> bool:
-    host_state = get_host_state(host)
-    nodeinfo_state = host_state.get("nodeinfo") or {}
-    last_error = parse_dt(nodeinfo_state.get("last_error"))
-    if last_error is None or ERROR_TTL_SECS <= 0:
-        return False
-    return (now - last_error).total_seconds() < ERROR_TTL_SECS
+    _, _, error_due = host_due_times(get_host_state(host))
+    return now.timestamp() < error_due
 
-def last_success_dt(host: str) -> Optional[datetime]:
-    host_state = get_host_state(host)
+def last_success_from_state(host_state: Dict) -> Optional[datetime]:
     nodeinfo_state = host_state.get("nodeinfo") or {}
     last_success = parse_dt(nodeinfo_state.get("last_success"))
     if last_success is not None:
@@ -607,13 +2623,72 @@ def last_success_dt(host: str) -> Optional[datetime]:
         return parse_dt(nodeinfo_state.get("last_checked"))
     return None
 
+def last_success_dt(host: str) -> Optional[datetime]:
+    return last_success_from_state(get_host_state(host))
+
 # ---------------------------------------------------------------------
 # Main async driver
 # ---------------------------------------------------------------------
+def select_hosts(
+    hosts: List[str],
+    now: datetime,
+    limit_n: int,
+    exclude: Set[str] = frozenset(),
+) -> Tuple[List[str], Dict[str, int], int]:
+    """
+    Pick the hosts due for a fetch at `now`, oldest successful fetch first.
+    Returns (selected hosts, skip counts by reason, number eligible).
+    """
+    now_ts = now.timestamp()
+    excluded = {"nodeinfo_ttl": 0, "robots_ttl": 0, "error_ttl": 0, "low_churn": 0}
+    not_due = state_store.not_due(now_ts)
+    due_hosts = state_store.due_hosts(now_ts)
+    candidates: List[Tuple[Optional[float], int, str]] = []
+    for host in hosts:
+        if host in exclude:
+            continue
+        due = not_due.get(host)
+        if due is not None:
+            nodeinfo_due, robots_due, error_due = due
+            if now_ts < nodeinfo_due:
+                excluded["nodeinfo_ttl"] += 1
+            elif now_ts < robots_due:
+                excluded["robots_ttl"] += 1
+            else:
+                excluded["error_ttl"] += 1
+            continue
+        candidates.append((due_hosts.get(host, (None, None))[0], tier_rank(host), host))
+
+    # Never fetched first, then the MAU head tier, then oldest success;
+    # untried discoveries only after all of those
+    candidates.sort(
+        key=lambda item: (item[2] in frontier_pending, 0 if item[0] is None else 1, item[1], item[0] or 0.0)
+    )
+    eligible_total = len(candidates)
+    selected_hosts = [host for _, _, host in candidates]
+    if REVISIT_ADAPTIVE and LOW_CHURN_SHARE < 1.0:
+        # Bound the share of this crawl given to hosts that rarely change;
+        # the rest of them wait for a later run.
+        budget = limit_n or len(selected_hosts)
+        low_churn_max = int(budget * LOW_CHURN_SHARE)
+        low_churn = 0
+        kept = []
+        for host in selected_hosts:
+            if is_low_churn(due_hosts.get(host, (None, None))[1]):
+                if low_churn >= low_churn_max:
+                    excluded["low_churn"] += 1
+                    continue
+                low_churn += 1
+            kept.append(host)
+        selected_hosts = kept
+    if limit_n:
+        selected_hosts = selected_hosts[:limit_n]
+
+    return selected_hosts, excluded, eligible_total
+
 async def main_async(
     hosts: list,
     nodeinfo_dir: str,
-    state_path: str,
     ratelimit: float,
     ratelimit_key: str,
     subnet_bits_v4: int,
@@ -621,42 +2696,65 @@ async def main_async(
     status_interval: float,
     status_max_keys: int,
     limit_n: int,
+    checkpoint_interval: float = STATE_CHECKPOINT_SECS,
+    daemon: bool = False,
+    hosts_path: Optional[str] = None,
+    daemon_tick: float = DAEMON_TICK_SECS,
+    concurrency_bounds: Optional[Tuple[int, int]] = None,
+    host_keys: Optional[Dict[str, str]] = None,
 ) -> None:
+    """
+    Crawl NodeInfo for `hosts`. In batch mode the due hosts are selected
+    once and the crawl ends when they are done. In daemon mode hosts are
+    scheduled every `daemon_tick` seconds, paced so each host is visited
+    about once per revisit cycle, `hosts_path` is re-read when it changes,
+    and SIGINT/SIGTERM finish in-flight fetches, checkpoint and return.
+
+    With `concurrency_bounds` (min, max) the number of in-flight requests
+    is adapted by a ConcurrencyController instead of fixed at MAX_CONCURRENT.
+
+    `host_keys` is set in shard workers: `hosts` were already selected by
+    the coordinator, which also resolved their rate-limit keys.
+    """
 
     timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
-    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT, limit_per_host=1)
+    controller = None
+    workers = MAX_CONCURRENT
+    if concurrency_bounds is not None:
+        controller = ConcurrencyController(MAX_CONCURRENT, *concurrency_bounds)
+        workers = controller.max_limit
+    global tls_context
+    tls_context = make_tls_context()
+    connector = aiohttp.TCPConnector(
+        limit=workers,
+        limit_per_host=1,
+        resolver=DNS_RESOLVER,
+        ssl=tls_context,
+        keepalive_timeout=KEEPALIVE_SECS,
+    )
     keyer = RateLimitKeyer(
         mode=ratelimit_key,
         subnet_bits_v4=subnet_bits_v4,
         subnet_bits_v6=subnet_bits_v6,
+        prefixes=prefix_index,
     )
 
+    global result_writer, event_log
+    loop = asyncio.get_running_loop()
     now = datetime.now(timezone.utc)
-    excluded = {"nodeinfo_ttl": 0, "robots_ttl": 0, "error_ttl": 0}
-    candidates: List[Tuple[Optional[datetime], str]] = []
-    for host in hosts:
-        if should_skip_nodeinfo(host, now):
-            excluded["nodeinfo_ttl"] += 1
-            continue
-        if should_skip_robots(host, now):
-            excluded["robots_ttl"] += 1
-            continue
-        if should_skip_error(host, now):
-            excluded["error_ttl"] += 1
-            continue
-        candidates.append((last_success_dt(host), host))
-
-    candidates.sort(
-        key=lambda item: (0 if item[0] is None else 1, item[0] or datetime.min)
-    )
-    eligible_total = len(candidates)
-    selected_hosts = [host for _, host in candidates]
-    if limit_n:
-        selected_hosts = selected_hosts[:limit_n]
+    selected_hosts: List[str] = []
+    excluded: Dict[str, int] = {}
+    eligible_total = 0
+    if host_keys is not None:
+        selected_hosts = list(hosts)
+        eligible_total = len(selected_hosts)
+        excluded = {"nodeinfo_ttl": 0, "robots_ttl": 0, "error_ttl": 0, "low_churn": 0}
+    elif not daemon:
+        selected_hosts, excluded, eligible_total = select_hosts(hosts, now, limit_n)
 
     dns_sem = asyncio.Semaphore(MAX_CONCURRENT)
 
-    progress = {"total": len(selected_hosts), "done": 0}
+    progress = {"total": 0, "done": 0, "deferred": 0}
     attempts = 0
     timing = {"sum_durations": 0.0}
     pending_resolves = 0
@@ -666,18 +2764,57 @@ async def main_async(
     per_key_active: Dict[str, int] = {}
     per_key_interval: Dict[str, float] = {}
     per_key_429_remaining: Dict[str, int] = {}
+    per_host_503_retries: Dict[str, int] = {}
+    # Keys told to come back after more than RETRY_AFTER_MAX_SECS; their
+    # hosts are deferred instead of queued until then
+    parked_until: Dict[str, float] = {}
     queue_cond = asyncio.Condition()
+    feeding_done = not daemon
+    stopping = False
+    stop_event = asyncio.Event()
+    scheduled: Set[str] = set()
+    resolve_tasks: Set[asyncio.Task] = set()
     max_rate = max(1.0, ratelimit)
     min_rate = 1.0
 
     def key_min_interval(key: str) -> float:
         key_max_rate = max_rate
-        if is_wordpress_key(key):
-            key_max_rate = 1.0
+        configured = key_rate_limit(key)
+        if configured is not None and configured > 0:
+            key_max_rate = min(key_max_rate, configured)
         return 1.0 / key_max_rate
 
-    def key_max_interval() -> float:
-        return 1.0 / min_rate
+    def key_max_interval(key: str) -> float:
+        return max(1.0 / min_rate, key_min_interval(key))
+
+    def is_parked(key: str, now: float) -> bool:
+        until = parked_until.get(key)
+        if until is None:
+            return False
+        if now >= until:
+            del parked_until[key]
+            return False
+        return True
+
+    def defer_host(host: str) -> None:
+        """Finish a scheduled host without fetching it; it stays due for a later run."""
+        progress["done"] += 1
+        progress["deferred"] += 1
+        scheduled.discard(host)
+        per_host_503_retries.pop(host, None)
+
+    def park_key(key: str, now: float, hint: float) -> None:
+        per_key_429_remaining[key] = 0
+        per_key_next[key] = now + RETRY_AFTER_MAX_SECS
+        parked_until[key] = now + RETRY_AFTER_MAX_SECS
+        queued = per_key_queues.pop(key, deque())
+        for host in queued:
+            defer_host(host)
+        print(
+            f"# Rate-limit key {key} asked to wait {hint:.0f}s;"
+            f" deferring {len(queued)} queued hosts",
+            file=sys.stderr,
+        )
 
     async def status_reporter(session: RateLimitedSession) -> None:
         start = time.monotonic()
@@ -715,13 +2852,19 @@ async def main_async(
             sum_delta = sum_durations - last_sum
             rate = attempts_delta / interval_secs
             avg_ms = (sum_delta / attempts_delta * 1000.0) if attempts_delta > 0 else 0.0
+            limit_str = str(MAX_CONCURRENT)
+            if controller is not None:
+                limit_str = f"{controller.limit} ({controller.last_reason})"
             print(
                 f"# Status t={elapsed:.1f}s done={done}/{total}"
-                f" active={active_total}/{MAX_CONCURRENT} queued={queued_total}"
+                f" active={active_total}/{limit_str} queued={queued_total}"
                 f" ready_keys={ready_keys} resolving={resolving} sem_waiting={sem_wait_total}"
+                f" writer_pending={result_writer.pending() if result_writer else 0}"
                 f" rate={rate:.2f}/s avg_ms={avg_ms:.0f}",
                 file=sys.stderr,
             )
+            print(latency_stats.status_line(), file=sys.stderr)
+            print(connection_status_line(), file=sys.stderr)
             last_time = now
             last_done = attempts_now
             last_sum = sum_durations
@@ -730,30 +2873,143 @@ async def main_async(
                 entries = entries[:status_max_keys]
             for key, queued, active, next_in, interval in entries:
                 rate = 1.0 / interval if interval > 0 else 0.0
+                total_hist = latency_stats.by_key.get(("total", key))
+                p90_ms = total_hist.percentile(0.9) * 1000.0 if total_hist is not None else 0.0
+                print(
+                    f"#   key={key} queued={queued} active={active}"
+                    f" next_ready_in={next_in:.2f}s rate={rate:.2f}/s p90_ms={p90_ms:.0f}",
+                    file=sys.stderr,
+                )
+
+    def crawl_gauges() -> Dict[str, Tuple[float, str]]:
+        """Scheduler state for the metrics exporter (read on the event loop)."""
+        now = time.monotonic()
+        active_keys = sum(1 for key in set(per_key_queues) | set(per_key_active)
+                          if per_key_queues.get(key) or per_key_active.get(key, 0) > 0)
+        return {
+            "hosts_scheduled": (progress["total"], "Hosts scheduled this run"),
+            "hosts_done": (progress["done"], "Scheduled hosts finished this run"),
+            "hosts_deferred": (progress["deferred"], "Scheduled hosts left for a later run (rate-limit key parked)"),
+            "fetch_attempts": (attempts, "Host fetch attempts this run, including retries"),
+            "fetch_seconds_sum": (timing["sum_durations"], "Time spent in host fetch attempts"),
+            "queued_hosts": (sum(len(q) for q in per_key_queues.values()), "Hosts waiting for their rate-limit key"),
+            "active_requests": (sum(per_key_active.values()), "Host fetches in flight"),
+            "active_keys": (active_keys, "Rate-limit keys with queued or in-flight hosts"),
+            "ready_keys": (
+                sum(1 for key, q in per_key_queues.items() if q and now >= per_key_next.get(key, 0.0)),
+                "Rate-limit keys allowed to send now",
+            ),
+            "resolving_hosts": (pending_resolves, "Hosts waiting for rate-limit key resolution"),
+            "writer_pending": (result_writer.pending() if result_writer else 0, "Writes queued for the writer thread"),
+            "concurrency_limit": (
+                controller.limit if controller is not None else MAX_CONCURRENT,
+                "Current limit on concurrent requests",
+            ),
+            "key_rate_max": (max_rate, "Per-key request rate limit (requests per second)"),
+        }
+
+    async def metrics_exporter() -> None:
+        while True:
+            try:
+                write_metrics_file(METRICS_FILE, render_metrics(crawl_gauges()))
+            except OSError as e:
+                print(f"# Warning: could not write metrics to {METRICS_FILE}: {e}", file=sys.stderr)
+            await asyncio.sleep(METRICS_INTERVAL_SECS)
+
+    async def checkpointer() -> None:
+        while True:
+            await asyncio.sleep(checkpoint_interval)
+            await save_state_async()
+
+    async def resolve_and_enqueue(host: str) -> None:
+        nonlocal pending_resolves
+        key = host_keys.get(host) if host_keys is not None else None
+        if key is None:
+            async with dns_sem:
+                try:
+                    key = await keyer.get_key_for_host(host)
+                except Exception:
+                    key = host
+        async with queue_cond:
+            if stopping:
+                scheduled.discard(host)
+            elif is_parked(key, time.monotonic()):
+                defer_host(host)
+            else:
+                per_key_queues.setdefault(key, deque()).append(host)
+            pending_resolves -= 1
+            queue_cond.notify()
+
+    async def schedule(batch: List[str]) -> None:
+        nonlocal pending_resolves
+        await loop.run_in_executor(None, state_store.preload, batch)
+        async with queue_cond:
+            scheduled.update(batch)
+            pending_resolves += len(batch)
+            progress["total"] += len(batch)
+        for host in batch:
+            task = asyncio.create_task(resolve_and_enqueue(host))
+            resolve_tasks.add(task)
+            task.add_done_callback(resolve_tasks.discard)
+
+    async def daemon_feeder() -> None:
+        nonlocal hosts, feeding_done, stopping
+        hosts_mtime = os.path.getmtime(hosts_path) if hosts_path else None
+        cycle = REVISIT_MIN_SECS if REVISIT_ADAPTIVE else NODEINFO_TTL_SECS
+        if cycle <= 0:
+            cycle = 24 * 3600.0
+        while not stop_event.is_set():
+            if hosts_path:
+                try:
+                    mtime = os.path.getmtime(hosts_path)
+                    if mtime != hosts_mtime:
+                        new_hosts = load_hostnames(hosts_path)
+                        added = len(set(new_hosts) - set(hosts))
+                        hosts = new_hosts
+                        hosts_mtime = mtime
+                        print(f"# Reloaded {len(hosts)} hosts from {hosts_path} ({added} new)", file=sys.stderr)
+                except (OSError, ValueError) as e:
+                    print(f"# Warning: could not reload {hosts_path}: {e}", file=sys.stderr)
+
+            # Due times are read from the store, so write back recent results first
+            await save_state_async()
+            candidates = hosts
+            if DISCOVERY:
+                candidates = await loop.run_in_executor(None, with_discovered, hosts)
+            budget = max(1, math.ceil(len(candidates) * daemon_tick / cycle))
+            async with queue_cond:
+                busy = set(scheduled)
+            batch, _, eligible = await loop.run_in_executor(
+                None, select_hosts, candidates, datetime.now(timezone.utc), budget, busy
+            )
+            await schedule(batch)
+            if batch:
                 print(
-                    f"#   key={key} queued={queued} active={active}"
-                    f" next_ready_in={next_in:.2f}s rate={rate:.2f}/s",
+                    f"# Scheduled {len(batch)} of {eligible} due hosts"
+                    f" ({len(busy)} already queued or in flight)",
                     file=sys.stderr,
                 )
-
-    async def resolve_and_enqueue(host: str) -> None:
-        nonlocal pending_resolves
-        async with dns_sem:
             try:
-                key = await keyer.get_key_for_host(host)
-            except Exception:
-                key = host
+                await asyncio.wait_for(stop_event.wait(), timeout=daemon_tick)
+            except asyncio.TimeoutError:
+                pass
+
+        # Shutting down: drop queued hosts and let in-flight fetches finish
         async with queue_cond:
-            per_key_queues.setdefault(key, deque()).append(host)
-            pending_resolves -= 1
-            queue_cond.notify()
+            stopping = True
+            feeding_done = True
+            for q in per_key_queues.values():
+                for host in q:
+                    scheduled.discard(host)
+            per_key_queues.clear()
+            queue_cond.notify_all()
 
     async def dispatch_loop(session: RateLimitedSession) -> None:
         nonlocal inflight, attempts
         while True:
             async with queue_cond:
                 queues_nonempty = any(per_key_queues.get(k) for k in per_key_queues.keys())
-                if pending_resolves == 0 and not queues_nonempty and inflight == 0:
+                if feeding_done and pending_resolves == 0 and not queues_nonempty and inflight == 0:
                     return
 
                 now = time.monotonic()
@@ -791,102 +3047,541 @@ async def main_async(
             start_time = time.monotonic()
             status = "fetch_error"
             error_str = None
+            retry_hint.set(None)
+            current_rate_key.set(key)
             try:
-                status, error_str = await process_host(host, session, nodeinfo_dir)
+                # One slot for the host's whole request chain
+                async with session.slot():
+                    status, error_str = await process_host(host, session, nodeinfo_dir)
             except Exception as e:
                 status = "fetch_error"
                 error_str = f"{type(e).__name__}: {e}"
             finally:
                 duration = time.monotonic() - start_time
+                hint = retry_hint.get()
                 async with queue_cond:
                     inflight -= 1
                     per_key_active[key] = per_key_active.get(key, 0) - 1
                     if per_key_active[key] <= 0:
                         per_key_active.pop(key, None)
                     attempts += 1
+                    now = time.monotonic()
+                    parked_hint = None
+                    if hint is not None and hint > RETRY_AFTER_MAX_SECS:
+                        # Asked to come back much later: give up on this key for the run
+                        parked_hint = hint
+                        per_key_429_remaining[key] = 0
+                        hint = None
                     if error_str == "HTTP 429":
                         remaining = per_key_429_remaining.get(key, MAX_429_RETRIES)
-                        if remaining > 0:
+                        if remaining > 0 and not stopping:
                             per_key_429_remaining[key] = remaining - 1
-                            interval = min(
-                                key_max_interval(),
-                                per_key_interval.get(key, key_min_interval(key)) * 2.0,
-                            )
-                            per_key_interval[key] = interval
-                            per_key_next[key] = max(time.monotonic(), per_key_next.get(key, 0.0)) + interval
+                            if hint is not None:
+                                # The server said exactly when to come back
+                                per_key_next[key] = max(per_key_next.get(key, 0.0), now + hint)
+                            else:
+                                interval = min(
+                                    key_max_interval(key),
+                                    per_key_interval.get(key, key_min_interval(key)) * 2.0,
+                                )
+                                per_key_interval[key] = interval
+                                per_key_next[key] = max(now, per_key_next.get(key, 0.0)) + interval
                             per_key_queues.setdefault(key, deque()).append(host)
                         else:
                             progress["done"] += 1
+                            scheduled.discard(host)
+                    elif error_str == "HTTP 503" and not stopping \
+                            and per_host_503_retries.get(host, 0) < MAX_503_RETRIES:
+                        retries = per_host_503_retries.get(host, 0)
+                        per_host_503_retries[host] = retries + 1
+                        delay = hint if hint is not None else RETRY_503_BASE_SECS * (2 ** retries)
+                        delay *= random.uniform(1.0, 1.5)
+                        per_key_next[key] = max(per_key_next.get(key, 0.0), now + delay)
+                        per_key_queues.setdefault(key, deque()).append(host)
                     else:
+                        if hint is not None:
+                            # Quota exhausted: hold the key until it resets
+                            per_key_next[key] = max(per_key_next.get(key, 0.0), now + hint)
+                        per_host_503_retries.pop(host, None)
                         progress["done"] += 1
+                        scheduled.discard(host)
                         if status == "ok":
                             interval = per_key_interval.get(key, key_min_interval(key))
                             per_key_interval[key] = max(key_min_interval(key), interval * 0.9)
                             per_key_429_remaining[key] = MAX_429_RETRIES
+                    if parked_hint is not None:
+                        # Also drops this host if it was queued for a retry above
+                        park_key(key, now, parked_hint)
                     timing["sum_durations"] += duration
                     queue_cond.notify()
 
     async with RateLimitedSession(
         timeout=timeout,
         connector=connector,
-        sem=None,
+        sem=controller,
         headers={"User-Agent": USER_AGENT},
     ) as session:
-        pending_resolves = len(selected_hosts)
-        print(
-            f"# Eligible hosts for fetch: {len(selected_hosts)}"
-            f" (skipped nodeinfo_ttl={excluded['nodeinfo_ttl']}"
-            f" robots_ttl={excluded['robots_ttl']}"
-            f" error_ttl={excluded['error_ttl']}"
-            f" excluded_by_n={max(0, eligible_total - len(selected_hosts))})",
-            file=sys.stderr,
-        )
-
-        resolve_tasks = [
-            asyncio.create_task(resolve_and_enqueue(host))
-            for host in selected_hosts
-        ]
+        result_writer = ResultWriter(nodeinfo_dir)
+        event_log = EventLog(LOG_JSONL)
+        feeder_task = None
+        if daemon:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop_event.set)
+            print(f"# Daemon mode: scheduling due hosts every {daemon_tick:.0f}s", file=sys.stderr)
+            feeder_task = asyncio.create_task(daemon_feeder())
+        elif host_keys is not None:
+            print(f"# Shard hosts for fetch: {len(selected_hosts)}", file=sys.stderr)
+            await schedule(selected_hosts)
+        else:
+            print(
+                f"# Eligible hosts for fetch: {len(selected_hosts)}"
+                f" (skipped nodeinfo_ttl={excluded['nodeinfo_ttl']}"
+                f" robots_ttl={excluded['robots_ttl']}"
+                f" error_ttl={excluded['error_ttl']}"
+                f" low_churn={excluded['low_churn']}"
+                f" excluded_by_n={max(0, eligible_total - excluded['low_churn'] - len(selected_hosts))})",
+                file=sys.stderr,
+            )
+            await schedule(selected_hosts)
 
         status_task = None
         if status_interval > 0:
             status_task = asyncio.create_task(status_reporter(session))
+        checkpoint_task = None
+        if checkpoint_interval > 0:
+            checkpoint_task = asyncio.create_task(checkpointer())
+        controller_task = None
+        if controller is not None:
+            controller_task = asyncio.create_task(controller.run())
+        metrics_task = None
+        if METRICS_FILE:
+            metrics_task = asyncio.create_task(metrics_exporter())
+        metrics_server = None
+        if METRICS_PORT:
+            try:
+                metrics_server = await start_metrics_server(METRICS_PORT, crawl_gauges)
+                print(f"# Serving metrics on http://127.0.0.1:{METRICS_PORT}/metrics", file=sys.stderr)
+            except OSError as e:
+                print(f"# Warning: could not serve metrics on port {METRICS_PORT}: {e}", file=sys.stderr)
 
         dispatchers = [
             asyncio.create_task(dispatch_loop(session))
-            for _ in range(MAX_CONCURRENT)
+            for _ in range(workers)
         ]
         try:
             if resolve_tasks:
-                await asyncio.gather(*resolve_tasks)
+                await asyncio.gather(*list(resolve_tasks))
                 async with queue_cond:
                     queue_cond.notify_all()
             await asyncio.gather(*dispatchers)
+            if feeder_task is not None:
+                await feeder_task
         except asyncio.CancelledError:
             # Ensure child tasks are cancelled and awaited to avoid pending-task warnings.
-            for task in resolve_tasks:
+            pending = list(resolve_tasks)
+            for task in pending:
                 task.cancel()
             for task in dispatchers:
                 task.cancel()
             if status_task is not None:
                 status_task.cancel()
-            if resolve_tasks:
-                await asyncio.gather(*resolve_tasks, return_exceptions=True)
+            if feeder_task is not None:
+                feeder_task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
             await asyncio.gather(*dispatchers, return_exceptions=True)
             if status_task is not None:
                 await asyncio.gather(status_task, return_exceptions=True)
+            if feeder_task is not None:
+                await asyncio.gather(feeder_task, return_exceptions=True)
             raise
         finally:
-            if status_task is not None:
-                status_task.cancel()
+            if daemon:
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.remove_signal_handler(sig)
+            for task in (status_task, checkpoint_task, controller_task, metrics_task):
+                if task is None:
+                    continue
+                task.cancel()
                 try:
-                    await status_task
+                    await task
                 except asyncio.CancelledError:
                     pass
+            if metrics_task is not None:
+                # Leave the final counts behind
+                try:
+                    write_metrics_file(METRICS_FILE, render_metrics(crawl_gauges()))
+                except OSError as e:
+                    print(f"# Warning: could not write metrics to {METRICS_FILE}: {e}", file=sys.stderr)
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+            # Drain queued results and stop the writer thread
+            await result_writer.close()
+            result_writer = None
+            await loop.run_in_executor(None, event_log.close)
+            event_log = None
 
     # Final state save on shutdown
-    save_state(state_path)
+    save_state()
     print("# Done.", file=sys.stderr)
 
+# ---------------------------------------------------------------------
+# Sharded crawling (--workers)
+# ---------------------------------------------------------------------
+# Module settings a shard worker needs; main() may have changed them from
+# the command line, and spawned workers start from a fresh import.
+SHARD_SETTINGS = (
+    "MAX_CONCURRENT", "ROBOTS_TTL_SECS", "NODEINFO_TTL_SECS", "ERROR_TTL_SECS",
+    "NODEINFO_LINK_TTL_SECS", "REVISIT_ADAPTIVE", "REVISIT_MIN_SECS", "REVISIT_MAX_SECS",
+    "LOW_CHURN_SHARE", "WRITER_QUEUE_SIZE", "ROBOTS_MAX_BYTES", "WELLKNOWN_MAX_BYTES",
+    "NODEINFO_MAX_BYTES", "KEY_RATE_LIMITS", "METRICS_FILE", "METRICS_PORT",
+    "METRICS_INTERVAL_SECS", "MAU_TIERS", "MAU_TAIL_TTL_FACTOR", "mau_tier_of",
+    "ERROR_BACKOFF_BASE_SECS", "ERROR_BACKOFF_MAX_SECS", "DISCOVERY", "PEERS_TTL_SECS",
+    "PEERS_MAX_BYTES", "LOG_LEVEL", "LOG_SAMPLE", "LOG_WINDOW_SECS",
+    "LOG_JSONL",
+)
+
+def shard_for_key(key: str, shards: int) -> int:
+    """Stable across processes and runs, unlike hash()."""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+async def resolve_host_keys(
+    hosts: List[str],
+    ratelimit_key: str,
+    subnet_bits_v4: int,
+    subnet_bits_v6: int,
+) -> Dict[str, str]:
+    keyer = RateLimitKeyer(
+        mode=ratelimit_key,
+        subnet_bits_v4=subnet_bits_v4,
+        subnet_bits_v6=subnet_bits_v6,
+        prefixes=prefix_index,
+    )
+    dns_sem = asyncio.Semaphore(MAX_CONCURRENT)
+
+    async def resolve(host: str) -> Tuple[str, str]:
+        async with dns_sem:
+            try:
+                return host, await keyer.get_key_for_host(host)
+            except Exception:
+                return host, host
+
+    return dict(await asyncio.gather(*(resolve(host) for host in hosts)))
+
+def merge_stats(other: Dict[str, Dict]) -> None:
+    """Add a worker's per-key stats to this process's."""
+    for key, their in other.items():
+        ours = get_stats(key)
+        for name, value in their.items():
+            if name == "http_statuses":
+                for status, count in value.items():
+                    ours["http_statuses"][status] = ours["http_statuses"].get(status, 0) + count
+            else:
+                ours[name] = ours.get(name, 0) + value
+
+def shard_worker(
+    index: int,
+    settings: Dict,
+    state_path: str,
+    forward_results: bool,
+    outbox,
+    hosts: List[str],
+    host_keys: Dict[str, str],
+    main_args: Tuple,
+) -> None:
+    """
+    Crawl one shard. Host state is read from the shared store, but every
+    write goes back through `outbox` to the coordinator, followed by this
+    worker's stats and a final ("done", index) message.
+    """
+    global state_store, shard_outbox, shard_forward_results, METRICS_FILE, METRICS_PORT, LOG_JSONL
+    globals().update(settings)
+    # Each worker exports its own shard's metrics and events
+    if METRICS_FILE:
+        METRICS_FILE = f"{METRICS_FILE}.shard-{index}"
+    if LOG_JSONL:
+        LOG_JSONL = f"{LOG_JSONL}.shard-{index}"
+    if METRICS_PORT:
+        METRICS_PORT += 1 + index
+    state_store = StateStore(state_path)
+    shard_outbox = outbox
+    shard_forward_results = forward_results
+    try:
+        asyncio.run(main_async(hosts, *main_args, host_keys=host_keys))
+    except KeyboardInterrupt:
+        save_state()
+    finally:
+        close_snapshot_reader()
+        state_store.close()
+        outbox.put([
+            ("stats", stats_hosts),
+            ("latency", latency_stats.dump()),
+            ("connections", connection_stats),
+            ("done", index),
+        ])
+
+def run_sharded(
+    workers: int,
+    hosts: List[str],
+    nodeinfo_dir: str,
+    ratelimit: float,
+    ratelimit_key: str,
+    subnet_bits_v4: int,
+    subnet_bits_v6: int,
+    status_interval: float,
+    status_max_keys: int,
+    limit_n: int,
+    checkpoint_interval: float,
+    concurrency_bounds: Optional[Tuple[int, int]],
+) -> None:
+    """
+    Coordinator for a crawl split over `workers` processes. Hosts are
+    selected here, then partitioned by rate-limit key, so each key (and its
+    politeness limit) belongs to exactly one worker. Workers write NodeInfo
+    files themselves; state updates, archive snapshots and stats come back
+    here and are merged into the usual state store and output layout.
+    """
+    global MAX_CONCURRENT
+    selected, excluded, eligible_total = select_hosts(hosts, datetime.now(timezone.utc), limit_n)
+    print(
+        f"# Eligible hosts for fetch: {len(selected)}"
+        f" (skipped nodeinfo_ttl={excluded['nodeinfo_ttl']}"
+        f" robots_ttl={excluded['robots_ttl']}"
+        f" error_ttl={excluded['error_ttl']}"
+        f" low_churn={excluded['low_churn']}"
+        f" excluded_by_n={max(0, eligible_total - excluded['low_churn'] - len(selected))})",
+        file=sys.stderr,
+    )
+    host_keys = asyncio.run(resolve_host_keys(selected, ratelimit_key, subnet_bits_v4, subnet_bits_v6))
+    shards: List[List[str]] = [[] for _ in range(workers)]
+    for host in selected:
+        shards[shard_for_key(host_keys[host], workers)].append(host)
+
+    # Every process gets its share of the connection budget
+    MAX_CONCURRENT = max(1, math.ceil(MAX_CONCURRENT / workers))
+    if concurrency_bounds is not None:
+        concurrency_bounds = tuple(max(1, math.ceil(b / workers)) for b in concurrency_bounds)
+    settings = {name: globals()[name] for name in SHARD_SETTINGS}
+    main_args = (
+        nodeinfo_dir, ratelimit, ratelimit_key, subnet_bits_v4, subnet_bits_v6,
+        status_interval, status_max_keys, 0, checkpoint_interval,
+        False, None, DAEMON_TICK_SECS, concurrency_bounds,
+    )
+
+    # spawn rather than fork: the coordinator holds SQLite connections
+    ctx = multiprocessing.get_context("spawn")
+    outbox = ctx.Queue(maxsize=max(1, WRITER_QUEUE_SIZE // WRITER_BATCH_SIZE) * workers)
+    procs = []
+    for index, shard in enumerate(shards):
+        if not shard:
+            continue
+        proc = ctx.Process(
+            target=shard_worker,
+            args=(
+                index, settings, state_store.path, nodeinfo_archive is not None,
+                outbox, shard, {host: host_keys[host] for host in shard}, main_args,
+            ),
+            name=f"shard-{index}",
+        )
+        proc.start()
+        procs.append(proc)
+        print(f"# Started shard {index} with {len(shard)} hosts (pid {proc.pid})", file=sys.stderr)
+
+    running = {int(proc.name.split("-")[1]): proc for proc in procs}
+    while running:
+        try:
+            batch = outbox.get(timeout=1.0)
+        except queue.Empty:
+            for index, proc in list(running.items()):
+                if not proc.is_alive() and outbox.empty():
+                    print(f"# Warning: shard {index} exited with code {proc.exitcode}", file=sys.stderr)
+                    running.pop(index)
+            continue
+        except KeyboardInterrupt:
+            # Workers got the same SIGINT and are saving; keep collecting
+            print("# Caught KeyboardInterrupt, waiting for shards to save state...", file=sys.stderr)
+            continue
+        for item in batch:
+            kind = item[0]
+            if kind == "result":
+                try:
+                    write_result(nodeinfo_dir, *item[1:])
+                except OSError as e:
+                    print(f"# Warning: could not save NodeInfo for {item[1]}: {e}", file=sys.stderr)
+            elif kind == "state":
+                try:
+                    state_store.write_rows(item[1])
+                except sqlite3.Error as e:
+                    print(f"# Warning: could not write state to {state_store.path}: {e}", file=sys.stderr)
+            elif kind == "frontier":
+                try:
+                    state_store.add_frontier(new_frontier_rows([row[0] for row in item[1]], item[1][0][1]))
+                except sqlite3.Error as e:
+                    print(f"# Warning: could not write frontier to {state_store.path}: {e}", file=sys.stderr)
+            elif kind == "stats":
+                merge_stats(item[1])
+            elif kind == "latency":
+                latency_stats.merge(item[1])
+            elif kind == "connections":
+                merge_connection_stats(item[1])
+            elif kind == "done":
+                running.pop(item[1], None)
+        if nodeinfo_archive is not None:
+            try:
+                nodeinfo_archive.commit()
+            except (OSError, sqlite3.Error) as e:
+                print(f"# Warning: could not commit archive {nodeinfo_archive.path}: {e}", file=sys.stderr)
+
+    for proc in procs:
+        proc.join()
+    if METRICS_FILE:
+        try:
+            write_metrics_file(METRICS_FILE, render_metrics({
+                "hosts_scheduled": (len(selected), "Hosts scheduled this run"),
+                "workers": (len(procs), "Shard worker processes"),
+            }))
+        except OSError as e:
+            print(f"# Warning: could not write metrics to {METRICS_FILE}: {e}", file=sys.stderr)
+    print(f"# Done ({len(procs)} shards).", file=sys.stderr)
+
+# ---------------------------------------------------------------------
+# End-to-end benchmark against a local mock fediverse
+# ---------------------------------------------------------------------
+REQUESTS_PER_FETCH_MAX = 4  # robots.txt, well-known, NodeInfo, one redirect
+# mock_fediverse.DEFAULTS that --benchmark-<name> overrides. mock_fediverse
+# (an aiohttp server) is only imported by run_benchmark.
+BENCHMARK_OPTIONS = (
+    ("instances", int),
+    ("addresses", int),
+    ("port", int),
+    ("latency_ms", float),
+    ("jitter_ms", float),
+    ("share_429", float),
+    ("share_503", float),
+    ("share_disallow", float),
+    ("share_redirect", float),
+    ("share_oversize", float),
+    ("seed", int),
+)
+
+def run_benchmark(
+    farm_options: Dict,
+    ratelimit: float,
+    ratelimit_key: str,
+    subnet_bits_v4: int,
+    subnet_bits_v6: int,
+    status_interval: float,
+    concurrency_bounds: Optional[Tuple[int, int]],
+) -> None:
+    """
+    Crawl a mock_fediverse farm with the real fetch path (session, robots,
+    fetch_json, keying, writer) into a scratch directory, then report
+    throughput, politeness per rate-limit key and peak memory.
+    `farm_options` overrides mock_fediverse.DEFAULTS where not None.
+    """
+    import mock_fediverse
+
+    global URL_SCHEME, DNS_RESOLVER
+    farm_config = dict(mock_fediverse.DEFAULTS)
+    farm_config.update({name: value for name, value in farm_options.items() if value is not None})
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Event()
+    stop = ctx.Event()
+    log_recv, log_send = ctx.Pipe(duplex=False)
+    farm = ctx.Process(target=mock_fediverse.serve_farm, args=(farm_config, ready, stop, log_send), name="mock-fediverse")
+    farm.start()
+    # Only the farm writes to the pipe; without our copy, recv() sees EOF if it dies
+    log_send.close()
+    if not ready.wait(60):
+        farm.terminate()
+        print("# Benchmark: mock fediverse did not start", file=sys.stderr)
+        return
+
+    URL_SCHEME = "http"
+    DNS_RESOLVER = mock_fediverse.MockResolver(farm_config["addresses"])
+    hosts = mock_fediverse.instance_hosts(farm_config)
+    print(
+        f"# Benchmark: {len(hosts)} instances on {farm_config['addresses']} addresses,"
+        f" ratelimit={ratelimit}/s per {ratelimit_key}",
+        file=sys.stderr,
+    )
+    with tempfile.TemporaryDirectory(prefix="fetch-nodeinfo-bench-") as scratch:
+        load_state(os.path.join(scratch, "state.sqlite"))
+        start = time.monotonic()
+        try:
+            asyncio.run(
+                main_async(
+                    hosts,
+                    os.path.join(scratch, "nodeinfo"),
+                    ratelimit,
+                    ratelimit_key,
+                    subnet_bits_v4,
+                    subnet_bits_v6,
+                    status_interval,
+                    20,
+                    0,
+                    STATE_CHECKPOINT_SECS,
+                    concurrency_bounds=concurrency_bounds,
+                )
+            )
+        finally:
+            elapsed = time.monotonic() - start
+            stop.set()
+            try:
+                log = log_recv.recv()
+            except EOFError:
+                log = []
+                print(f"# Benchmark: mock fediverse exited ({farm.exitcode}) without its request log",
+                      file=sys.stderr)
+            farm.join()
+            state_store.close()
+
+    # Sustained rate: between the 10th and 90th percentile of hosts finishing
+    finished = sorted({host: ts for ts, host, _, _, _ in log}.values())
+    sustained = 0.0
+    if len(finished) >= 10:
+        lo, hi = finished[len(finished) // 10], finished[len(finished) * 9 // 10]
+        if hi > lo:
+            sustained = (len(finished) * 8 // 10) / (hi - lo)
+
+    def key_of(host: str, addr: str) -> str:
+        if ratelimit_key == "host":
+            return host
+        if ratelimit_key == "ip":
+            return addr
+        # subnet, and asn/org (the farm is not in any routing table)
+        return str(ipaddress.ip_network(f"{addr}/{subnet_bits_v4}", strict=False))
+
+    polite = mock_fediverse.politeness_report(
+        log, key_of, math.ceil(max(1.0, ratelimit)) * REQUESTS_PER_FETCH_MAX
+    )
+    totals: Dict[str, int] = {}
+    for hs in stats_hosts.values():
+        for name, value in hs.items():
+            if isinstance(value, int):
+                totals[name] = totals.get(name, 0) + value
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    print("# Benchmark results", file=sys.stderr)
+    print(
+        f"# hosts={len(hosts)} elapsed={elapsed:.1f}s rate={len(hosts) / max(elapsed, 0.001):.1f} hosts/s"
+        f" sustained={sustained:.1f} hosts/s requests={len(log)}",
+        file=sys.stderr,
+    )
+    print(
+        "# outcomes " + " ".join(f"{name}={value}" for name, value in sorted(totals.items())),
+        file=sys.stderr,
+    )
+    print(
+        f"# politeness keys={polite['keys']} max_per_key={polite['max_per_second']}/s"
+        f" (allowed {polite['allowed_per_second']}) keys_over={polite['keys_over']}"
+        f" requests_over={polite['requests_over']}",
+        file=sys.stderr,
+    )
+    print(f"# peak_rss={peak_mb:.0f}MiB", file=sys.stderr)
+    print(latency_stats.status_line(), file=sys.stderr)
+    print(connection_status_line(), file=sys.stderr)
+
 async def run_rate_limit_self_test(rate: float, seconds: float, hosts: int, workers: int) -> None:
     if rate <= 0:
         print("# Self-test requires a positive --ratelimit value.", file=sys.stderr)
@@ -957,12 +3652,24 @@ async def run_rate_limit_self_test(rate: float, seconds: float, hosts: int, work
 # Entry point
 # ---------------------------------------------------------------------
 def main() -> None:
-    global ROBOTS_TTL_SECS, NODEINFO_TTL_SECS, ERROR_TTL_SECS
+    global ROBOTS_TTL_SECS, NODEINFO_TTL_SECS, ERROR_TTL_SECS, NODEINFO_LINK_TTL_SECS
+    global REVISIT_ADAPTIVE, REVISIT_MIN_SECS, REVISIT_MAX_SECS, LOW_CHURN_SHARE
+    global WRITER_QUEUE_SIZE, ROBOTS_MAX_BYTES, WELLKNOWN_MAX_BYTES, NODEINFO_MAX_BYTES
+    global METRICS_FILE, METRICS_PORT, METRICS_INTERVAL_SECS
+    global MAU_TIERS, MAU_HEAD_SHARE, MAU_TAIL_TTL_FACTOR, mau_tier_of
+    global ERROR_BACKOFF_BASE_SECS, ERROR_BACKOFF_MAX_SECS
+    global DISCOVERY, DISCOVER_MAX_PENDING, PEERS_TTL_SECS, PEERS_MAX_BYTES, discovery_known
+    global LOG_LEVEL, LOG_SAMPLE, LOG_WINDOW_SECS, LOG_JSONL
 
     parser = argparse.ArgumentParser(description="Fetch NodeInfo documents for hosts.")
     parser.add_argument("hosts_json", nargs="?", help="JSON file containing array of hostnames")
     parser.add_argument("nodeinfo_dir", nargs="?", help="Directory to store hostname.json NodeInfo docs")
-    parser.add_argument("state_file", nargs="?", help="JSON file to track robots/nodeinfo state across runs")
+    parser.add_argument(
+        "state_file",
+        nargs="?",
+        help="SQLite file to track robots/nodeinfo state across runs"
+             " (a .json path is imported once into a .sqlite file next to it)",
+    )
     parser.add_argument(
         "--robots-ttl-hours",
         type=float,
@@ -975,11 +3682,127 @@ def main() -> None:
         default=24.0, # One day
         help="Minimum hours between re-fetching NodeInfo for a host (0 = always re-fetch)",
     )
+    parser.add_argument(
+        "--nodeinfo-link-ttl-hours",
+        type=float,
+        default=24.0*30, # One month
+        help="Hours to reuse a host's NodeInfo href before re-reading /.well-known/nodeinfo (0 = always)",
+    )
+    parser.add_argument(
+        "--adaptive-revisit",
+        action="store_true",
+        help="Revisit each host at an interval adapted to how often its NodeInfo changes",
+    )
+    parser.add_argument(
+        "--revisit-min-hours",
+        type=float,
+        default=None,
+        help="Shortest adaptive revisit interval (default: --nodeinfo-ttl-hours)",
+    )
+    parser.add_argument(
+        "--revisit-max-hours",
+        type=float,
+        default=24.0*14, # Two weeks
+        help="Longest adaptive revisit interval",
+    )
+    parser.add_argument(
+        "--low-churn-share",
+        type=float,
+        default=LOW_CHURN_SHARE,
+        help="Max fraction of a crawl spent on hosts that rarely change (with --adaptive-revisit)",
+    )
     parser.add_argument(
         "--error-ttl-hours",
         type=float,
         default=6.0,
-        help="Minimum hours between retries after an error (0 = disable error TTL)",
+        help="Minimum hours between retries after an error (0 = no flat error TTL;"
+             " the --error-backoff delays still apply)",
+    )
+    parser.add_argument(
+        "--error-backoff",
+        default="",
+        help="First retry delay in hours per error class, e.g. \"dns=48,http_5xx=3\""
+             " (classes: " + ", ".join(
+                 f"{name}={secs / 3600:g}" for name, secs in ERROR_BACKOFF_BASE_SECS.items()
+             ) + "); doubles with each consecutive failure",
+    )
+    parser.add_argument(
+        "--error-backoff-max-hours",
+        type=float,
+        default=ERROR_BACKOFF_MAX_SECS / 3600.0,
+        help="Longest retry delay for a persistently failing host",
+    )
+    parser.add_argument(
+        "--checkpoint-secs",
+        type=float,
+        default=STATE_CHECKPOINT_SECS,
+        help="Seconds between state checkpoints during a crawl (0 = only at exit)",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Append NodeInfo documents to a packed, deduplicated archive in"
+             " nodeinfo_dir/archive instead of writing one JSON file per fetch",
+    )
+    parser.add_argument(
+        "--weights",
+        help="MAU CSV from parse-nodeinfo.py, or a directory of them (newest is used),"
+             " e.g. data/fedi-mau. Enables freshness tiers and MAU-first ordering",
+    )
+    parser.add_argument(
+        "--head-mau-share",
+        type=float,
+        default=MAU_HEAD_SHARE,
+        help="With --weights: the largest hosts covering this share of MAU are"
+             " fetched every run (after their NodeInfo TTL) and before other hosts",
+    )
+    parser.add_argument(
+        "--tail-ttl-factor",
+        type=float,
+        default=MAU_TAIL_TTL_FACTOR,
+        help="With --weights: NodeInfo TTL multiplier for hosts outside the head tier",
+    )
+    parser.add_argument(
+        "--discover",
+        action="store_true",
+        help="Also crawl hosts not in hosts_json: peers listed by Mastodon-compatible"
+             " instances and the --discover-static lists, queued after known hosts",
+    )
+    parser.add_argument(
+        "--discover-static",
+        action="append",
+        help="CSV host list (domain, Domain, hostname or name column) to seed"
+             " discovery from; may be repeated (default: the data-static lists)",
+    )
+    parser.add_argument(
+        "--discover-max",
+        type=int,
+        default=DISCOVER_MAX_PENDING,
+        help="With --discover: most untried discovered hosts added per run (or daemon round)",
+    )
+    parser.add_argument(
+        "--peers-ttl-hours",
+        type=float,
+        default=PEERS_TTL_SECS / 3600,
+        help="With --discover: hours between peer list fetches per instance",
+    )
+    parser.add_argument(
+        "--max-peers-kib",
+        type=int,
+        default=PEERS_MAX_BYTES // 1024,
+        help="Largest peer list accepted",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run continuously, pacing fetches across each revisit cycle and"
+             " re-reading hosts_json when it changes (stop with SIGINT/SIGTERM)",
+    )
+    parser.add_argument(
+        "--daemon-tick-secs",
+        type=float,
+        default=DAEMON_TICK_SECS,
+        help="Seconds between scheduling rounds in --daemon mode",
     )
     parser.add_argument(
         "--N",
@@ -995,9 +3818,28 @@ def main() -> None:
     )
     parser.add_argument(
         "--ratelimit-key",
-        choices=["host", "ip", "subnet"],
+        choices=["host", "ip", "subnet", "asn", "org"],
         default="host",
-        help="Key rate limiting by hostname, resolved IP, or resolved IP subnet"
+        help="Key rate limiting by hostname, resolved IP, resolved IP subnet,"
+             " or the origin AS / organisation of the resolved IP"
+             " (falling back to the subnet when it is not in the routing table)"
+    )
+    parser.add_argument(
+        "--ratelimit-config",
+        default=RATELIMITS_PATH,
+        help="JSON file of per-key rate limits (default: ratelimits.json next to this script)",
+    )
+    parser.add_argument(
+        "--asn-table",
+        action="append",
+        default=[],
+        help="Prefix-to-ASN table (\"prefix asn [org]\" per line) for --ratelimit-key=asn/org;"
+             " may be repeated",
+    )
+    parser.add_argument(
+        "--geo-cache",
+        default=GEO_CACHE_PATH,
+        help="IPinfo cache from data-fetchers/geo, also used for --ratelimit-key=asn/org",
     )
     parser.add_argument(
         "--ratelimit-subnet-v4",
@@ -1029,6 +3871,107 @@ def main() -> None:
         default=0,
         help="Maximum number of concurrent connections"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Crawl with this many processes, each owning a disjoint set of"
+             " rate-limit keys (batch mode only)",
+    )
+    parser.add_argument(
+        "--writer-queue",
+        type=int,
+        default=WRITER_QUEUE_SIZE,
+        help="Max results waiting for the background writer before fetches pause",
+    )
+    parser.add_argument(
+        "--max-robots-kib",
+        type=int,
+        default=ROBOTS_MAX_BYTES // 1024,
+        help="robots.txt bytes parsed per origin; the rest is ignored",
+    )
+    parser.add_argument(
+        "--max-wellknown-kib",
+        type=int,
+        default=WELLKNOWN_MAX_BYTES // 1024,
+        help="Largest /.well-known/nodeinfo body accepted",
+    )
+    parser.add_argument(
+        "--max-nodeinfo-kib",
+        type=int,
+        default=NODEINFO_MAX_BYTES // 1024,
+        help="Largest NodeInfo document accepted",
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Adapt the number of in-flight requests (AIMD) between"
+             " --min-concurrent and --max-concurrent (default 256)",
+    )
+    parser.add_argument(
+        "--min-concurrent",
+        type=int,
+        default=10,
+        help="Lower bound for --adaptive-concurrency",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=list(LOG_LEVELS),
+        default=LOG_LEVEL,
+        help="Least severe per-request event (HTTP/network/JSON errors are info) to report",
+    )
+    parser.add_argument(
+        "--log-sample",
+        type=int,
+        default=LOG_SAMPLE,
+        help="Per-request events printed per class (e.g. \"HTTP 404\") in each"
+             " --log-window-secs; the rest are only counted",
+    )
+    parser.add_argument(
+        "--log-window-secs",
+        type=float,
+        default=LOG_WINDOW_SECS,
+        help="Window for --log-sample, after which suppressed events are summarised",
+    )
+    parser.add_argument(
+        "--log-jsonl",
+        help="Append every per-request event to this file as JSON lines"
+             " (with --workers, shard N writes FILE.shard-N)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Rewrite crawl metrics in OpenMetrics text format to this file"
+             " (e.g. for the node_exporter textfile collector)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve crawl metrics on http://127.0.0.1:PORT/metrics."
+             " With --workers, shard N uses PORT+1+N and writes FILE.shard-N",
+    )
+    parser.add_argument(
+        "--metrics-interval-secs",
+        type=float,
+        default=METRICS_INTERVAL_SECS,
+        help="Seconds between --metrics-file rewrites",
+    )
+    parser.add_argument(
+        "--latency-report",
+        help="Write per-stage latency percentiles (overall, per status class"
+             " and per rate-limit key) to this JSON file at the end of the crawl",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Crawl a local mock fediverse end to end and report throughput,"
+             " politeness and memory (no arguments needed)",
+    )
+    for name, kind in BENCHMARK_OPTIONS:
+        parser.add_argument(
+            f"--benchmark-{name.replace('_', '-')}",
+            type=kind,
+            help=f"Mock fediverse {name.replace('_', ' ')} (default in mock_fediverse.DEFAULTS)",
+        )
     parser.add_argument(
         "--self-test",
         action="store_true",
@@ -1066,36 +4009,156 @@ def main() -> None:
         )
         return
 
-    if not args.hosts_json or not args.nodeinfo_dir or not args.state_file:
-        parser.error("hosts_json, nodeinfo_dir, and state_file are required unless --self-test is set")
+    if not args.benchmark and (not args.hosts_json or not args.nodeinfo_dir or not args.state_file):
+        parser.error("hosts_json, nodeinfo_dir, and state_file are required unless --self-test or --benchmark is set")
+    if args.workers > 1 and args.daemon:
+        parser.error("--workers cannot be combined with --daemon")
 
     ROBOTS_TTL_SECS = max(0.0, args.robots_ttl_hours) * 3600.0
     NODEINFO_TTL_SECS = max(0.0, args.nodeinfo_ttl_hours) * 3600.0
     ERROR_TTL_SECS = max(0.0, args.error_ttl_hours) * 3600.0
+    try:
+        ERROR_BACKOFF_BASE_SECS = parse_backoff(args.error_backoff)
+    except ValueError as e:
+        parser.error(f"--error-backoff: {e}")
+    ERROR_BACKOFF_MAX_SECS = max(0.0, args.error_backoff_max_hours) * 3600.0
+    NODEINFO_LINK_TTL_SECS = max(0.0, args.nodeinfo_link_ttl_hours) * 3600.0
+    WRITER_QUEUE_SIZE = max(1, args.writer_queue)
+    ROBOTS_MAX_BYTES = max(1, args.max_robots_kib) * 1024
+    WELLKNOWN_MAX_BYTES = max(1, args.max_wellknown_kib) * 1024
+    NODEINFO_MAX_BYTES = max(1, args.max_nodeinfo_kib) * 1024
+    REVISIT_ADAPTIVE = args.adaptive_revisit
+    if args.revisit_min_hours is None:
+        REVISIT_MIN_SECS = NODEINFO_TTL_SECS
+    else:
+        REVISIT_MIN_SECS = max(0.0, args.revisit_min_hours) * 3600.0
+    REVISIT_MAX_SECS = max(REVISIT_MIN_SECS, args.revisit_max_hours * 3600.0)
+    LOW_CHURN_SHARE = min(1.0, max(0.0, args.low_churn_share))
+
+    global KEY_RATE_LIMITS, prefix_index
+    METRICS_FILE = args.metrics_file
+    METRICS_PORT = args.metrics_port
+    METRICS_INTERVAL_SECS = max(1.0, args.metrics_interval_secs)
+    LOG_LEVEL = args.log_level
+    LOG_SAMPLE = max(0, args.log_sample)
+    LOG_WINDOW_SECS = max(1.0, args.log_window_secs)
+    LOG_JSONL = args.log_jsonl
+    try:
+        KEY_RATE_LIMITS = load_ratelimits(args.ratelimit_config)
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"# Warning: could not read rate limits from {args.ratelimit_config}: {e}", file=sys.stderr)
+    if args.ratelimit_key in ("asn", "org"):
+        prefix_index = PrefixIndex()
+        sources = [(load_geo_cache, args.geo_cache)] + [(load_asn_table, path) for path in args.asn_table]
+        for loader, path in sources:
+            try:
+                added = loader(prefix_index, path)
+            except (OSError, ValueError) as e:
+                print(f"# Warning: could not load prefixes from {path}: {e}", file=sys.stderr)
+                continue
+            print(f"# Loaded {added} prefixes from {path}", file=sys.stderr)
 
-    if args.max_concurrent:
+    concurrency_bounds = None
+    if args.adaptive_concurrency:
+        concurrency_bounds = (args.min_concurrent, args.max_concurrent or 256)
+    elif args.max_concurrent:
         global MAX_CONCURRENT
         MAX_CONCURRENT = args.max_concurrent
 
+    if args.benchmark:
+        run_benchmark(
+            {name: getattr(args, f"benchmark_{name}") for name, _ in BENCHMARK_OPTIONS},
+            args.ratelimit,
+            args.ratelimit_key,
+            args.ratelimit_subnet_v4,
+            args.ratelimit_subnet_v6,
+            args.status_interval,
+            concurrency_bounds,
+        )
+        return
+
     hosts = load_hostnames(args.hosts_json)
 
     print(f"# Loaded {len(hosts)} unique hosts from {args.hosts_json}", file=sys.stderr)
 
     # Ordering and limiting happens in main_async.
 
+    if args.weights:
+        try:
+            weights_path, weights = load_mau_weights(args.weights)
+        except (OSError, ValueError, csv.Error) as e:
+            parser.error(f"could not read --weights {args.weights}: {e}")
+        MAU_TIERS = True
+        MAU_HEAD_SHARE = min(1.0, max(0.0, args.head_mau_share))
+        MAU_TAIL_TTL_FACTOR = max(1.0, args.tail_ttl_factor)
+        mau_tier_of = mau_tiers(weights, MAU_HEAD_SHARE)
+        head = sum(1 for tier in mau_tier_of.values() if tier == "head")
+        print(
+            f"# MAU tiers from {weights_path}: {head} of {len(weights)} hosts cover"
+            f" {MAU_HEAD_SHARE:.0%} of {sum(weights.values())} MAU; others use"
+            f" {MAU_TAIL_TTL_FACTOR:g}x the NodeInfo TTL",
+            file=sys.stderr,
+        )
+
     load_state(args.state_file)
-    global state_hosts
-    print(f"# Loaded {len(state_hosts)} state entries from {args.state_file}")
+    print(f"# Loaded {state_store.count()} state entries from {state_store.path}")
+    if MAU_TIERS:
+        changed = state_store.apply_tiers()
+        if changed:
+            print(f"# Updated the MAU tier of {changed} hosts", file=sys.stderr)
+
+    if args.discover:
+        DISCOVERY = True
+        DISCOVER_MAX_PENDING = max(0, args.discover_max)
+        PEERS_TTL_SECS = args.peers_ttl_hours * 3600
+        PEERS_MAX_BYTES = args.max_peers_kib * 1024
+        discovery_known = HostSet(hosts)
+        discovery_known.update(state_store.known_hosts())
+        for path in args.discover_static or DISCOVERY_STATIC_FILES:
+            source = os.path.splitext(os.path.basename(path))[0]
+            try:
+                rows = new_frontier_rows(load_static_candidates(path), source)
+            except (OSError, ValueError, csv.Error) as e:
+                print(f"# Warning: could not read {path}: {e}", file=sys.stderr)
+                continue
+            state_store.add_frontier(rows)
+            print(f"# Discovered {len(rows)} new hosts in {path}", file=sys.stderr)
+        listed = len(hosts)
+        hosts = with_discovered(hosts)
+        print(
+            f"# Discovery: {len(discovery_known)} known hosts, {len(hosts) - listed} added to"
+            f" this run ({len(frontier_pending)} never fetched successfully)",
+            file=sys.stderr,
+        )
 
     os.makedirs(args.nodeinfo_dir, exist_ok=True)
     print(f"# Created {args.nodeinfo_dir}")
 
+    global nodeinfo_archive
+    if args.archive:
+        nodeinfo_archive = NodeInfoArchive.for_nodeinfo_dir(args.nodeinfo_dir, writable=True)
+
     try:
+        if args.workers > 1:
+            run_sharded(
+                args.workers,
+                hosts,
+                args.nodeinfo_dir,
+                args.ratelimit,
+                args.ratelimit_key,
+                args.ratelimit_subnet_v4,
+                args.ratelimit_subnet_v6,
+                args.status_interval,
+                args.status_max_keys,
+                args.N,
+                args.checkpoint_secs,
+                concurrency_bounds,
+            )
+            return
         asyncio.run(
             main_async(
                 hosts,
                 args.nodeinfo_dir,
-                args.state_file,
                 args.ratelimit,
                 args.ratelimit_key,
                 args.ratelimit_subnet_v4,
@@ -1103,15 +4166,32 @@ def main() -> None:
                 args.status_interval,
                 args.status_max_keys,
                 args.N,
+                args.checkpoint_secs,
+                args.daemon,
+                args.hosts_json,
+                max(1.0, args.daemon_tick_secs),
+                concurrency_bounds,
             )
         )
     except KeyboardInterrupt:
-        # Ctrl-C: try to persist whatever is in state_hosts right now
+        # Ctrl-C: try to persist whatever state has not been checkpointed yet
         print("# Caught KeyboardInterrupt, saving state before exit...", file=sys.stderr)
-        save_state(args.state_file)
+        save_state()
         sys.exit(1)
     finally:
+        if nodeinfo_archive is not None:
+            nodeinfo_archive.close()
+        close_snapshot_reader()
+        state_store.close()
         print_stats(sys.stderr)
+        print(latency_stats.status_line(), file=sys.stderr)
+        print(connection_status_line(), file=sys.stderr)
+        if args.latency_report:
+            try:
+                with open(args.latency_report, "w", encoding="utf-8") as f:
+                    json.dump(latency_stats.report(), f, indent=2)
+            except OSError as e:
+                print(f"# Warning: could not write {args.latency_report}: {e}", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,233 @@
+"""
+A local server farm impersonating many fediverse instances, for load
+testing fetch-nodeinfo.py without touching real servers.
+
+Instances are named i<N>.fedi.test and spread over loopback addresses
+127.1.x.y (several instances per address, like shared hosting). One aiohttp
+server listens on every address and picks the instance from the Host
+header. Each instance gets a deterministic profile from the seed: response
+latency, robots.txt rules, a redirected NodeInfo URL, an oversized
+document, or a 429/503 on its first request.
+
+The farm runs in its own process so the crawler's memory and CPU can be
+measured alone. Every request is logged and sent back at the end, so the
+caller can check politeness. fetch-nodeinfo.py --benchmark drives it.
+"""
+import asyncio
+import ipaddress
+import random
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+
+DOMAIN = "fedi.test"
+BASE_ADDRESS = ipaddress.ip_address("127.1.0.1")
+OVERSIZE_BYTES = 2 * 1024 * 1024
+SOFTWARE = ("mastodon", "pleroma", "misskey", "lemmy", "peertube", "pixelfed", "gotosocial")
+
+DEFAULTS = {
+    "instances": 1000,
+    "addresses": 64,
+    "port": 18400,
+    "latency_ms": 20.0,
+    "jitter_ms": 20.0,
+    "share_429": 0.02,
+    "share_503": 0.02,
+    "share_disallow": 0.02,
+    "share_redirect": 0.05,
+    "share_oversize": 0.01,
+    "seed": 1,
+}
+
+def instance_host(index: int) -> str:
+    return f"i{index}.{DOMAIN}"
+
+def instance_index(host: str) -> Optional[int]:
+    name = host.split(":", 1)[0]
+    if not name.endswith("." + DOMAIN) or not name.startswith("i"):
+        return None
+    try:
+        return int(name[1:-len(DOMAIN) - 1])
+    except ValueError:
+        return None
+
+def address_for(index: int, addresses: int) -> str:
+    return str(BASE_ADDRESS + index % max(1, addresses))
+
+def instance_hosts(config: Dict) -> List[str]:
+    """Host list for the crawler, with the farm's port."""
+    return [f"{instance_host(i)}:{config['port']}" for i in range(config["instances"])]
+
+def profile(config: Dict, index: int) -> Dict:
+    """Behaviour of instance `index`; the same for a given seed."""
+    rng = random.Random(config["seed"] * 1_000_003 + index)
+    return {
+        "latency": max(0.0, config["latency_ms"] + rng.uniform(0.0, config["jitter_ms"])) / 1000.0,
+        "disallow": rng.random() < config["share_disallow"],
+        "redirect": rng.random() < config["share_redirect"],
+        "oversize": rng.random() < config["share_oversize"],
+        "first_429": rng.random() < config["share_429"],
+        "first_503": rng.random() < config["share_503"],
+        "software": rng.choice(SOFTWARE),
+        "users": int(rng.paretovariate(1.2) * 10),
+    }
+
+class MockResolver(AbstractResolver):
+    """Resolves *.fedi.test to the farm's loopback addresses, and nothing else."""
+
+    def __init__(self, addresses: int):
+        self._addresses = addresses
+
+    def address(self, host: str) -> Optional[str]:
+        index = instance_index(host)
+        if index is None:
+            return None
+        return address_for(index, self._addresses)
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict]:
+        addr = self.address(host)
+        if addr is None:
+            raise OSError(f"mock resolver: unknown host {host}")
+        return [{
+            "hostname": host,
+            "host": addr,
+            "port": port,
+            "family": socket.AF_INET,
+            "proto": 0,
+            "flags": socket.AI_NUMERICHOST,
+        }]
+
+    async def close(self) -> None:
+        pass
+
+def make_app(config: Dict, log: List[Tuple[float, str, str, str, int]]) -> web.Application:
+    profiles: Dict[int, Dict] = {}
+    first_seen: Dict[Tuple[int, str], bool] = {}
+
+    def get_profile(index: int) -> Dict:
+        p = profiles.get(index)
+        if p is None:
+            p = profiles[index] = profile(config, index)
+        return p
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        host = request.host
+        index = instance_index(host)
+        path = request.path
+        sockname = request.transport.get_extra_info("sockname") if request.transport else None
+        status = 404
+        try:
+            if index is None or index >= config["instances"]:
+                return web.Response(status=404)
+            p = get_profile(index)
+            await asyncio.sleep(p["latency"])
+            base = f"http://{host}"
+            first = (index, path) not in first_seen
+            first_seen[(index, path)] = True
+
+            if path == "/robots.txt":
+                rules = "User-agent: *\nDisallow: /.well-known/nodeinfo\n" if p["disallow"] else "User-agent: *\nDisallow:\n"
+                status = 200
+                return web.Response(text=rules)
+
+            if path == "/.well-known/nodeinfo":
+                if p["first_429"] and first:
+                    status = 429
+                    return web.Response(status=429, headers={"Retry-After": "1"})
+                href = f"{base}/nodeinfo-old/2.0" if p["redirect"] else f"{base}/nodeinfo/2.0"
+                status = 200
+                return web.json_response({"links": [
+                    {"rel": "http://nodeinfo.diaspora.software/ns/schema/2.0", "href": href},
+                ]})
+
+            if path == "/nodeinfo-old/2.0":
+                status = 301
+                raise web.HTTPMovedPermanently(f"{base}/nodeinfo/2.0")
+
+            if path == "/nodeinfo/2.0":
+                if p["first_503"] and first:
+                    status = 503
+                    return web.Response(status=503)
+                doc = {
+                    "version": "2.0",
+                    "software": {"name": p["software"], "version": "1.0.0"},
+                    "protocols": ["activitypub"],
+                    "openRegistrations": index % 2 == 0,
+                    "usage": {"users": {"total": p["users"], "activeMonth": p["users"] // 3}},
+                    "metadata": {},
+                }
+                if p["oversize"]:
+                    doc["metadata"]["padding"] = "x" * OVERSIZE_BYTES
+                status = 200
+                return web.json_response(doc)
+
+            return web.Response(status=404)
+        finally:
+            log.append((time.monotonic(), host.split(":", 1)[0], sockname[0] if sockname else "", path, status))
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handle)
+    return app
+
+async def run_farm(config: Dict, ready, stop, log: List) -> None:
+    runner = web.AppRunner(make_app(config, log), access_log=None)
+    await runner.setup()
+    for i in range(min(config["addresses"], config["instances"])):
+        site = web.TCPSite(runner, address_for(i, config["addresses"]), config["port"], backlog=1024)
+        await site.start()
+    if ready is not None:
+        ready.set()
+    try:
+        while stop is None or not stop.is_set():
+            await asyncio.sleep(0.2)
+    finally:
+        await runner.cleanup()
+
+def serve_farm(config: Dict, ready, stop, conn) -> None:
+    """Process entry point: run until `stop` is set, then send the request log over `conn`."""
+    log: List = []
+    try:
+        asyncio.run(run_farm(config, ready, stop, log))
+    finally:
+        if conn is not None:
+            conn.send(log)
+            conn.close()
+
+def politeness_report(
+    log: List[Tuple[float, str, str, str, int]],
+    key_of,
+    max_per_second: int,
+) -> Dict:
+    """
+    Slide a one-second window over each key's requests. Returns the worst
+    count seen and the keys (and requests) that went over `max_per_second`.
+    """
+    by_key: Dict[str, List[float]] = {}
+    for ts, host, addr, _, _ in log:
+        by_key.setdefault(key_of(host, addr), []).append(ts)
+    worst = 0
+    over_keys = 0
+    over_requests = 0
+    for times in by_key.values():
+        times.sort()
+        lo = 0
+        key_over = False
+        for hi, ts in enumerate(times):
+            while ts - times[lo] >= 1.0:
+                lo += 1
+            in_window = hi - lo + 1
+            worst = max(worst, in_window)
+            if in_window > max_per_second:
+                over_requests += 1
+                key_over = True
+        over_keys += key_over
+    return {
+        "keys": len(by_key),
+        "max_per_second": worst,
+        "allowed_per_second": max_per_second,
+        "keys_over": over_keys,
+        "requests_over": over_requests,
+    }
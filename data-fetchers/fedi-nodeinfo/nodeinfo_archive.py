@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Packed, deduplicated storage for NodeInfo snapshots.
+
+Instead of nodeinfo_dir/<host>/<timestamp>.json, documents are kept under
+nodeinfo_dir/archive/:
+
+  seg-NNNNNN.bin   append-only segment files of zlib-compressed documents
+  index.sqlite     blob locations (by SHA-256 of the document) and a
+                   per-host list of snapshot timestamps referencing them
+
+A document identical to one already stored only adds a snapshot row. Each
+segment record starts with a small header (magic, digest, length) so the
+blob table can be rebuilt from the segments if needed.
+
+Run directly to pack existing per-file directories into the archive:
+
+  nodeinfo_archive.py pack data/nodeinfo [--remove]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import sys
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ARCHIVE_DIRNAME = "archive"
+INDEX_FILENAME = "index.sqlite"
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+RECORD_MAGIC = b"NIA1"
+RECORD_HEADER = struct.Struct(">4s32sI")
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest BLOB PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    host TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    nodeinfo_url TEXT,
+    PRIMARY KEY (host, ts)
+);
+"""
+
+def sanitize_filename(host: str) -> str:
+    """Make sure hostname is safe for filenames."""
+    return re.sub(r"[^A-Za-z0-9._-]", "_", host)
+
+def archive_path(nodeinfo_dir: str) -> str:
+    return os.path.join(nodeinfo_dir, ARCHIVE_DIRNAME)
+
+def has_archive(nodeinfo_dir: str) -> bool:
+    return os.path.exists(os.path.join(archive_path(nodeinfo_dir), INDEX_FILENAME))
+
+def encode_document(nodeinfo: object) -> bytes:
+    """Canonical encoding, so equal documents hash the same."""
+    return json.dumps(
+        nodeinfo, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    ).encode("utf-8")
+
+class NodeInfoArchive:
+    """
+    Reader/writer for a NodeInfo archive directory.
+
+    Writes go to the current segment and an open index transaction;
+    commit() flushes the segment and commits the index, so a crash loses
+    at most the uncommitted snapshots.
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        if writable:
+            os.makedirs(path, exist_ok=True)
+        # Writers may hand the archive to a background thread
+        self._conn = sqlite3.connect(os.path.join(path, INDEX_FILENAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(INDEX_SCHEMA)
+        self._readers: Dict[int, object] = {}
+        self._segment = 0
+        self._segment_file = None
+        if writable:
+            self._open_segment()
+
+    @classmethod
+    def for_nodeinfo_dir(cls, nodeinfo_dir: str, writable: bool = False) -> "NodeInfoArchive":
+        return cls(archive_path(nodeinfo_dir), writable=writable)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"seg-{segment:06d}.bin")
+
+    def _open_segment(self) -> None:
+        row = self._conn.execute("SELECT MAX(segment) FROM blobs").fetchone()
+        segment = row[0] if row and row[0] is not None else 1
+        while os.path.exists(self._segment_path(segment + 1)):
+            segment += 1
+        if os.path.exists(self._segment_path(segment)) and \
+                os.path.getsize(self._segment_path(segment)) >= SEGMENT_MAX_BYTES:
+            segment += 1
+        self._segment = segment
+        self._segment_file = open(self._segment_path(segment), "ab")
+
+    # -----------------------------------------------------------------
+    # Writing
+    # -----------------------------------------------------------------
+    def _store_blob(self, digest: bytes, raw: bytes) -> None:
+        if self._conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone():
+            return
+        payload = zlib.compress(raw, 6)
+        if self._segment_file.tell() + RECORD_HEADER.size + len(payload) > SEGMENT_MAX_BYTES \
+                and self._segment_file.tell() > 0:
+            self._segment_file.close()
+            self._segment += 1
+            self._segment_file = open(self._segment_path(self._segment), "ab")
+        self._segment_file.write(RECORD_HEADER.pack(RECORD_MAGIC, digest, len(payload)))
+        offset = self._segment_file.tell()
+        self._segment_file.write(payload)
+        self._conn.execute(
+            "INSERT INTO blobs (digest, segment, offset, length) VALUES (?, ?, ?, ?)",
+            (digest, self._segment, offset, len(payload)),
+        )
+
+    def append(self, host: str, ts: str, nodeinfo_url: Optional[str], nodeinfo: object) -> bool:
+        """
+        Record a snapshot of `host` taken at `ts` (the timestamp string used
+        as the file stem in the per-file layout). Returns True if the
+        document was new and had to be stored.
+        """
+        raw = encode_document(nodeinfo)
+        digest = hashlib.sha256(raw).digest()
+        before = self._conn.total_changes
+        self._store_blob(digest, raw)
+        stored = self._conn.total_changes != before
+        self._conn.execute(
+            "INSERT OR REPLACE INTO snapshots (host, ts, digest, nodeinfo_url) VALUES (?, ?, ?, ?)",
+            (host, ts, digest, nodeinfo_url),
+        )
+        return stored
+
+    def commit(self) -> None:
+        if self._segment_file is not None:
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+        self._conn.commit()
+
+    # -----------------------------------------------------------------
+    # Reading
+    # -----------------------------------------------------------------
+    def hosts(self) -> List[str]:
+        return [row[0] for row in self._conn.execute("SELECT DISTINCT host FROM snapshots")]
+
+    def snapshots(self, host: str) -> List[str]:
+        """Snapshot timestamp strings for `host`, oldest first."""
+        return [
+            row[0]
+            for row in self._conn.execute(
+                "SELECT ts FROM snapshots WHERE host = ? ORDER BY ts", (host,)
+            )
+        ]
+
+    def iter_snapshots(self) -> Iterator[Tuple[str, str]]:
+        """All (host, ts) pairs in the archive."""
+        yield from self._conn.execute("SELECT host, ts FROM snapshots ORDER BY host, ts")
+
+    def last_rowid(self) -> int:
+        row = self._conn.execute("SELECT MAX(rowid) FROM snapshots").fetchone()
+        return row[0] or 0
+
+    def iter_snapshots_after(self, rowid: int) -> Iterator[Tuple[int, str, str]]:
+        """
+        (rowid, host, ts) of snapshots recorded after `rowid`, oldest first,
+        so readers can keep up with the archive incrementally.
+        """
+        yield from self._conn.execute(
+            "SELECT rowid, host, ts FROM snapshots WHERE rowid > ? ORDER BY rowid", (rowid,)
+        )
+
+    def _read_blob(self, segment: int, offset: int, length: int) -> bytes:
+        if self._segment_file is not None and segment == self._segment:
+            self._segment_file.flush()
+        f = self._readers.get(segment)
+        if f is None:
+            f = open(self._segment_path(segment), "rb")
+            self._readers[segment] = f
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    def load_raw(self, host: str, ts: str) -> Optional[Tuple[Optional[str], bytes]]:
+        """(nodeinfo_url, encoded document) of a snapshot; None if it is not stored."""
+        row = self._conn.execute(
+            """
+            SELECT s.nodeinfo_url, b.segment, b.offset, b.length
+            FROM snapshots s JOIN blobs b ON b.digest = s.digest
+            WHERE s.host = ? AND s.ts = ?
+            """,
+            (host, ts),
+        ).fetchone()
+        if row is None:
+            return None
+        nodeinfo_url, segment, offset, length = row
+        return nodeinfo_url, self._read_blob(segment, offset, length)
+
+    def load(self, host: str, ts: str) -> Optional[dict]:
+        """
+        Return the snapshot in the same shape as a per-file record:
+        {"hostname", "nodeinfo_url", "nodeinfo"}; None if it is not stored.
+        """
+        stored = self.load_raw(host, ts)
+        if stored is None:
+            return None
+        nodeinfo_url, raw = stored
+        return {
+            "hostname": host,
+            "nodeinfo_url": nodeinfo_url,
+            "nodeinfo": json.loads(raw),
+        }
+
+    def close(self) -> None:
+        if self._segment_file is not None:
+            self.commit()
+            self._segment_file.close()
+            self._segment_file = None
+        for f in self._readers.values():
+            f.close()
+        self._readers.clear()
+        self._conn.close()
+
+# ---------------------------------------------------------------------
+# Packing existing per-file directories
+# ---------------------------------------------------------------------
+def pack_directory(nodeinfo_dir: str, remove: bool = False) -> None:
+    archive = NodeInfoArchive.for_nodeinfo_dir(nodeinfo_dir, writable=True)
+    files = 0
+    stored = 0
+    try:
+        for d in sorted(os.listdir(nodeinfo_dir)):
+            hdir = os.path.join(nodeinfo_dir, d)
+            if d == ARCHIVE_DIRNAME or not os.path.isdir(hdir):
+                continue
+            packed_paths = []
+            for fn in sorted(os.listdir(hdir)):
+                if not fn.endswith(".json"):
+                    continue
+                path = os.path.join(hdir, fn)
+                try:
+                    with open(path, "r", encoding="utf-8") as jf:
+                        record = json.load(jf)
+                except Exception as e:
+                    print(f"# Skipping {path}: {e}", file=sys.stderr)
+                    continue
+                host = record.get("hostname") or d
+                if archive.append(host, fn[:-5], record.get("nodeinfo_url"), record.get("nodeinfo")):
+                    stored += 1
+                files += 1
+                packed_paths.append(path)
+            archive.commit()
+            if remove:
+                for path in packed_paths:
+                    os.remove(path)
+                if not os.listdir(hdir):
+                    os.rmdir(hdir)
+    finally:
+        archive.close()
+    print(f"# Packed {files} files ({stored} distinct documents) into {archive.path}", file=sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage packed NodeInfo archives.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pack = sub.add_parser("pack", help="Pack per-file host directories into the archive")
+    pack.add_argument("nodeinfo_dir")
+    pack.add_argument(
+        "--remove",
+        action="store_true",
+        help="Delete the JSON files once they are committed to the archive",
+    )
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack_directory(args.nodeinfo_dir, remove=args.remove)
+
+if __name__ == "__main__":
+    main()
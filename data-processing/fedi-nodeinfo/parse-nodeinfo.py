@@ -1,13 +1,41 @@
 #!/usr/bin/env python3
 import argparse
+import calendar
+import datetime
 import sys
 import os
 import json
 import csv
 import re
+import hashlib
+import multiprocessing
+import sqlite3
+import time
+from pathlib import Path
 from typing import List, Optional, Tuple, Dict, Set
 
 import yaml
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+CACHE_DIR = REPO_ROOT / "data" / "cache"
+
+# The archive format belongs to the fetcher, which writes it; its reader is
+# imported from there rather than copied (as helpers/update-datafile.py
+# does with centralization_stats). Moving fetch-nodeinfo.py's directory
+# means updating this path.
+sys.path.insert(0, str(REPO_ROOT / "data-fetchers" / "fedi-nodeinfo"))
+try:
+    from nodeinfo_archive import ARCHIVE_DIRNAME, NodeInfoArchive, has_archive, sanitize_filename
+except ImportError as exc:
+    raise SystemExit(
+        "nodeinfo_archive.py not found in data-fetchers/fedi-nodeinfo (it ships with fetch-nodeinfo.py)"
+    ) from exc
+
 def _coerce_int(value: object) -> Optional[int]:
     if value is None:
         return None
@@ -232,8 +260,7 @@ def extract_fields(nodeinfo_wrapper: dict):
 
     return hostname, software_name, software_version, users_total, active_month, protocols, protocols_str
 
-def _parse_now(value: Optional[str]) -> "datetime.datetime":
-    import datetime
+def _parse_now(value: Optional[str]) -> datetime.datetime:
 
     if value is None:
         return datetime.datetime.now(datetime.timezone.utc)
@@ -248,77 +275,282 @@ def _parse_now(value: Optional[str]) -> "datetime.datetime":
         return parsed.replace(tzinfo=datetime.timezone.utc)
     return parsed.astimezone(datetime.timezone.utc)
 
+def _default_manifest_path(nodeinfo_dir: str) -> str:
+    """
+    data/cache/parse-manifest-<id>.sqlite, one per nodeinfo_dir, so a parse
+    never writes into the fetcher's data.
+    """
+    key = hashlib.sha256(os.path.abspath(nodeinfo_dir).encode("utf-8")).hexdigest()[:16]
+    return str(CACHE_DIR / f"parse-manifest-{key}.sqlite")
 
-def main() -> None:
-    import datetime
+# A directory modified this recently may still be changing; scan it again next run
+MANIFEST_SETTLE_NS = 2 * 10**9
 
-    parser = argparse.ArgumentParser(
-        description="Parse nodeinfo JSON into a CSV snapshot.",
-    )
-    parser.add_argument("nodeinfo_dir")
-    parser.add_argument("output_csv")
-    parser.add_argument("max_age_days", nargs="?", type=int, default=30)
-    parser.add_argument(
-        "--now",
-        type=_parse_now,
-        help="ISO-8601 datetime to use as the current time (UTC if naive).",
-    )
-    args = parser.parse_args()
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ts_us INTEGER NOT NULL,
+    in_file INTEGER NOT NULL DEFAULT 0,
+    archive_host TEXT,
+    PRIMARY KEY (dir, name)
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_time ON snapshots (dir, ts_us);
+CREATE TABLE IF NOT EXISTS fields (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    fields TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
 
-    nodeinfo_dir = args.nodeinfo_dir
-    output_csv = args.output_csv
-    max_age_days = args.max_age_days
+# Recreated whenever the extractor changes (see cached_outcomes)
+OUTCOMES_SCHEMA = """
+DROP TABLE IF EXISTS outcomes;
+CREATE TABLE outcomes (
+    dir TEXT PRIMARY KEY,
+    newest TEXT NOT NULL,
+    newest_stat TEXT,
+    oldest TEXT NOT NULL,
+    oldest_stat TEXT,
+    outcome TEXT NOT NULL
+);
+"""
 
-    cutoff = datetime.timedelta(days=max_age_days)
-    now = args.now or datetime.datetime.now(datetime.timezone.utc)
+def _timestamp_us(value: datetime.datetime) -> int:
+    """Exact microseconds since the epoch of an aware datetime."""
+    return calendar.timegm(value.utctimetuple()) * 1_000_000 + value.microsecond
 
-    hostname_dirs = [
-        os.path.join(nodeinfo_dir, d)
-        for d in os.listdir(nodeinfo_dir)
-        if os.path.isdir(os.path.join(nodeinfo_dir, d))
-    ]
+def _snapshot_time_us(fn: str) -> Optional[int]:
+    """Timestamp of a "<datetime>.json" snapshot name, in microseconds (UTC)."""
+    if not fn.endswith(".json"):
+        return None
+    stem = fn[:-5]  # strip ".json"
+    try:
+        ts = datetime.datetime.fromisoformat(stem.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    # Ensure parsed timestamp is also aware UTC
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return _timestamp_us(ts)
 
-    selected_files = []
+class SnapshotManifest:
+    """
+    Persistent index of the snapshots under a nodeinfo_dir, so a run does
+    not have to list every host directory and parse every file name.
 
-    for hdir in hostname_dirs:
-        hostname = os.path.basename(hdir)
-        candidates = []
+    A host directory is only listed again when its mtime has changed (the
+    fetcher adding or removing a file changes it), and then only new names
+    are parsed. Archive snapshots are followed by rowid. The outcome of
+    each host's extraction is kept too, and reused while its selected
+    newest/oldest snapshots (path, size and mtime) and the extractor
+    (script, quirks config) are unchanged. Outcomes of hosts whose
+    snapshots could not be loaded are not kept: the file may have been
+    read while the fetcher was writing it.
 
-        for fn in os.listdir(hdir):
-            if not fn.endswith(".json"):
-                continue
-            path = os.path.join(hdir, fn)
-            stem = fn[:-5]  # strip ".json"
-            try:
-                ts = datetime.datetime.fromisoformat(stem.replace("Z", "+00:00"))
-                # Ensure parsed timestamp is also aware UTC
-                if ts.tzinfo is None:
-                    ts = ts.replace(tzinfo=datetime.timezone.utc)
-                else:
-                    ts = ts.astimezone(datetime.timezone.utc)
-            except Exception:
-                continue
-            candidates.append((ts, path))
+    The fields table caches what the quirks read from each document (see
+    _document_fields), keyed by path relative to nodeinfo_dir plus size and
+    mtime, so a host whose outcome cannot be reused (e.g. a --now backfill
+    picking other snapshots) still need not decode its JSON again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(MANIFEST_SCHEMA)
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def refresh(self, nodeinfo_dir: str) -> int:
+        """Bring the index up to date; returns the number of directories listed."""
+        conn = self._conn
+        known = dict(conn.execute("SELECT name, mtime_ns FROM dirs"))
+        settled_before = time.time_ns() - MANIFEST_SETTLE_NS
+        listed = 0
+        seen: Set[str] = set()
+        with conn:
+            with os.scandir(nodeinfo_dir) as entries:
+                for entry in entries:
+                    if entry.name == ARCHIVE_DIRNAME or not entry.is_dir():
+                        continue
+                    seen.add(entry.name)
+                    mtime_ns = entry.stat().st_mtime_ns
+                    if known.get(entry.name) == mtime_ns:
+                        continue
+                    listed += 1
+                    names = set(os.listdir(entry.path))
+                    indexed = {
+                        name for (name,) in conn.execute(
+                            "SELECT name FROM snapshots WHERE dir = ? AND in_file = 1", (entry.name,)
+                        )
+                    }
+                    conn.executemany(
+                        "UPDATE snapshots SET in_file = 0 WHERE dir = ? AND name = ?",
+                        [(entry.name, name) for name in indexed - names],
+                    )
+                    added = []
+                    for name in names - indexed:
+                        ts_us = _snapshot_time_us(name)
+                        if ts_us is not None:
+                            added.append((entry.name, name, ts_us))
+                    conn.executemany(
+                        """
+                        INSERT INTO snapshots (dir, name, ts_us, in_file) VALUES (?, ?, ?, 1)
+                        ON CONFLICT (dir, name) DO UPDATE SET in_file = 1
+                        """,
+                        added,
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO dirs (name, mtime_ns) VALUES (?, ?)",
+                        (entry.name, mtime_ns if mtime_ns < settled_before else -1),
+                    )
+            for name in set(known) - seen:
+                conn.execute("DELETE FROM dirs WHERE name = ?", (name,))
+                conn.execute("UPDATE snapshots SET in_file = 0 WHERE dir = ?", (name,))
+            self._refresh_archive(nodeinfo_dir)
+            conn.execute("DELETE FROM snapshots WHERE in_file = 0 AND archive_host IS NULL")
+        return listed
+
+    def _refresh_archive(self, nodeinfo_dir: str) -> None:
+        conn = self._conn
+        last = int(self._meta("archive_rowid") or 0)
+        if not has_archive(nodeinfo_dir):
+            if last:
+                conn.execute("UPDATE snapshots SET archive_host = NULL")
+                self._set_meta("archive_rowid", "0")
+            return
+        archive = NodeInfoArchive.for_nodeinfo_dir(nodeinfo_dir)
+        try:
+            if archive.last_rowid() < last:
+                # A different (rebuilt) archive: index it from scratch
+                conn.execute("UPDATE snapshots SET archive_host = NULL")
+                last = 0
+            for rowid, host, ts in archive.iter_snapshots_after(last):
+                fn = ts + ".json"
+                ts_us = _snapshot_time_us(fn)
+                if ts_us is not None:
+                    conn.execute(
+                        """
+                        INSERT INTO snapshots (dir, name, ts_us, archive_host) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (dir, name) DO UPDATE SET archive_host = excluded.archive_host
+                        """,
+                        (sanitize_filename(host), fn, ts_us, host),
+                    )
+                last = rowid
+        finally:
+            archive.close()
+        self._set_meta("archive_rowid", str(last))
+
+    def select(self, nodeinfo_dir: str, oldest_us: int, newest_us: int) -> List[Dict]:
+        """
+        Per host directory, the newest and oldest snapshot taken within
+        [oldest_us, newest_us], sorted by the newest snapshot's path.
+        """
+        bounds = (oldest_us, newest_us)
+        picked: Dict[str, Dict] = {}
+        for label, aggregate in (("newest", "MAX"), ("oldest", "MIN")):
+            # SQLite takes the bare columns from the row holding the MAX/MIN
+            for d, name, _, archive_host in self._conn.execute(
+                f"""
+                SELECT dir, name, {aggregate}(ts_us), archive_host FROM snapshots
+                WHERE ts_us >= ? AND ts_us <= ? GROUP BY dir
+                """,
+                bounds,
+            ):
+                item = picked.setdefault(d, {"dir": d})
+                item[label] = os.path.join(nodeinfo_dir, d, name)
+                item[label + "_ref"] = (archive_host, name[:-5]) if archive_host is not None else None
+        return sorted(picked.values(), key=lambda item: item["newest"])
+
+    def cached_outcomes(self, config: str) -> Dict[str, Tuple[str, str, str, str, Dict]]:
+        """
+        Stored (newest, newest_stat, oldest, oldest_stat, outcome) by
+        directory, or none if `config` has changed.
+        """
+        if self._meta("extractor") != config:
+            self._conn.executescript(OUTCOMES_SCHEMA)
+            with self._conn:
+                self._set_meta("extractor", config)
+            return {}
+        return {
+            row[0]: row[1:5] + (json.loads(row[5]),)
+            for row in self._conn.execute(
+                "SELECT dir, newest, newest_stat, oldest, oldest_stat, outcome FROM outcomes"
+            )
+        }
+
+    def store_outcomes(self, rows: List[Tuple[str, str, str, str, str, Dict]]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO outcomes (dir, newest, newest_stat, oldest, oldest_stat, outcome)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [row[:5] + (json.dumps(row[5]),) for row in rows],
+            )
+
+    def prepare_fields(self, version: str) -> None:
+        """Drop cached document fields computed by another version of the code."""
+        if self._meta("fields") != version:
+            with self._conn:
+                self._conn.execute("DELETE FROM fields")
+                self._set_meta("fields", version)
 
-        if not candidates:
-            continue
+    def store_fields(self, rows: List[Tuple[str, int, int, Dict]]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fields (path, size, mtime_ns, fields) VALUES (?, ?, ?, ?)",
+                [(path, size, mtime_ns, json.dumps(fields)) for path, size, mtime_ns, fields in rows],
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+def _digest(paths: List[str], extra: str = "") -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    digest.update(extra.encode("utf-8"))
+    return digest.hexdigest()
 
-        candidates_recent = [
-            c for c in candidates if c[0] <= now and now - c[0] <= cutoff
-        ]
-        if not candidates_recent:
-            continue
+def _extractor_version(nodeinfo_dir: str) -> str:
+    """Changes whenever cached outcomes could differ: code, quirks or paths."""
+    return _digest([os.path.abspath(__file__), QUIRKS_CONFIG_PATH], nodeinfo_dir)
 
-        ts_newest, path_newest = max(candidates_recent, key=lambda x: x[0])
-        ts_oldest, path_oldest = min(candidates_recent, key=lambda x: x[0])
+def _fields_version() -> str:
+    """Changes whenever cached document fields could differ: the code."""
+    return _digest([os.path.abspath(__file__)])
 
-        selected_files.append({
-            "newest": path_newest,
-            "oldest": path_oldest,
-        })
+def _document_fields(wrapper: dict) -> Dict:
+    """Everything the quirks read from one snapshot document."""
+    return {
+        "fields": list(extract_fields(wrapper)),
+        "federation_disabled": _metadata_federation_disabled(wrapper),
+        "local_posts": _extract_local_posts(wrapper),
+        "local_comments": _extract_local_comments(wrapper),
+        "non_activitypub_users": _extract_metadata_non_activitypub_users(wrapper),
+    }
 
-    selected_files.sort(key=lambda item: item["newest"])
+# Quirks config and archive handle of the process extracting rows: the
+# parent in a serial run, otherwise each pool worker (see _init_extractor).
+_extractor: Dict[str, object] = {}
 
+def _init_extractor(nodeinfo_dir: str, fields_path: Optional[str]) -> None:
     (
         quirks_by_software,
         known_software,
@@ -327,175 +559,481 @@ def main() -> None:
         minimum_versions,
         ignore_domains,
     ) = _load_quirks_config(QUIRKS_CONFIG_PATH)
-    configured_software = (
-        set(known_software)
-        | set(quirks_by_software.keys())
-        | set(misskey_forks)
-        | set(pleroma_forks)
-        | set(minimum_versions.keys())
-    )
+    _extractor.clear()
+    _extractor.update({
+        "quirks_by_software": quirks_by_software,
+        "misskey_forks": misskey_forks,
+        "pleroma_forks": pleroma_forks,
+        "minimum_versions": minimum_versions,
+        "ignore_domains": ignore_domains,
+        "configured_software": (
+            set(known_software)
+            | set(quirks_by_software.keys())
+            | set(misskey_forks)
+            | set(pleroma_forks)
+            | set(minimum_versions.keys())
+        ),
+        "archive": NodeInfoArchive.for_nodeinfo_dir(nodeinfo_dir) if has_archive(nodeinfo_dir) else None,
+        # Read-only; new entries go back to the parent with each outcome
+        "fields_db": (
+            sqlite3.connect(Path(fields_path).resolve().as_uri() + "?mode=ro", uri=True)
+            if fields_path else None
+        ),
+    })
 
-    unknown_software_report = {}
-    quirk_report = {}
-    federation_disabled_count = 0
-    minimum_version_skip_count = 0
+def _close_extractor() -> None:
+    archive = _extractor.get("archive")
+    if archive is not None:
+        archive.close()
+    fields_db = _extractor.get("fields_db")
+    if fields_db is not None:
+        fields_db.close()
+    _extractor.clear()
+
+# The parts of a snapshot _document_fields reads; True keeps the whole value
+_PROJECTION = {
+    "hostname": True,
+    "nodeinfo": {
+        "software": {"name": True, "version": True},
+        "protocols": True,
+        "usage": {
+            "users": {"total": True, "activeMonth": True},
+            "localPosts": True,
+            "localComments": True,
+        },
+        "metadata": {"protocols": True, "users": True, "stats": True, "federation": {"enabled": True}},
+    },
+}
+
+def _project(value: object, spec: object) -> object:
+    """
+    Copy of `value` reduced to the keys in `spec`. Values that are not
+    objects are kept as they are, so the extract functions see the same
+    types (and fail the same way) as on the full document.
+    """
+    if spec is True or not isinstance(value, dict):
+        return value
+    return {key: _project(value[key], sub) for key, sub in spec.items() if key in value}
+
+def _has_float(value: object) -> bool:
+    if isinstance(value, float):
+        return True
+    if isinstance(value, dict):
+        return any(_has_float(v) for v in value.values())
+    if isinstance(value, list):
+        return any(_has_float(v) for v in value)
+    return False
+
+def _decode_projected(raw: bytes, spec: object, fallback) -> object:
+    """
+    Decode `raw` with orjson when it is installed and project it. Anything
+    orjson rejects is handed to `fallback`, the stdlib decoding used
+    before, so invalid documents (and json's extensions such as NaN) give
+    the same result or error message either way. Projections holding a
+    float are decoded again too: orjson reads integers beyond 64 bits as
+    floats where json keeps them exact.
+    """
+    if orjson is not None:
+        try:
+            projected = _project(orjson.loads(raw), spec)
+        except orjson.JSONDecodeError:
+            pass
+        else:
+            if not _has_float(projected):
+                return projected
+    return _project(fallback(), spec)
+
+def _load_wrapper(path: str, ref: Optional[Tuple[str, str]]) -> dict:
+    """
+    Load the projection (see _PROJECTION) of a snapshot from its file, or
+    from the archive when only packed there. Large metadata sections are
+    dropped as soon as the document is decoded.
+    """
+    archive = _extractor.get("archive")
+    if ref is not None and archive is not None and not os.path.exists(path):
+        stored = archive.load_raw(*ref)
+        if stored is None:
+            raise FileNotFoundError(path)
+        nodeinfo_url, raw = stored
+        return {
+            "hostname": ref[0],
+            "nodeinfo_url": nodeinfo_url,
+            "nodeinfo": _decode_projected(raw, _PROJECTION["nodeinfo"], lambda: json.loads(raw)),
+        }
+
+    def load_text() -> object:
+        with open(path, "r", encoding="utf-8") as jf:
+            return json.load(jf)
+
+    if orjson is None:
+        return _project(load_text(), _PROJECTION)
+    with open(path, "rb") as jf:
+        raw = jf.read()
+    return _decode_projected(raw, _PROJECTION, load_text)
+
+def _snapshot_stat(path: str, ref: Optional[Tuple[str, str]]) -> Tuple[int, int]:
+    """(size, mtime_ns) identifying the current content of a snapshot."""
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except FileNotFoundError:
+        if ref is None:
+            raise
+        # Archived snapshots never change
+        return -1, 0
+
+def _stat_key(item: Dict, which: str) -> Optional[str]:
+    """_snapshot_stat() of the item's "newest" or "oldest" snapshot as stored in the manifest."""
+    try:
+        size, mtime_ns = _snapshot_stat(item[which], item[which + "_ref"])
+    except OSError:
+        return None
+    return f"{size} {mtime_ns}"
+
+def _load_fields(item: Dict, which: str, outcome: Dict) -> Dict:
+    """
+    _document_fields() of the item's "newest" or "oldest" snapshot, from the
+    fields cache when the file is unchanged. Freshly computed fields are
+    added to outcome["new_fields"] for the parent to store.
+    """
+    path = item[which]
+    ref = item[which + "_ref"]
+    key = os.path.join(item["dir"], os.path.basename(path))
+    size, mtime_ns = _snapshot_stat(path, ref)
+    fields_db = _extractor.get("fields_db")
+    if fields_db is not None:
+        row = fields_db.execute(
+            "SELECT fields FROM fields WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (key, size, mtime_ns),
+        ).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+    fields = _document_fields(_load_wrapper(path, ref))
+    outcome["new_fields"].append((key, size, mtime_ns, fields))
+    return fields
+
+def _extract_host(item: Dict) -> Dict:
+    """
+    Apply the quirks to one host's selected snapshots. Returns the CSV row
+    (or None if the host is skipped) along with everything the reports
+    need, so results from pool workers can be merged in host order and give
+    the same output as a serial run.
+    """
+    outcome = {
+        "row": None,
+        "messages": [],
+        "quirks": [],
+        "federation_disabled": False,
+        "minimum_version_skip": False,
+        "unknown": None,
+        "used_oldest": False,
+        "load_failed": False,
+        "new_fields": [],
+    }
+    quirks_by_software = _extractor["quirks_by_software"]
+    minimum_versions = _extractor["minimum_versions"]
 
     def bump_quirk(quirk: str) -> None:
-        quirk_report[quirk] = quirk_report.get(quirk, 0) + 1
-
-    with open(output_csv, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["hostname", "software", "users_total", "active_month", "protocols"])
-
-        for item in selected_files:
-            path = item["newest"]
-            try:
-                with open(path, "r", encoding="utf-8") as jf:
-                    wrapper = json.load(jf)
-            except Exception as e:
-                print(f"# Skipping {path}: {e}", file=sys.stderr)
-                continue
+        outcome["quirks"].append(quirk)
 
-            (
-                hostname,
-                software_name,
-                software_version,
-                users_total,
-                active_month,
-                protocols,
-                protocols_str,
-            ) = extract_fields(wrapper)
-            if str(hostname).lower() in ignore_domains:
-                continue
+    path = item["newest"]
+    try:
+        newest = _load_fields(item, "newest", outcome)
+    except Exception as e:
+        outcome["messages"].append(f"# Skipping {path}: {e}")
+        outcome["load_failed"] = True
+        return outcome
 
-            if _metadata_federation_disabled(wrapper):
-                federation_disabled_count += 1
-                continue
+    (
+        hostname,
+        software_name,
+        software_version,
+        users_total,
+        active_month,
+        protocols,
+        protocols_str,
+    ) = newest["fields"]
+    if str(hostname).lower() in _extractor["ignore_domains"]:
+        return outcome
 
-            if not protocols or not any(str(p).lower() == "activitypub" for p in protocols):
-                continue
-            software_key = (software_name or "").lower()
-            minimum_version = minimum_versions.get(software_key)
-            if minimum_version and not _version_meets_min(software_version, minimum_version):
-                minimum_version_skip_count += 1
-                continue
+    if newest["federation_disabled"]:
+        outcome["federation_disabled"] = True
+        return outcome
+
+    if not protocols or not any(str(p).lower() == "activitypub" for p in protocols):
+        return outcome
+    software_key = (software_name or "").lower()
+    minimum_version = minimum_versions.get(software_key)
+    if minimum_version and not _version_meets_min(software_version, minimum_version):
+        outcome["minimum_version_skip"] = True
+        return outcome
+
+    software_key, quirks = _get_quirks(
+        software_name,
+        quirks_by_software,
+        _extractor["misskey_forks"],
+        _extractor["pleroma_forks"],
+    )
 
-            software_key, quirks = _get_quirks(
-                software_name,
-                quirks_by_software,
-                misskey_forks,
-                pleroma_forks,
+    if quirks.get("no_monthly_users"):
+        bump_quirk("no_monthly_users_skip")
+        return outcome
+    if quirks.get("relay"):
+        bump_quirk("relay_skip")
+        return outcome
+    if quirks.get("conditional_no_monthly_users") and active_month is None:
+        bump_quirk("conditional_no_monthly_users_skip")
+        return outcome
+    if quirks.get("use_metadata_non_activitypub_users"):
+        bridge_users = newest["non_activitypub_users"]
+        users_total = bridge_users
+        active_month = bridge_users
+        bump_quirk("use_metadata_non_activitypub_users")
+    if quirks.get("detect_activity_from_posts"):
+        outcome["used_oldest"] = True
+        try:
+            oldest = _load_fields(item, "oldest", outcome)
+        except Exception:
+            outcome["load_failed"] = True
+            return outcome
+        oldest_posts = oldest["local_posts"]
+        newest_posts = newest["local_posts"]
+        if oldest_posts is None or newest_posts is None:
+            return outcome
+        if newest_posts > oldest_posts:
+            active_month = users_total
+            bump_quirk("detect_activity_from_posts_active")
+        else:
+            bump_quirk("detect_activity_from_posts_inactive")
+            return outcome
+    if quirks.get("detect_activity_from_posts_and_comments"):
+        outcome["used_oldest"] = True
+        try:
+            oldest = _load_fields(item, "oldest", outcome)
+        except Exception:
+            outcome["load_failed"] = True
+            return outcome
+        oldest_posts = oldest["local_posts"]
+        newest_posts = newest["local_posts"]
+        oldest_comments = oldest["local_comments"]
+        newest_comments = newest["local_comments"]
+        if (
+            oldest_posts is None
+            or newest_posts is None
+            or oldest_comments is None
+            or newest_comments is None
+        ):
+            return outcome
+        if newest_posts > oldest_posts or newest_comments > oldest_comments:
+            active_month = users_total
+            bump_quirk("detect_activity_from_posts_and_comments_active")
+        else:
+            bump_quirk("detect_activity_from_posts_and_comments_inactive")
+            return outcome
+    if quirks.get("monthly_from_total"):
+        active_month = users_total
+        bump_quirk("monthly_from_total")
+    if quirks.get("zero_monthly_skip") and active_month == 0:
+        bump_quirk("zero_monthly_skip")
+        return outcome
+    if (
+        (users_total is not None and users_total < 0)
+        or (active_month is not None and active_month < 0)
+    ):
+        outcome["messages"].append(
+            f"# Skipping {path}: negative users_total ({users_total}) or active_month ({active_month})"
+        )
+        return outcome
+    if software_key not in _extractor["configured_software"]:
+        outcome["unknown"] = (software_key or "(unknown)", active_month, users_total)
+
+    if active_month is not None and users_total is not None and active_month > users_total:
+        if quirks.get("cap_monthly_to_total"):
+            # Monthly users counts posters while total users counts enabled accounts.
+            active_month = users_total
+            bump_quirk("cap_monthly_to_total")
+        elif quirks.get("trust_monthly_gt_total"):
+            bump_quirk("trust_monthly_gt_total")
+            pass
+        else:
+            outcome["messages"].append(
+                f"# Skipping {path}: active_month ({active_month}) exceeds users_total ({users_total})"
             )
+            return outcome
+    if (
+        active_month is not None
+        and users_total is not None
+        and users_total > active_month
+        and quirks.get("cap_total_to_monthly")
+    ):
+        users_total = active_month
+        bump_quirk("cap_total_to_monthly")
 
-            if quirks.get("no_monthly_users"):
-                bump_quirk("no_monthly_users_skip")
-                continue
-            if quirks.get("relay"):
-                bump_quirk("relay_skip")
-                continue
-            if quirks.get("conditional_no_monthly_users") and active_month is None:
-                bump_quirk("conditional_no_monthly_users_skip")
-                continue
-            if quirks.get("use_metadata_non_activitypub_users"):
-                bridge_users = _extract_metadata_non_activitypub_users(wrapper)
-                users_total = bridge_users
-                active_month = bridge_users
-                bump_quirk("use_metadata_non_activitypub_users")
-            if quirks.get("detect_activity_from_posts"):
-                try:
-                    with open(item["oldest"], "r", encoding="utf-8") as jf:
-                        oldest_wrapper = json.load(jf)
-                except Exception:
-                    continue
-                oldest_posts = _extract_local_posts(oldest_wrapper)
-                newest_posts = _extract_local_posts(wrapper)
-                if oldest_posts is None or newest_posts is None:
-                    continue
-                if newest_posts > oldest_posts:
-                    active_month = users_total
-                    bump_quirk("detect_activity_from_posts_active")
-                else:
-                    bump_quirk("detect_activity_from_posts_inactive")
-                    continue
-            if quirks.get("detect_activity_from_posts_and_comments"):
-                try:
-                    with open(item["oldest"], "r", encoding="utf-8") as jf:
-                        oldest_wrapper = json.load(jf)
-                except Exception:
-                    continue
-                oldest_posts = _extract_local_posts(oldest_wrapper)
-                newest_posts = _extract_local_posts(wrapper)
-                oldest_comments = _extract_local_comments(oldest_wrapper)
-                newest_comments = _extract_local_comments(wrapper)
-                if (
-                    oldest_posts is None
-                    or newest_posts is None
-                    or oldest_comments is None
-                    or newest_comments is None
-                ):
+    outcome["row"] = [
+        hostname or "",
+        software_name or "",
+        users_total if users_total is not None else "",
+        active_month if active_month is not None else "",
+        protocols_str,
+    ]
+    return outcome
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Parse nodeinfo JSON into a CSV snapshot.",
+    )
+    parser.add_argument("nodeinfo_dir")
+    parser.add_argument("output_csv")
+    parser.add_argument("max_age_days", nargs="?", type=int, default=30)
+    parser.add_argument(
+        "--now",
+        type=_parse_now,
+        help="ISO-8601 datetime to use as the current time (UTC if naive).",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Snapshot manifest to use and update"
+             " (default: data/cache/parse-manifest-<id>.sqlite, one per nodeinfo_dir).",
+    )
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="Scan every host directory and extract every host, without reading or writing a manifest.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for extracting hosts (default: one per CPU; 1 to run serially).",
+    )
+    args = parser.parse_args()
+
+    nodeinfo_dir = args.nodeinfo_dir
+    output_csv = args.output_csv
+    max_age_days = args.max_age_days
+
+    cutoff = datetime.timedelta(days=max_age_days)
+    now = args.now or datetime.datetime.now(datetime.timezone.utc)
+
+    if args.no_manifest:
+        manifest = SnapshotManifest(":memory:")
+    else:
+        manifest_path = args.manifest or _default_manifest_path(nodeinfo_dir)
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+        manifest = SnapshotManifest(manifest_path)
+    listed = manifest.refresh(nodeinfo_dir)
+    now_us = _timestamp_us(now)
+    selected_files = manifest.select(
+        nodeinfo_dir, now_us - cutoff // datetime.timedelta(microseconds=1), now_us
+    )
+
+    # Hosts whose selected snapshots have not changed reuse their outcome;
+    # the oldest only matters to quirks that compare it with the newest
+    extractor_version = _extractor_version(nodeinfo_dir)
+    cached = {} if args.no_manifest else manifest.cached_outcomes(extractor_version)
+    reused: Dict[str, Dict] = {}
+    pending_files = []
+    for item in selected_files:
+        entry = cached.get(item["dir"])
+        if entry is not None:
+            newest, newest_stat, oldest, oldest_stat, outcome = entry
+            if newest == item["newest"] and newest_stat is not None \
+                    and newest_stat == _stat_key(item, "newest"):
+                if not outcome.get("used_oldest"):
+                    reused[item["dir"]] = outcome
                     continue
-                if newest_posts > oldest_posts or newest_comments > oldest_comments:
-                    active_month = users_total
-                    bump_quirk("detect_activity_from_posts_and_comments_active")
-                else:
-                    bump_quirk("detect_activity_from_posts_and_comments_inactive")
+                if oldest == item["oldest"] and oldest_stat is not None \
+                        and oldest_stat == _stat_key(item, "oldest"):
+                    reused[item["dir"]] = outcome
                     continue
-            if quirks.get("monthly_from_total"):
-                active_month = users_total
-                bump_quirk("monthly_from_total")
-            if quirks.get("zero_monthly_skip") and active_month == 0:
-                bump_quirk("zero_monthly_skip")
-                continue
-            if (
-                (users_total is not None and users_total < 0)
-                or (active_month is not None and active_month < 0)
-            ):
-                print(
-                    f"# Skipping {path}: negative users_total ({users_total}) or active_month ({active_month})",
-                    file=sys.stderr,
-                )
-                continue
-            if software_key not in configured_software:
-                report_entry = unknown_software_report.setdefault(
-                    software_key or "(unknown)",
-                    {"count": 0, "active_month_total": 0, "users_total_total": 0},
-                )
-                report_entry["count"] += 1
-                if isinstance(active_month, int):
-                    report_entry["active_month_total"] += active_month
-                if isinstance(users_total, int):
-                    report_entry["users_total_total"] += users_total
-
-            if active_month is not None and users_total is not None and active_month > users_total:
-                if quirks.get("cap_monthly_to_total"):
-                    # Monthly users counts posters while total users counts enabled accounts.
-                    active_month = users_total
-                    bump_quirk("cap_monthly_to_total")
-                elif quirks.get("trust_monthly_gt_total"):
-                    bump_quirk("trust_monthly_gt_total")
-                    pass
-                else:
-                    print(
-                        f"# Skipping {path}: active_month ({active_month}) exceeds users_total ({users_total})",
-                        file=sys.stderr,
+        if not args.no_manifest:
+            # Taken before extracting, so a file that changes meanwhile is
+            # extracted again next run
+            item["newest_stat"] = _stat_key(item, "newest")
+            item["oldest_stat"] = _stat_key(item, "oldest")
+        pending_files.append(item)
+    if not args.no_manifest:
+        print(
+            f"# Manifest {manifest.path}: listed {listed} changed directories,"
+            f" reusing {len(reused)} of {len(selected_files)} hosts",
+            file=sys.stderr,
+        )
+
+    unknown_software_report = {}
+    quirk_report = {}
+    federation_disabled_count = 0
+    minimum_version_skip_count = 0
+
+    fields_path = None
+    if not args.no_manifest:
+        manifest.prepare_fields(_fields_version())
+        fields_path = manifest.path
+
+    # Hosts are extracted in order, in chunks handed to a pool of workers
+    # when there are several jobs; results are merged in that same order.
+    pool = None
+    if args.jobs > 1 and len(pending_files) > 1:
+        pool = multiprocessing.Pool(
+            args.jobs, initializer=_init_extractor, initargs=(nodeinfo_dir, fields_path)
+        )
+        chunksize = max(1, min(256, len(pending_files) // (args.jobs * 4)))
+        extracted = pool.imap(_extract_host, pending_files, chunksize=chunksize)
+    else:
+        _init_extractor(nodeinfo_dir, fields_path)
+        extracted = map(_extract_host, pending_files)
+    new_outcomes = []
+    new_fields = []
+
+    try:
+        with open(output_csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["hostname", "software", "users_total", "active_month", "protocols"])
+
+            for item in selected_files:
+                outcome = reused.get(item["dir"])
+                if outcome is None:
+                    outcome = next(extracted)
+                    new_fields.extend(outcome.pop("new_fields"))
+                    if not args.no_manifest and not outcome["load_failed"]:
+                        new_outcomes.append((
+                            item["dir"],
+                            item["newest"],
+                            item["newest_stat"],
+                            item["oldest"],
+                            item["oldest_stat"],
+                            outcome,
+                        ))
+                for message in outcome["messages"]:
+                    print(message, file=sys.stderr)
+                for quirk in outcome["quirks"]:
+                    quirk_report[quirk] = quirk_report.get(quirk, 0) + 1
+                if outcome["federation_disabled"]:
+                    federation_disabled_count += 1
+                if outcome["minimum_version_skip"]:
+                    minimum_version_skip_count += 1
+                if outcome["unknown"] is not None:
+                    software_key, active_month, users_total = outcome["unknown"]
+                    report_entry = unknown_software_report.setdefault(
+                        software_key,
+                        {"count": 0, "active_month_total": 0, "users_total_total": 0},
                     )
-                    continue
-            if (
-                active_month is not None
-                and users_total is not None
-                and users_total > active_month
-                and quirks.get("cap_total_to_monthly")
-            ):
-                users_total = active_month
-                bump_quirk("cap_total_to_monthly")
-
-            writer.writerow([
-                hostname or "",
-                software_name or "",
-                users_total if users_total is not None else "",
-                active_month if active_month is not None else "",
-                protocols_str,
-            ])
+                    report_entry["count"] += 1
+                    if isinstance(active_month, int):
+                        report_entry["active_month_total"] += active_month
+                    if isinstance(users_total, int):
+                        report_entry["users_total_total"] += users_total
+                if outcome["row"] is not None:
+                    writer.writerow(outcome["row"])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            _close_extractor()
+    if not args.no_manifest:
+        manifest.store_fields(new_fields)
+        manifest.store_outcomes(new_outcomes)
+    manifest.close()
 
     if unknown_software_report:
         print("# Unknown software report (top 5):", file=sys.stderr)